@@ -26,6 +26,8 @@ class BicepHelperCommandLoad(AzCommandsLoader):
             group_command.custom_command("down", "down_handler", confirmation=True)
             group_command.custom_command("hook", "hook_handler", table_transformer=hooks_output_format)
             group_command.custom_command("test", "test_handler")
+        with self.command_group("cdf state", resource_type=ResourceType.MGMT_RESOURCE_RESOURCES) as group_command:
+            group_command.custom_command("migrate", "state_migrate_handler")
         with self.command_group("cdf debug", resource_type=ResourceType.MGMT_RESOURCE_RESOURCES) as group_command:
             group_command.custom_command("version", "debug_version_handler")
             group_command.custom_command("config", "debug_config_handler")
@@ -33,6 +35,7 @@ class BicepHelperCommandLoad(AzCommandsLoader):
             group_command.custom_command("state", "debug_state_handler")
             group_command.custom_command("interpolate", "debug_interpolate_handler")
             group_command.custom_command("errors", "debug_deployment_error_handler")
+            group_command.custom_command("cache", "debug_cache_handler")
         return self.command_table
 
     def load_arguments(self, command):
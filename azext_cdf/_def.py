@@ -1,5 +1,6 @@
 ''' Definition '''
 
+STATIC_PHASE = 0
 FIRST_PHASE = 1
 SECOND_PHASE = 2
 LIFECYCLE_PRE_UP, LIFECYCLE_POST_UP, LIFECYCLE_PRE_DOWN, LIFECYCLE_POST_DOWN = "pre-up", "post-up", "pre-down", "post-down"
@@ -12,6 +13,8 @@ RUNTIME_RESULT_RESOURCES = "resources"
 RUNTIME_HOOKS = "hooks"
 RUNTIME_RUN_ONCE_KEY = "once"
 RUNTIME_RUN_ONCE = "_ONCE_ONCE_"
+RUNTIME_STORE = "store"
+RUNTIME_SECOND_PHASE_VARS = (RUNTIME_RESULT, RUNTIME_HOOKS)
 # Config
 CONFIG_NAME = "name"
 CONFIG_RG = "resource_group"
@@ -21,6 +24,10 @@ CONFIG_SUPPORTED_PROVISIONERS = ('bicep', 'arm', 'terraform')
 CONFIG_PROVISIONER = "provisioner"
 CONFIG_SCOPE = "scope"
 CONFIG_TMP = "tmp_dir"
+CONFIG_TMP_DEFAULT_DIRNAME = ".cdf_tmp"
+CONFIG_TMP_DEFAULT = "{{cdf.config_dir}}/" + CONFIG_TMP_DEFAULT_DIRNAME
+CONFIG_CACHE_DIRNAME = "config"
+CONFIG_CACHE_FILENAME = "config_cache_{}.json"
 CONFIG_UP = "up"
 CONFIG_VARS = "vars"
 CONFIG_PARAMS = "params"
@@ -34,6 +41,9 @@ CONFIG_TYPE = "type"
 CONFIG_FILE = "file"
 CONFIG_DEPLOYMENT_COMPLETE = "complete_deployment"
 CONFIG_STATE_FILEPATH_DEFAULT = "file://{{ cdf.tmp_dir }}/state.json"
+CONFIG_STATE_FLUSH = "state_flush"
+CONFIG_STATE_DURABILITY = "state_durability"
+CONFIG_STATE_RETENTION = "state_retention"
 # CONFIG_STATE_FILENAME_DEFAULT = "state.json"
 CONFIG_CMD = "cmd"
 CONFIG_ARGS = "args"
@@ -70,9 +80,37 @@ STATE_PHASE = "phase"
 STATE_LASTUPDATE = "lastUpdate"
 STATE_STATUS = "status"
 STATE_EVENTS = "events"
+STATE_EVENTS_COUNT = "events_count"
+STATE_STATUS_EVENT = "status_event"
+STATE_EVENTS_LOG_COUNT = "events_log_count"
+STATE_EVENTS_LOG_OLDEST = "events_log_oldest"
 STATE_UP_RESULT = "result"
 STATE_UP_RESULT_OUTPUTS = "outputs"
 STATE_UP_RESULT_RESOURCES = "resources"
 STATE_HOOKS_RESULT = "hooks"
 STATE_VERSION = "version"
 STATE_STORE = "store"
+
+# When state changes are written, 'always' on every change, at the end of a 'hook' or at a 'phase' transition
+STATE_FLUSH_ALWAYS = "always"
+STATE_FLUSH_HOOK = "hook"
+STATE_FLUSH_PHASE = "phase"
+STATE_SUPPORTED_FLUSH = (STATE_FLUSH_ALWAYS, STATE_FLUSH_HOOK, STATE_FLUSH_PHASE)
+CONFIG_STATE_FLUSH_DEFAULT = STATE_FLUSH_HOOK
+
+# How state is written, 'none' in place, 'rename-only' to a temp file renamed over the state, 'fsync' renamed and synced to disk
+STATE_DURABILITY_NONE = "none"
+STATE_DURABILITY_RENAME = "rename-only"
+STATE_DURABILITY_FSYNC = "fsync"
+STATE_SUPPORTED_DURABILITY = (STATE_DURABILITY_NONE, STATE_DURABILITY_RENAME, STATE_DURABILITY_FSYNC)
+CONFIG_STATE_DURABILITY_DEFAULT = STATE_DURABILITY_FSYNC
+STATE_BACKUP_SUFFIX = ".bak"
+# Seconds a writer waits for the state lock held by another process
+CONFIG_STATE_LOCK_TIMEOUT = "state_lock_timeout"
+CONFIG_STATE_LOCK_TIMEOUT_DEFAULT = 300
+STATE_LOCK_SUFFIX = ".lock"
+
+# Events kept in the events log by count and age in days, older events are archived
+STATE_RETENTION_COUNT = "count"
+STATE_RETENTION_DAYS = "days"
+CONFIG_STATE_RETENTION_DEFAULT = {STATE_RETENTION_COUNT: 1000}
@@ -42,6 +42,30 @@ helps[
 ] = """
 type: command
 short-summary: Show status.
+examples:
+  - name: Show the newest 20 events.
+    text: az cdf status --events --limit 20
+  - name: Show events of the last 2 hours of a hook.
+    text: az cdf status --events --since 2h --hook my_hook
+  - name: Show events including archived events.
+    text: az cdf status --events --archived
+"""
+
+helps[
+    "cdf state"
+] = """
+type: group
+short-summary: Manage the CDF state.
+"""
+
+helps[
+    "cdf state migrate"
+] = """
+type: command
+short-summary: Copy the state and its events to a new state.
+examples:
+  - name: Migrate a json state to sqlite.
+    text: az cdf state migrate --to sqlite://.cdf_tmp/state.db
 """
 
 helps[
@@ -63,6 +87,15 @@ helps[
 ] = """
 type: command
 short-summary: Run an interactive session to test/debug your jinja2 expressions.
+long-summary: |
+    With --batch expressions are read from a file or stdin and interpolated without prompting.
+    Batch content is one expression per line, or a JSON/YAML list of expressions or map of name and expression.
+    The output is a JSON map of results and errors per expression.
+examples:
+    - name: Interpolate expressions from stdin
+      text: echo "{{ cdf.name }}" | az cdf debug interpolate --batch -
+    - name: Interpolate a YAML map of expressions in first phase
+      text: az cdf debug interpolate --batch expressions.yml --batch-format yaml --phase 1
 """
 
 helps[
@@ -92,3 +125,10 @@ helps[
 type: command
 short-summary: Print out results.
 """
+
+helps[
+    "cdf debug cache"
+] = """
+type: command
+short-summary: Print out template and file content cache statistics.
+"""
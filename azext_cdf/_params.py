@@ -5,7 +5,7 @@
 def load_arguments(self, _):
     with self.argument_context("cdf") as context:
         context.argument("config", options_list=["--config", "-c"], help="config file for cdf", default=".cdf.yml")
-        context.argument("working_dir", options_list=["--work-dir", "-w"], help="Change working directory", default=None)
+        context.argument("working_dir", options_list=["--work-dir", "-w"], help="Working directory, relative paths are resolved against it", default=None)
         context.argument("state_file", options_list=["--state", "-s"], help="State file", default=False)
 
     with self.argument_context("cdf init") as context:
@@ -23,9 +23,19 @@ def load_arguments(self, _):
 
     with self.argument_context("cdf status") as context:
         context.argument("events", options_list=["--events", "-e"], help="Print also events", default=False)
+        context.argument("limit", options_list=["--limit", "-l"], help="Print at most the newest limit events", type=int, default=None)
+        context.argument("since", options_list=["--since"], help="Print events since epoch seconds, a duration i.e. 30m, 2h, 1d or an ISO date time", default=None)
+        context.argument("phase", options_list=["--phase"], help="Print events of a phase", default=None)
+        context.argument("hook", options_list=["--hook"], help="Print events of a hook", default=None)
+        context.argument("archived", options_list=["--archived"], help="Include archived events", default=False)
+
+    with self.argument_context("cdf state migrate") as context:
+        context.argument("target", options_list=["--to", "-t"], help="New state i.e. 'sqlite://state.db', relative paths are resolved against the working directory")
 
     with self.argument_context("cdf debug interpolate") as context:
-        context.argument("phase", options_list=["--phase", "-p"], help="test your jinja2 expression", default=2)
+        context.argument("phase", options_list=["--phase", "-p"], help="test your jinja2 expression", type=int, choices=[1, 2], default=2)
+        context.argument("batch", options_list=["--batch", "-b"], help="Interpolate expressions from a file or '-' for stdin and print results as JSON", default=None)
+        context.argument("batch_format", options_list=["--batch-format", "-f"], help="Batch file format", choices=["lines", "json", "yaml"], default="lines")
 
     with self.argument_context("cdf hook") as context:
         context.positional("hook_args", nargs="*", help="Hook name to run.", default=None)
@@ -0,0 +1,113 @@
+''' Content addressed store for large hook op outputs '''
+
+import gzip
+import hashlib
+import os
+from knack.util import CLIError
+
+BLOBS_DIRNAME = "blobs"
+BLOB_MIN_BYTES = 4096  # smaller outputs are kept in the state
+BLOB_KEY = "blob"
+BLOB_SIZE_KEY = "size"
+
+
+def is_blob_ref(value):
+    ''' Return True if value is a reference to a blob i.e. {"blob": "<sha256>", "size": 1024} '''
+
+    return isinstance(value, dict) and set(value) == {BLOB_KEY, BLOB_SIZE_KEY}
+
+
+class BlobStore():
+    ''' Gzip compressed blobs named by the sha256 of their content '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _filepath(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.gz")
+
+    def put(self, content):
+        ''' Store content once and return its reference '''
+
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        filepath = self._filepath(digest)
+        if not os.path.exists(filepath):
+            tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                with open(tmp_filepath, "wb") as out_file:
+                    out_file.write(gzip.compress(data))
+                os.replace(tmp_filepath, filepath)
+            except OSError as error:
+                raise CLIError(f"Failed to write blob '{filepath}'. Error: {str(error)}") from error
+        return {BLOB_KEY: digest, BLOB_SIZE_KEY: len(data)}
+
+    def get(self, ref):
+        ''' Return the content of a blob reference '''
+
+        filepath = self._filepath(ref[BLOB_KEY])
+        try:
+            with gzip.open(filepath, "rb") as in_file:
+                return in_file.read().decode("utf-8")
+        except (OSError, EOFError) as error:
+            raise CLIError(f"Failed to read blob '{filepath}', was the tmp dir removed? Error: {str(error)}") from error
+
+    def prune(self, referenced):
+        ''' Remove blobs whose digest is not in referenced, returns the number of removed blobs '''
+
+        removed = 0
+        if not os.path.isdir(self.directory):
+            return removed
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".gz") and filename[:-len(".gz")] not in referenced:
+                    try:
+                        os.remove(os.path.join(dirpath, filename))
+                        removed += 1
+                    except OSError as error:
+                        raise CLIError(f"Failed to remove blob '{filename}'. Error: {str(error)}") from error
+        return removed
+
+    def externalize(self, op_data, min_bytes=BLOB_MIN_BYTES):
+        ''' Return op_data with string values of min_bytes or more replaced by blob references '''
+
+        return {
+            key: self.put(value) if isinstance(value, str) and len(value) >= min_bytes else value
+            for key, value in op_data.items()
+        }
+
+
+class BlobResult(dict):
+    '''
+    Read only view of an op result with blob references, a blob is read on first access of its key.
+    Mapping views, copies and json i.e. tojson resolve references to contents.
+    '''
+
+    def __init__(self, store, op_data):
+        super().__init__(op_data)
+        self._store = store
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if not is_blob_ref(value):
+            return value
+        if key not in self._loaded:
+            self._loaded[key] = self._store.get(value)
+        return self._loaded[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
@@ -0,0 +1,79 @@
+''' Blobs test'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from jinja2 import BaseLoader, StrictUndefined
+from azext_cdf.blobs import BlobStore, BlobResult
+from azext_cdf.state import State
+from azext_cdf.template import CDFEnvironment
+
+# pylint: disable=C0111
+
+
+class TestBlobs(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.store = BlobStore(f"{self.dirpath}/blobs")
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_put_get(self):
+        ref = self.store.put("x" * 100)
+        self.assertEqual(self.store.put("x" * 100), ref)  # stored once
+        self.assertEqual(ref["size"], 100)
+        self.assertEqual(self.store.get(ref), "x" * 100)
+        self.assertEqual(self.store.externalize({"stdout": "x" * 100, "stderr": "", "rc": 0}, min_bytes=10), {"stdout": ref, "stderr": "", "rc": 0})
+
+    def test_lazy_result(self):
+        result = BlobResult(self.store, {"stdout": self.store.put("out"), "stderr": ""})
+        with patch.object(self.store, "get", wraps=self.store.get) as mock_get:
+            env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined)
+            self.assertEqual(env.render("{{ op.stderr }}", {"op": result}), "")
+            mock_get.assert_not_called()
+            self.assertEqual(env.render("{{ op.stdout }}{{ op.get('stdout') }}", {"op": result}), "outout")
+            mock_get.assert_called_once()
+
+    def test_result_views(self):
+        result = BlobResult(self.store, {"stdout": self.store.put("out"), "rc": 0})
+        self.assertEqual(result.items(), [("stdout", "out"), ("rc", 0)])
+        self.assertEqual(result.values(), ["out", 0])
+        self.assertEqual(result.copy(), {"stdout": "out", "rc": 0})
+        env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined)
+        self.assertEqual(env.render("{{ op | tojson }}", {"op": result}), '{"rc": 0, "stdout": "out"}')  # sorted keys
+
+    def test_prune(self):
+        kept = self.store.put("kept")
+        self.store.put("removed")
+        self.assertEqual(self.store.prune({kept["blob"]}), 1)
+        self.assertEqual(self.store.get(kept), "kept")
+
+    def test_state(self):
+        blob_dir = f"{self.dirpath}/blobs"
+        state = State(f"file://{self.dirpath}/state.json", blob_dir=blob_dir)
+        state.setup("name", "rg", {"hello": {"op": {}}})
+        state.set_hook_state("hello", "op", {"stdout": "x" * 100000, "stderr": "err"})
+        self.assertLess(os.path.getsize(f"{self.dirpath}/state.json"), 4096)
+        state = State(f"file://{self.dirpath}/state.json", locking=False, blob_dir=blob_dir)
+        self.assertEqual(state.state["hooks"]["hello"]["op"]["stdout"]["size"], 100000)
+        self.assertEqual(state.result_hooks["hello"]["op"]["stdout"], "x" * 100000)
+        self.assertEqual(state.result_hooks["hello"]["op"]["stderr"], "err")
+
+    def test_state_prunes_replaced_blobs(self):
+        blob_dir = f"{self.dirpath}/blobs"
+        state = State(f"file://{self.dirpath}/state.json", blob_dir=blob_dir)
+        state.setup("name", "rg", {"hello": {"op": {}}})
+        state.set_hook_state("hello", "op", {"stdout": "x" * 10000})
+        state.set_hook_state("hello", "op", {"stdout": "y" * 10000})  # rerun
+        blobs = [filename for _, _, filenames in os.walk(blob_dir) for filename in filenames]
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(state.result_hooks["hello"]["op"]["stdout"], "y" * 10000)
+        with open(f"{self.dirpath}/state.json") as in_file:
+            self.assertNotIn("y" * 10000, in_file.read())  # views are not serialized
+
+
+if __name__ == '__main__':
+    unittest.main()
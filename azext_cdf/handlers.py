@@ -2,17 +2,21 @@
 
 import sys
 import os
+import re
+import time
 from collections import OrderedDict
+from datetime import datetime
+import yaml
 from knack.util import CLIError
 from knack.log import get_logger
 from azure.cli.command_modules.resource.custom import run_bicep_command
 from azure.cli.core.util import user_confirmation
 from azure.cli.core import __version__ as azure_cli_core_version
 from azext_cdf.version import VERSION
-from azext_cdf.utils import dir_change_working, json_load, file_read_content, file_exists, convert_to_list_if_need
+from azext_cdf.utils import json_load, file_read_content, file_exists
 from azext_cdf.utils import Progress, init_config
 from azext_cdf.hooks import run_hook
-from azext_cdf._def import STATE_PHASE_UP, STATE_STATUS_SUCCESS
+from azext_cdf._def import STATE_PHASE_UP, STATE_STATUS_SUCCESS, CONFIG_STATE_FILEPATH
 from azext_cdf.provisioner import de_provision, provision, check_deployment_error
 from azext_cdf.tester import run_test
 from azext_cdf.parser import ConfigParser
@@ -49,6 +53,15 @@ def debug_state_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, state_file
     return cobj.state.state
 
 
+def state_migrate_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, state_file=None, target=None):
+    ''' state migrate handler, copy the state and its events to a new state '''
+
+    cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file, lazy=True)
+    target_state = cobj.migrate_state(target)
+    _LOGGER.warning("Migrated state, set 'state: %s' in your config to use it", target)
+    return OrderedDict([("from", cobj.data[CONFIG_STATE_FILEPATH]), ("to", target), ("events", len(list(target_state.iter_events())))])
+
+
 def debug_result_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, state_file=None):
     ''' debug result handler, return results after up'''
 
@@ -56,6 +69,13 @@ def debug_result_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, state_fil
     return cobj.state.result_up
 
 
+def debug_cache_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, state_file=None):
+    ''' debug cache handler, return cache statistics after loading the config '''
+
+    cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file, state_locking=False)
+    return cobj.jinja_env.cache_stats
+
+
 def debug_deployment_error_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, state_file=None):
     ''' debug deployment error handler, return results last known deployment error '''
 
@@ -80,10 +100,46 @@ def debug_deployment_error_handler(cmd, config=CONFIG_DEFAULT, working_dir=None,
     return None
 
 
-def debug_interpolate_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, phase=2, state_file=None):
-    ''' debug interpolate handler, start an interactive jinja2 interpolation shell like '''
+def _read_batch_expressions(batch, batch_format):
+    ''' Return a dict of name and expression from a batch file or stdin '''
+
+    content = sys.stdin.read() if batch == "-" else file_read_content(batch)
+    if batch_format == "lines":
+        return {line: line for line in content.splitlines() if line.strip()}
+    if batch_format == "json":
+        document = json_load(content)
+    else:
+        try:
+            document = yaml.safe_load(content)
+        except yaml.YAMLError as error:
+            raise CLIError(f"Failed to parse YAML batch content. Error: {str(error)}") from error
+    if isinstance(document, dict):
+        return {str(name): expression for name, expression in document.items()}
+    if isinstance(document, list) and all(isinstance(expression, str) for expression in document):
+        return {expression: expression for expression in document}
+    raise CLIError("batch document should be a list of expressions or a map of name and expression")
+
+
+def _interpolate_batch(cobj, phase, expressions):
+    ''' Interpolate all expressions, returns results and errors keyed by expression name '''
+
+    results = {}
+    errors = {}
+    for name, expression in expressions.items():
+        try:
+            results[name] = cobj.interpolate(phase=phase, template=expression, context=f"batch expression '{name}'")
+        except CLIError as error:
+            errors[name] = str(error)
+    return {"results": results, "errors": errors}
+
+
+def debug_interpolate_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, phase=2, state_file=None, batch=None, batch_format="lines"):
+    ''' debug interpolate handler, start an interactive jinja2 interpolation shell like or interpolate a batch of expressions '''
 
+    expressions = _read_batch_expressions(batch, batch_format) if batch else None  # fail on a bad batch before opening the state
     cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file, state_locking=False)
+    if expressions is not None:
+        return _interpolate_batch(cobj, phase, expressions)
     line = ""
     print("Type your jinja2 expression.")
     print("to exit type 'quit' or 'exit' or 'ctrl+c'.")
@@ -95,9 +151,10 @@ def debug_interpolate_handler(cmd, config=CONFIG_DEFAULT, working_dir=None, phas
                 break
             print(cobj.interpolate(phase=phase, template=line))
         except EOFError:
-            return
+            return None
         except CLIError as error:
             print(f"Error : {str(error)}")
+    return None
 
 
 def init_handler(cmd, config=CONFIG_DEFAULT, force=False, example=False, working_dir=None, state_file=None):
@@ -111,18 +168,16 @@ def init_handler(cmd, config=CONFIG_DEFAULT, force=False, example=False, working
 def hook_handler(cmd, config=CONFIG_DEFAULT, hook_args=None, working_dir=None, confirm=False, state_file=None):
     """ hook handler function. list or run specific handler """
 
-    cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file)
+    cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file, lazy=True)
     if not hook_args:
         output_hooks = []
-        for key, value in cobj.get_hooks(format_list=False):
-            lifecycle = convert_to_list_if_need(value["lifecycle"])
-            output_hooks.append({"name": key, "description": value["description"], "lifecycle": lifecycle})
+        for hook in cobj.model.hooks.values():
+            output_hooks.append({"name": hook.name, "description": hook.description, "lifecycle": hook.lifecycle})
         return output_hooks
 
     hook_name = hook_args[0]  # hook is the first arg
-    hooks_names = cobj.get_hooks(format_list=True)
-    if hook_name not in hooks_names:
-        raise CLIError(f"unknown hook name '{hook_name}', Supported hooks '{hooks_names}")
+    if hook_name not in cobj.model.hooks:
+        raise CLIError(f"unknown hook name '{hook_name}', Supported hooks '{cobj.get_hooks(format_list=True)}")
     status = cobj.state.status
     if confirm:
         pass
@@ -134,13 +189,36 @@ def hook_handler(cmd, config=CONFIG_DEFAULT, hook_args=None, working_dir=None, c
     return None
 
 
-def status_handler(cmd, config=CONFIG_DEFAULT, events=False, working_dir=None, state_file=None):
+_SINCE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_since(since):
+    ''' Return epoch of since, epoch seconds, a relative duration i.e. 30m, 2h, 1d or an ISO date time '''
+
+    if since is None:
+        return None
+    try:
+        return float(since)
+    except ValueError:
+        pass
+    match = re.fullmatch(r"(\d+)([smhd])", since.strip())
+    if match:
+        return time.time() - int(match.group(1)) * _SINCE_UNITS[match.group(2)]
+    try:
+        return datetime.fromisoformat(since).timestamp()
+    except ValueError as error:
+        raise CLIError(f"Invalid --since '{since}', expected epoch seconds, a duration i.e. 30m, 2h, 1d or an ISO date time") from error
+
+
+def status_handler(cmd, config=CONFIG_DEFAULT, events=False, working_dir=None, state_file=None, limit=None, since=None, phase=None, hook=None, archived=False):
     """ status handler function, return status """
 
-    cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file, state_locking=False)
+    cobj, _ = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file, state_locking=False, lazy=True)
     output_status = {}
     if events:
-        output_status["events"] = cobj.state.events
+        if limit is not None and limit < 1:
+            raise CLIError("--limit should be greater than 0")
+        output_status["events"] = cobj.state.query_events(limit=limit, since=_parse_since(since), phase=phase, hook=hook, archived=archived)
     else:
         output_status = cobj.state.status
     return output_status
@@ -159,9 +237,7 @@ def up_handler(cmd, config=CONFIG_DEFAULT, remove_tmp=False, prompt=False, worki
 
     Progress(cmd, pseudo=True)  # hacky way to disable default progress animation
     if destroy:
-        cwd = os.getcwd()
         down_handler(cmd, config=config, remove_tmp=remove_tmp, working_dir=working_dir, state_file=state_file)
-        dir_change_working(cwd)
 
     cobj, _ = init_config(config, ConfigParser, remove_tmp=remove_tmp, working_dir=working_dir, state_file=state_file)
     provision(cmd, cobj)
@@ -175,14 +251,13 @@ def test_handler(cmd, config=CONFIG_DEFAULT, test_args=None, working_dir=None, s
 
     cobj = init_config(config, ConfigParser, remove_tmp=False, working_dir=working_dir, state_file=state_file)[0]
     Progress(cmd, pseudo=True)  # hacky way to disable default progress animation
-    dir_change_working(working_dir)
     if not test_args:
         test_args = cobj.tests
     for test in test_args:
         if test not in cobj.tests:
             raise CLIError(f"unknown test name '{test}', Supported tests '{cobj.tests}")
 
-    results = run_test(cmd, cobj, config, exit_on_error, test_args, working_dir, down_strategy, upgrade_strategy)
+    results = run_test(cmd, cobj, config, exit_on_error, test_args, down_strategy, upgrade_strategy)
     # print status to screen
     one_test_failed = False
     upgrade_failed = []
@@ -0,0 +1,51 @@
+''' Handlers test'''
+
+import io
+import unittest
+from mock import patch
+from knack.util import CLIError
+from azext_cdf.parser import ConfigParser
+from azext_cdf.handlers import _read_batch_expressions, _interpolate_batch
+from azext_cdf._supporter_test import BasicParser
+
+# pylint: disable=C0111
+
+
+class TestBatchInterpolate(BasicParser):
+    def _batch(self, content, batch_format):
+        batch_file = f"{self.dirpath}/batch.{batch_format}"
+        with open(batch_file, "w") as out_file:
+            out_file.write(content)
+        return _read_batch_expressions(batch_file, batch_format)
+
+    def test_lines(self):
+        expressions = self._batch("{{ cdf.name }}\n\n{{ cdf.location }}\n", "lines")
+        self.assertEqual(expressions, {"{{ cdf.name }}": "{{ cdf.name }}", "{{ cdf.location }}": "{{ cdf.location }}"})
+
+    def test_json(self):
+        self.assertEqual(self._batch('{"name": "{{ cdf.name }}"}', "json"), {"name": "{{ cdf.name }}"})
+        self.assertEqual(self._batch('["{{ cdf.name }}"]', "json"), {"{{ cdf.name }}": "{{ cdf.name }}"})
+
+    def test_yaml(self):
+        self.assertEqual(self._batch("name: '{{ cdf.name }}'\n1: '{{ cdf.location }}'\n", "yaml"), {"name": "{{ cdf.name }}", "1": "{{ cdf.location }}"})
+        with self.assertRaises(CLIError):
+            self._batch("name: [", "yaml")
+        with self.assertRaises(CLIError):
+            self._batch("- 1\n- 2\n", "yaml")
+
+    def test_stdin(self):
+        with patch("sys.stdin", io.StringIO("{{ cdf.name }}\n")):
+            self.assertEqual(_read_batch_expressions("-", "lines"), {"{{ cdf.name }}": "{{ cdf.name }}"})
+
+    @patch.object(ConfigParser, '_read_config')
+    def test_failing_expression(self, mock_read_config):
+        mock_read_config.return_value = self.config
+        cobj = ConfigParser(f"{self.dirpath}/config.yml", override_config=self.override_config, state_locking=False)
+        output = _interpolate_batch(cobj, 2, {"name": "{{ cdf.name }}", "undefined": "{{ undefined_var }}"})
+        self.assertEqual(output["results"], {"name": self.config["name"]})
+        self.assertEqual(list(output["errors"]), ["undefined"])
+        self.assertIn("'undefined_var' is undefined", output["errors"]["undefined"])
+
+
+if __name__ == '__main__':
+    unittest.main()
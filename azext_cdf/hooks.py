@@ -6,7 +6,7 @@ import stat
 from knack.util import CLIError
 from knack.log import get_logger
 from azext_cdf.utils import is_equal_or_in, file_read_content, file_write_content, run_command, convert_to_shlex_arg
-from azext_cdf._def import CONFIG_HOOKS, SECOND_PHASE, RUNTIME_RUN_ONCE, CONFIG_TYPE, CONFIG_NAME, CONFIG_ARGS
+from azext_cdf._def import CONFIG_HOOKS, SECOND_PHASE, RUNTIME_RUN_ONCE, CONFIG_TYPE, CONFIG_NAME, CONFIG_ARGS, STATE_FLUSH_HOOK
 
 _LOGGER = get_logger(__name__)
 
@@ -18,8 +18,8 @@ def run_hook_lifecycle(cobj, event):
     Loop through defined hooks and run all hooks attached to event.
     Returns: None
     """
-    for hook_name in cobj.data[CONFIG_HOOKS]:
-        if is_equal_or_in(event, cobj.data[CONFIG_HOOKS][hook_name]["lifecycle"]):
+    with cobj.state.batch():
+        for hook_name in cobj.model.hooks_for(event):
             _LOGGER.info("Hook event:%s triggered for hook:%s", event, hook_name)
             run_hook(cobj, [hook_name])
 
@@ -40,9 +40,12 @@ def run_hook(cobj, hook_args):
             return
         cobj.state.add_event("Finished running hook", hook=hook_name, flush=True)
         cobj.state.set_hook_state(hook_name, "_condition", {"ran": True}, flush=True)
+        cobj.update_hooks_result(cobj.state.result_hooks, hook=hook_name, op_name="_condition")
     except CLIError as error:
         cobj.state.add_event(f"Error during hook execution {str(error)}", hook=hook_name, flush=True)
         raise
+    finally:
+        cobj.state.checkpoint(STATE_FLUSH_HOOK)
 
 
 def _recursion_limit(recursion_n, hook_name):
@@ -74,6 +77,7 @@ def _run_hook(cobj, hook_args, recursion_n=1, root_vars=None):
 
         op_args = cobj.interpolate(phase=SECOND_PHASE, template=operation[CONFIG_ARGS], root_vars=root_vars, context=f"az-cli op interpolation '{ops_name}' in hook '{hook_name}'")
         op_cwd = cobj.interpolate(phase=SECOND_PHASE, template=operation.get("cwd", None), root_vars=root_vars, context=f"az-cli cwd interpolation '{ops_name}' in hook '{hook_name}'")
+        op_cwd = cobj.resolve_path(op_cwd) if op_cwd else cobj.working_dir
         interactive = operation.get("mode") == "interactive"
         if operation[CONFIG_TYPE] == "az":
             stdout, stderr = _run_az(hook_name, ops_name, op_args, cwd=op_cwd)
@@ -89,7 +93,7 @@ def _run_hook(cobj, hook_args, recursion_n=1, root_vars=None):
 
         if operation.get(CONFIG_NAME, False):
             cobj.state.set_hook_state(hook=hook_name, op_name=operation[CONFIG_NAME], op_data={"stdout": stdout, "stderr": stderr}, flush=True)
-            cobj.update_hooks_result(cobj.state.result_hooks)
+            cobj.update_hooks_result(cobj.state.result_hooks, hook=hook_name, op_name=operation[CONFIG_NAME])
     return True
 
 
@@ -117,9 +121,9 @@ def _run_az(hook_name, ops_name, op_args, cwd):
 
 def _run_script(hook_name, ops_name, op_args, hook_args, cobj, cwd):
     op_args = convert_to_shlex_arg(op_args)
-    filename = op_args[0]
+    filename = cobj.resolve_path(op_args[0])
     target_file = f"{cobj.tmp_dir}/{os.path.basename(filename)}"
-    content = file_read_content(op_args[0])
+    content = file_read_content(filename)
     content = cobj.interpolate(SECOND_PHASE, content, f"interpolating script op {op_args[0]}")
     file_write_content(target_file, content)
     os.chmod(target_file, stat.S_IRUSR | stat.S_IEXEC | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)  # make file exec
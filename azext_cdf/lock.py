@@ -0,0 +1,147 @@
+''' Advisory file locks shared by readers and exclusive for writers '''
+
+import os
+import time
+from knack.util import CLIError
+from knack.log import get_logger
+
+try:
+    import fcntl
+    msvcrt = None  # pylint: disable=invalid-name
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt  # pylint: disable=import-error
+
+_LOGGER = get_logger(__name__)
+
+LOCK_POLL_MIN = 0.05
+LOCK_POLL_MAX = 1.0
+
+_HELD = {}  # lock file path -> {"file", "exclusive", "count"} held by this process
+
+
+def _try_lock(lock_file, exclusive):
+    try:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        else:  # no shared locks on windows, readers are exclusive too
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(lock_file):
+    if fcntl:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _holder_pid(filepath):
+    ''' Return the PID of the exclusive holder written in the lock file if any '''
+
+    try:
+        with open(filepath, encoding="utf-8") as in_file:
+            return int(in_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _holder(lock_file, filepath, upgrade):
+    ''' Return who holds a contended lock, readers don't write their PID '''
+
+    if upgrade:  # this process holds a shared lock, only readers can hold it too
+        return " by a reader"
+    if fcntl and _try_lock(lock_file, False):  # only readers hold it if a shared lock is granted
+        _unlock(lock_file)
+        return " by a reader"
+    pid = _holder_pid(filepath)
+    return f" by PID {pid}" if pid else ""
+
+
+class FileLock():
+    '''
+    Advisory lock on a lock file, shared or exclusive.
+    Contending locks are retried until timeout seconds, locks are reentrant within a process.
+    '''
+
+    def __init__(self, filepath, timeout=0):
+        self.filepath = os.path.abspath(filepath)
+        self.timeout = timeout
+        self.held = False
+
+    @property
+    def exclusive(self):
+        ''' True if this process holds the lock exclusively '''
+
+        entry = _HELD.get(self.filepath)
+        return bool(self.held and entry and entry["exclusive"])
+
+    def _wait(self, lock_file, exclusive, upgrade=False):
+        deadline = time.monotonic() + self.timeout
+        delay = LOCK_POLL_MIN
+        waiting = False
+        while not _try_lock(lock_file, exclusive):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                holder = _holder(lock_file, self.filepath, upgrade)
+                raise CLIError(f"State is locked{holder}, timed out after {self.timeout} seconds waiting for '{self.filepath}'")
+            if not waiting:
+                _LOGGER.warning("Waiting for lock '%s' held by another process", self.filepath)
+                waiting = True
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, LOCK_POLL_MAX)
+        if exclusive:
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+
+    def acquire(self, exclusive=True):
+        '''
+        Acquire the lock, a shared lock held by this process is upgraded if exclusive.
+        The upgrade is not atomic, another process may take and release the lock in between, read the locked file after acquire.
+        '''
+
+        entry = _HELD.get(self.filepath)
+        if entry is None:
+            try:
+                lock_file = open(self.filepath, "a+", encoding="utf-8")  # pylint: disable=consider-using-with
+            except OSError as error:
+                raise CLIError(f"Failed to open lock file '{self.filepath}'. Error: {str(error)}") from error
+            try:
+                self._wait(lock_file, exclusive)
+            except CLIError:
+                lock_file.close()
+                raise
+            entry = _HELD[self.filepath] = {"file": lock_file, "exclusive": exclusive, "count": 0}
+        elif exclusive and not entry["exclusive"]:
+            self._wait(entry["file"], True, upgrade=True)
+            entry["exclusive"] = True
+        if not self.held:
+            entry["count"] += 1
+            self.held = True
+
+    def release(self):
+        ''' Release the lock, the lock file is unlocked once no lock of this process holds it '''
+
+        entry = _HELD.get(self.filepath)
+        if not self.held or entry is None:
+            return
+        self.held = False
+        entry["count"] -= 1
+        if entry["count"] > 0:
+            return
+        del _HELD[self.filepath]
+        try:
+            if entry["exclusive"]:  # a PID left in the file would be blamed for locks held by readers
+                entry["file"].seek(0)
+                entry["file"].truncate()
+                entry["file"].flush()
+            _unlock(entry["file"])
+        except OSError as error:
+            _LOGGER.debug("Failed to unlock '%s'. %s", self.filepath, str(error))
+        entry["file"].close()
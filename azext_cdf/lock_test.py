@@ -0,0 +1,117 @@
+''' Lock test'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from knack.util import CLIError
+from azext_cdf.lock import FileLock
+from azext_cdf.state import State
+
+# pylint: disable=C0111
+
+_HOLD_LOCK = '''
+import sys, time
+from azext_cdf.lock import FileLock
+lock = FileLock(sys.argv[1])
+lock.acquire(exclusive=sys.argv[2] == "exclusive")
+print("locked", flush=True)
+time.sleep(float(sys.argv[3]))
+lock.release()
+'''
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.filepath = f"{self.dirpath}/state.json.lock"
+        self.process = None
+
+    def tearDown(self):
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.dirpath)
+
+    def _hold(self, mode, seconds):
+        env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-c", _HOLD_LOCK, self.filepath, mode, str(seconds)], stdout=subprocess.PIPE, env=env, universal_newlines=True
+        )
+        self.assertEqual(self.process.stdout.readline().strip(), "locked")
+
+    def test_reentrant(self):
+        first = FileLock(self.filepath)
+        second = FileLock(self.filepath)
+        first.acquire(exclusive=False)
+        second.acquire(exclusive=True)  # upgraded
+        self.assertTrue(first.exclusive)
+        second.release()
+        self.assertTrue(first.exclusive)
+        first.release()
+        self.assertFalse(first.exclusive)
+
+    @unittest.skipIf(sys.platform == "win32", "no shared locks on windows")
+    def test_shared(self):
+        lock = FileLock(self.filepath)
+        lock.acquire(exclusive=True)  # a previous writer
+        lock.release()
+        self._hold("shared", 10)
+        lock.acquire(exclusive=False)
+        lock.release()
+        with self.assertRaises(CLIError) as error:
+            lock.acquire(exclusive=True)
+        self.assertIn("locked by a reader", str(error.exception))
+
+    def test_exclusive_waits(self):
+        self._hold("exclusive", 0.5)
+        with self.assertRaises(CLIError) as error:
+            FileLock(self.filepath).acquire()
+        self.assertIn(f"PID {self.process.pid}", str(error.exception))
+        start = time.monotonic()
+        lock = FileLock(self.filepath, timeout=30)
+        lock.acquire()
+        self.assertLess(time.monotonic() - start, 30)
+        lock.release()
+
+    def test_state_reader(self):
+        state_file = f"{self.dirpath}/state.json"
+        State(f"file://{state_file}").close()
+        self._hold("exclusive", 10)
+        with self.assertRaises(CLIError):
+            State(f"file://{state_file}")
+        state = State(f"file://{state_file}", locking=False, ignore_lock_error=True)  # reads the last written state
+        self.assertEqual(state.status["StatusMessage"], "Created a state file")
+
+    def test_reader_releases_lock(self):
+        state_file = f"{self.dirpath}/state.json"
+        State(f"file://{state_file}").close()
+        state = State(f"file://{state_file}", locking=False)
+        self._hold("exclusive", 10)  # a writer isn't blocked by the open reader
+        self.assertEqual(state.status["StatusMessage"], "Created a state file")
+
+    def test_reader_does_not_write(self):
+        state_file = f"{self.dirpath}/state.json"
+        events = [{"timestamp": "t", "phase": "up", "msg": "legacy", "status": None, "hook": None}]
+        with open(state_file, "w") as out_file:
+            json.dump({"name": None, "phase": "up", "lastUpdate": "t", "status": 0, "events": events, "version": "0.0.1", "store": {},
+                       "hooks": {}, "resource_group": None, "result": {}}, out_file)
+        with open(state_file) as in_file:
+            content = in_file.read()
+        self._hold("exclusive", 10)  # a writer
+        state = State(f"file://{state_file}", locking=False, ignore_lock_error=True)
+        self.assertEqual(state.status["StatusMessage"], "legacy")  # upgraded in memory
+        self.assertEqual(state.store_get("key", "value"), "value")
+        self.assertFalse(state.writable)
+        state.close()
+        with open(state_file) as in_file:
+            self.assertEqual(in_file.read(), content)
+        self.assertFalse(os.path.exists(f"{self.dirpath}/state.events.jsonl"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+''' Template functions that look up external data i.e. http_get and az_query '''
+
+import os
+import io
+import json
+import time
+import hashlib
+import requests
+from jinja2 import contextfunction  # pass_context
+from knack.util import CLIError
+from knack.log import get_logger
+from azure.cli.core import get_default_cli
+from azext_cdf.utils import convert_to_shlex_arg, dir_create, file_write_content, http_session, HTTP_TIMEOUT
+
+_LOGGER = get_logger(__name__)
+
+LOOKUPS_DIRNAME = "lookups"
+
+
+def _tmp_dir(ctx):
+    cdf = ctx.resolve("cdf")
+    return cdf.get("tmp_dir") if isinstance(cdf, dict) else None
+
+
+class Lookups():
+    '''
+    Lookup functions exposed to templates.
+    Results are memoized for the life of this object, results with a ttl (seconds) are also saved in 'cdf.tmp_dir' and reused by following runs until they expire.
+    '''
+
+    def __init__(self):
+        self._memo = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_filepath(self, tmp_dir, key):
+        return os.path.join(tmp_dir, LOOKUPS_DIRNAME, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _get(self, key, tmp_dir, ttl):
+        entry = self._memo.get(key)
+        if entry is None and ttl and tmp_dir:
+            try:
+                with open(self._cache_filepath(tmp_dir, key), encoding="utf-8") as in_file:
+                    entry = json.load(in_file)
+            except (OSError, ValueError):
+                entry = None
+        if entry is None or (entry["expires"] is not None and entry["expires"] < time.time()):
+            self.misses += 1
+            return False, None
+        self._memo[key] = entry
+        self.hits += 1
+        return True, entry["value"]
+
+    def _put(self, key, tmp_dir, ttl, value):
+        entry = {"expires": time.time() + ttl if ttl else None, "value": value}
+        self._memo[key] = entry
+        if not ttl or not tmp_dir:
+            return
+        filepath = self._cache_filepath(tmp_dir, key)
+        try:
+            dir_create(os.path.dirname(filepath))
+            file_write_content(filepath, json.dumps(entry, default=str))
+        except CLIError as error:
+            _LOGGER.debug("Failed to save lookup result. %s", str(error))
+
+    @contextfunction
+    def http_get(self, ctx, url, parse_json=False, headers=None, ttl=None, timeout=HTTP_TIMEOUT):
+        ''' Return content of url as text or parsed json '''
+
+        key = json.dumps(["http_get", url, parse_json, headers], sort_keys=True)
+        tmp_dir = _tmp_dir(ctx)
+        found, value = self._get(key, tmp_dir, ttl)
+        if found:
+            return value
+        try:
+            response = http_session().get(url, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            value = response.json() if parse_json else response.text
+        except (requests.RequestException, ValueError) as error:
+            raise CLIError(f"http_get failed for '{url}'. Error: {str(error)}") from error
+        self._put(key, tmp_dir, ttl, value)
+        return value
+
+    @contextfunction
+    def az_query(self, ctx, args, query=None, ttl=None):
+        ''' Run an az command in process and return its parsed json output, query is a JMESPath query '''
+
+        args = list(convert_to_shlex_arg(args))
+        if query:
+            args += ["--query", query]
+        key = json.dumps(["az_query", args], sort_keys=True)
+        tmp_dir = _tmp_dir(ctx)
+        found, value = self._get(key, tmp_dir, ttl)
+        if found:
+            return value
+        cli = get_default_cli()
+        exit_code = cli.invoke(args + ["--output", "json"], out_file=io.StringIO())
+        if exit_code:
+            raise CLIError(f"az_query failed for 'az {' '.join(args)}' exit code {exit_code}")
+        value = cli.result.result if cli.result else None
+        self._put(key, tmp_dir, ttl, value)
+        return value
+
+    @property
+    def stats(self):
+        ''' Return cache counters '''
+
+        return {"size": len(self._memo), "hits": self.hits, "misses": self.misses}
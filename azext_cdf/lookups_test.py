@@ -0,0 +1,103 @@
+''' Lookups test'''
+
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from jinja2 import BaseLoader, StrictUndefined
+from mock import patch, MagicMock
+from knack.util import CLIError
+from azext_cdf.lookups import Lookups
+from azext_cdf.template import CDFEnvironment
+
+# pylint: disable=C0111
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        _Handler.requests += 1
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path, "items": [1, 2]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestLookups(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _Handler.requests = 0
+        self.dirpath = tempfile.mkdtemp()
+        self.env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined)
+        self._set_lookups(Lookups())
+        self.scope = {"cdf": {"tmp_dir": self.dirpath}, "url": self.url}
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def _set_lookups(self, lookups):
+        self.lookups = lookups
+        self.env.globals["http_get"] = lookups.http_get
+        self.env.globals["az_query"] = lookups.az_query
+
+    def test_http_get_memoized(self):
+        self.assertEqual(self.env.render("{{ http_get(url ~ '/a', parse_json=True)['items'][1] }}", self.scope), "2")
+        self.assertEqual(json.loads(self.env.render("{{ http_get(url ~ '/a') }}", self.scope))["path"], "/a")
+        self.assertEqual(self.env.render("{{ http_get(url ~ '/a', parse_json=True).path }}", self.scope), "/a")
+        self.assertEqual(_Handler.requests, 2)  # text and json are cached separately
+        self.assertEqual(self.lookups.stats, {"size": 2, "hits": 1, "misses": 2})
+        with self.assertRaises(CLIError):
+            self.env.render("{{ http_get(url ~ '/missing') }}", self.scope)
+
+    def test_http_get_ttl(self):
+        template = "{{ http_get(url ~ '/ttl', parse_json=True, ttl=60).path }}"
+        self.assertEqual(self.env.render(template, self.scope), "/ttl")
+        self._set_lookups(Lookups())  # next run reuses the result saved in tmp dir
+        self.assertEqual(self.env.render(template, self.scope), "/ttl")
+        self.assertEqual(_Handler.requests, 1)
+        with patch("azext_cdf.lookups.time") as mock_time:
+            mock_time.time.return_value = 1e12  # expired
+            self._set_lookups(Lookups())
+            self.env.render(template, self.scope)
+        self.assertEqual(_Handler.requests, 2)
+
+    @patch("azext_cdf.lookups.get_default_cli")
+    def test_az_query(self, mock_cli):
+        cli = MagicMock()
+        cli.invoke.return_value = 0
+        cli.result.result = "rg-id"
+        mock_cli.return_value = cli
+        template = "{{ az_query('group show -n \\'my rg\\'', query='id') }}"
+        self.assertEqual(self.env.render(template, self.scope), "rg-id")
+        self.assertEqual(self.env.render(template, self.scope), "rg-id")
+        self.assertEqual(cli.invoke.call_count, 1)
+        self.assertEqual(cli.invoke.call_args[0][0], ["group", "show", "-n", "my rg", "--query", "id", "--output", "json"])
+        cli.invoke.return_value = 1
+        with self.assertRaises(CLIError):
+            self.env.render("{{ az_query(['group', 'list']) }}", self.scope)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+''' Indexed config model built once from the validated config '''
+
+from azext_cdf.utils import convert_to_list_if_need
+# pylint: disable=W0401,W0614
+from azext_cdf._def import *
+# pylint: disable=too-few-public-methods
+
+
+class Op():
+    ''' Hook operation '''
+
+    __slots__ = ("name", "type", "args", "platform", "data")
+
+    def __init__(self, data):
+        self.name = data.get(CONFIG_NAME)
+        self.type = data.get(CONFIG_TYPE)
+        self.args = data.get(CONFIG_ARGS)
+        self.platform = data.get("platform")
+        self.data = data
+
+
+class Hook():
+    ''' Hook with its ops and named ops index '''
+
+    __slots__ = ("name", "description", "lifecycle", "ops", "named_ops", "data")
+
+    def __init__(self, name, data):
+        self.name = name
+        self.description = data.get(CONFIG_DESCRIPTION)
+        self.lifecycle = convert_to_list_if_need(data.get("lifecycle"))
+        self.ops = tuple(Op(op_data) for op_data in data["ops"])
+        self.named_ops = {}
+        for operation in self.ops:
+            if operation.name and operation.name not in self.named_ops:
+                self.named_ops[operation.name] = operation
+        self.data = data
+
+
+class Upgrade():
+    ''' Upgrade path '''
+
+    __slots__ = ("name", "type", "from_expect", "data")
+
+    def __init__(self, data):
+        self.name = data.get(CONFIG_NAME)
+        self.type = data.get(CONFIG_TYPE)
+        self.from_expect = data.get("from_expect")
+        self.data = data
+
+
+class Test():
+    ''' Test with expectations indexed by up, down and hook name '''
+
+    __slots__ = ("name", "expect", "expect_hooks", "hook_names", "upgrades", "data")
+
+    def __init__(self, name, data):
+        self.name = name
+        self.expect = data.get(CONFIG_EXPECT, {})
+        self.expect_hooks = {}
+        hook_names = []
+        for expect_hook in self.expect.get(CONFIG_HOOKS, []):
+            for hook_name, expect_obj in expect_hook.items():
+                self.expect_hooks.setdefault(hook_name, expect_obj)  # first expectation wins
+            hook_names.append(next(iter(expect_hook)))
+        self.hook_names = tuple(hook_names)
+        self.upgrades = tuple(Upgrade(upgrade) for upgrade in data.get(CONFIG_UPGRADE, []))
+        self.data = data
+
+
+class ConfigModel():
+    '''
+    Hooks, ops, tests and upgrades of a config with name indexes and a lifecycle index.
+    Hooks are reused from previous model if built from the same hooks config.
+    '''
+
+    __slots__ = ("hooks", "lifecycle", "tests", "upgrades", "_hooks_data")
+
+    def __init__(self, data, previous=None):
+        hooks_data = data.get(CONFIG_HOOKS, {})
+        if previous is not None and previous._hooks_data is hooks_data:  # pylint: disable=protected-access
+            self.hooks = previous.hooks
+            self.lifecycle = previous.lifecycle
+        else:
+            self.hooks = {name: Hook(name, hook_data) for name, hook_data in hooks_data.items()}
+            self.lifecycle = {}
+            for hook in self.hooks.values():
+                for event in dict.fromkeys(hook.lifecycle):
+                    self.lifecycle.setdefault(event, []).append(hook.name)
+        self._hooks_data = hooks_data
+        self.tests = {name: Test(name, test_data) for name, test_data in data.get(CONFIG_TESTS, {}).items()}
+        self.upgrades = tuple(Upgrade(upgrade) for upgrade in data.get(CONFIG_UPGRADE, []))
+
+    def hooks_for(self, event):
+        ''' Return hook names attached to a lifecycle event in config order '''
+
+        return self.lifecycle.get(event, [])
+
+    @property
+    def hook_ops(self):
+        ''' Return named ops per hook, hook name -> op name -> Op '''
+
+        return {name: hook.named_ops for name, hook in self.hooks.items()}
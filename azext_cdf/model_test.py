@@ -0,0 +1,43 @@
+''' Model test'''
+
+import unittest
+from azext_cdf.model import ConfigModel
+
+# pylint: disable=C0111
+
+
+class TestConfigModel(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            "hooks": {
+                "a": {"ops": [{"name": "one", "args": "x"}, {"args": "y"}], "lifecycle": ["post-up", "pre-down"], "description": "a"},
+                "b": {"ops": [{"name": "two", "type": "call", "args": "a"}], "lifecycle": "post-up", "description": "b"},
+                "c": {"ops": [{"args": "z"}], "lifecycle": "", "description": "c"},
+            },
+            "tests": {
+                "default": {"expect": {"up": {"fail": True}, "hooks": [{"b": {"assert": "1"}}, {"a": {"assert": "2"}}, {"b": {"assert": "3"}}]}},
+                "empty": {},
+            },
+        }
+
+    def test_indexes(self):
+        model = ConfigModel(self.config)
+        self.assertEqual(model.hooks_for("post-up"), ["a", "b"])
+        self.assertEqual(model.hooks_for("pre-down"), ["a"])
+        self.assertEqual(model.hooks_for("pre-up"), [])
+        self.assertEqual(model.hook_ops, {"a": {"one": model.hooks["a"].ops[0]}, "b": {"two": model.hooks["b"].ops[0]}, "c": {}})
+        test = model.tests["default"]
+        self.assertEqual(test.hook_names, ("b", "a", "b"))
+        self.assertEqual(test.expect_hooks["b"], {"assert": "1"})
+        self.assertEqual(test.expect["up"], {"fail": True})
+        self.assertEqual(model.tests["empty"].hook_names, ())
+
+    def test_hooks_reused(self):
+        model = ConfigModel(self.config)
+        overlay = {**self.config, "tests": {}}
+        self.assertIs(ConfigModel(overlay, previous=model).hooks, model.hooks)
+        self.assertIsNot(ConfigModel({**self.config, "hooks": {}}, previous=model).hooks, model.hooks)
+
+
+if __name__ == '__main__':
+    unittest.main()
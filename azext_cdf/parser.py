@@ -1,72 +1,172 @@
 """ Configuration module"""
 
 import os
+import hashlib
+import json
+from collections import ChainMap
+from copy import copy
+from functools import partial
 import platform
 import yaml
-from schema import Schema, SchemaError, SchemaMissingKeyError, SchemaWrongKeyError
+from schema import SchemaError, SchemaMissingKeyError, SchemaWrongKeyError
 
 from knack.util import CLIError
-from jinja2 import Environment, BaseLoader, StrictUndefined, Template, contextfunction  # pass_context
+from knack.log import get_logger
+from jinja2 import BaseLoader, StrictUndefined, contextfunction  # pass_context
 from jinja2.exceptions import UndefinedError, TemplateSyntaxError, TemplateRuntimeError
 from azext_cdf.version import VERSION
-from azext_cdf.utils import dir_create, dir_remove, real_dirname, random_string, convert_to_list_if_need, dir_change_working
+from azext_cdf.utils import dir_create, dir_remove, real_dirname, random_string, convert_to_list_if_need
+from azext_cdf.utils import file_hash, file_read_content, file_write_atomic, json_load
 from azext_cdf.state import State
-from azext_cdf.parser_schema import MAIN_SCHEMA
+from azext_cdf.parser_schema import MAIN_SCHEMA, TEST_SCHEMA
+from azext_cdf.parser_validator import CompiledSchema
+from azext_cdf.model import ConfigModel, Test
+from azext_cdf.lookups import Lookups
+from azext_cdf.blobs import BLOBS_DIRNAME
+from azext_cdf.template import CDFEnvironment, FILE_CACHE, cdf_cache_dir, needs_rendering, shared_bytecode_cache
 # pylint: disable=W0401,W0614
 from azext_cdf._def import *
 
+_LOGGER = get_logger(__name__)
+_MAIN_VALIDATOR = CompiledSchema(MAIN_SCHEMA)
+_TEST_VALIDATOR = CompiledSchema(TEST_SCHEMA)
+# Variable roots that can change after first use and the depth of the paths tracked for them i.e. hooks.<hook>.<op>
+_MEMO_TRACKED_DEPTH = {CONFIG_CDF: 2, CONFIG_VARS: 2, RUNTIME_RESULT: 1, RUNTIME_HOOKS: 3}
+# Variable roots that do not change after setup, any other variable (env, store, functions, ...) disables memoization
+_MEMO_STABLE = frozenset((CONFIG_PARAMS, RUNTIME_RUN_ONCE_KEY))
+# Filters that return a different value per call, globals i.e. random_string, http_get and az_query are never tracked
+_MEMO_IMPURE_FILTERS = frozenset(("random",))
 
-def _include_file(name):
+
+def _include_file(base_dir, name):
     try:
-        with open(name) as in_file:
-            return in_file.read()
+        return FILE_CACHE.read(os.path.join(base_dir, name))
     except Exception as error:
         raise CLIError(f"include_file filter argument '{name}' error. {str(error)}") from error
 
 
-# @pass_context
-@contextfunction
-def _template_file(ctx, name):
+def _template_file(base_dir, ctx, name):
     try:
-        data = _include_file(name)
-        return Template(data, undefined=StrictUndefined).render(ctx)
+        data = _include_file(base_dir, name)
+        return ctx.environment.render(data, ChainMap(ctx.vars, ctx.parent))
 
     except Exception as error:
         raise CLIError(f"template_file filter argument '{name}' error. {str(error)}") from error
-    return data
+
+
+def _template_strings(template):
+    ''' Yield all strings in a template object that need rendering '''
+
+    if isinstance(template, str):
+        if needs_rendering(template):
+            yield template
+    elif isinstance(template, list):
+        for template_item in template:
+            yield from _template_strings(template_item)
+    elif isinstance(template, dict):
+        for template_item in template.values():
+            yield from _template_strings(template_item)
 
 
 class ConfigParser:
     '''  CDF yaml config parser class '''
-    def __init__(self, config_filepath, remove_tmp=False, test=None, working_dir=None, override_config=None, state_locking=True):
+    def __init__(self, config_filepath, remove_tmp=False, test=None, working_dir=None, override_config=None, state_locking=True, lazy=False):
+        self.jinja_env = None
+        self.cwd = os.getcwd()
+        self.working_dir = os.path.realpath(working_dir) if working_dir else self.cwd  # relative paths are resolved against it
+        config_filepath = self.resolve_path(config_filepath)
+        self.config_filepath = config_filepath
+        self._document = {}  # parsed and validated config, shared with forks and never modified
+        self._loaded_tests = {}  # tests loaded from their own file, shared with forks
+        self._plan = {}
+        self._memo_dependencies = {}
+        self.model = None
+        self._init_instance(test, remove_tmp, state_locking)
+        self._setup_jinja2()
+        self._setup_pre_phase_interpolation(config_filepath)  # pre phase
+        cache_filepath = self._config_cache_filepath(config_filepath)
+        if not self._read_config_cache(config_filepath, cache_filepath):
+            self.data = self._read_config(config_filepath)
+            self._validate_conf(config_filepath)
+            self._write_config_cache(config_filepath, cache_filepath)
+        self._document = self.data
+        self._setup_overlay(override_config, lazy)
+
+    def _init_instance(self, test, remove_tmp, state_locking):
+        ''' initialize per instance attributes, not shared with forks '''
+
         self.data = {}
-        self.state = {}
         self.first_phase_vars = {}
         self.second_phase_vars = {}
+        self._state = None
         self._delayed_vars = []
-        self.jinja_env = None
+        self._vars_phase = {}
+        self._second_phase_generation = 0
+        self._delayed_vars_generation = -1
+        self._render_memo = {}
+        self._path_versions = {}  # version of a path, changes when the path or any path under it changes
+        self._replaced_versions = {}  # version of a path, changes when the path is replaced as a whole
+        self._materialized = True  # no lazy phase is triggered while constructing
+        self._remove_tmp = remove_tmp
+        self._state_locking = state_locking
         self.test = test
-        self.cwd = os.getcwd()
-        if working_dir:
-            dir_change_working(working_dir)
-        self.data = self._read_config(config_filepath)
-        self._validate_conf(config_filepath)
-        self._setup_jinja2()
-        self._setup_pre_phase_interpolation(config_filepath)  # pre phase
-        self._setup_load_file_references()
+        self._loaded = set()  # loaded tests in data
+
+    def _setup_overlay(self, override_config, lazy):
+        ''' setup a copy of the document with test and override config applied '''
+
+        self.data = {**self._document, CONFIG_TESTS: {k: dict(self._loaded_tests.get(k, v)) for k, v in self._document[CONFIG_TESTS].items()}}
+        self._loaded = set(self._loaded_tests)
+        previous_model, self.model = self.model, None  # model of this overlay is built after test setup
         self._setup_test()
         if override_config:
             self.data = {**self.data, **override_config}
-        self._setup_first_phase_interpolation(state_locking, remove_tmp)  # First phase
+        self.model = ConfigModel(self.data, previous=previous_model)
+        if lazy:
+            self._materialized = False  # phases are setup on first access
+        else:
+            self._setup_phases()
+
+    def fork(self, test=None, override_config=None, remove_tmp=False, state_locking=True, lazy=False):
+        '''
+        Return a new config object for test and override config.
+        The parsed config, jinja2 environment and compiled templates are shared with this object, state and variables are not.
+        '''
+
+        forked = copy(self)
+        forked._init_instance(test, remove_tmp, state_locking)  # pylint: disable=protected-access
+        forked._setup_pre_phase_interpolation(self.config_filepath)  # pylint: disable=protected-access
+        forked._setup_overlay(override_config, lazy)  # pylint: disable=protected-access
+        return forked
+
+    def resolve_path(self, path):
+        ''' Return path resolved against the working directory, the process working directory is never changed '''
+
+        if not path:
+            return path
+        return os.path.join(self.working_dir, path)
+
+    def _materialize(self):
+        ''' Setup lazy phases if not done yet '''
+
+        if self._materialized:
+            return
+        self._materialized = True
+        self._setup_phases()
+
+    def _setup_phases(self):
+        self._setup_first_phase_interpolation()  # First phase
         self._setup_second_phase_variables()  # Second phase
         self.update_hooks_result(self.state.result_hooks)
-        dir_change_working(self.cwd)
 
     def _validate_conf(self, config_filepath):
+        self.data = self._validate(_MAIN_VALIDATOR, self.data, config_filepath)
+        self._extra_validate()
+
+    @staticmethod
+    def _validate(validator, data, config_filepath):
         try:
-            schema_obj = Schema(MAIN_SCHEMA)
-            self.data = schema_obj.validate(self.data)
-            self._extra_validate()
+            return validator.validate(data)
         except SchemaWrongKeyError as error:
             raise CLIError(f"config schema error 'SchemaWrongKeyError' in '{config_filepath}' an unexpected key is detected: {str(error)}") from error
         except SchemaMissingKeyError as error:
@@ -76,61 +176,117 @@ class ConfigParser:
 
     def _extra_validate(self):
         ''' validation not covered by schema '''
-        hooks = []
-        for hook_name, hook_value in self.get_hooks(format_list=False):
-            hooks.append(hook_name)
-            if hook_name[0] == "_":
-                raise CLIError(f"Hook names '{hook_name}' can't start with '_'")
-            for operation in hook_value.get("ops"):
-                op_name = operation.get(CONFIG_NAME, " ")
+
+        model = ConfigModel(self.data)
+        for hook in model.hooks.values():
+            if hook.name[0] == "_":
+                raise CLIError(f"Hook names '{hook.name}' can't start with '_'")
+            op_names = set()
+            for operation in hook.ops:
+                op_name = operation.name or " "
                 if op_name[0] == "_":
                     raise CLIError(f"op names '{op_name}' can't start with '_'")
-                if operation.get(CONFIG_TYPE) == "call" and operation.get(CONFIG_ARGS) not in self.get_hooks(format_list=True):
-                    raise CLIError(f"'{op_name}' can't call an undefined hook {operation.get('args')}")
-
-        # TODO Refactor very messy
-        for test in self.data.get(CONFIG_TESTS, {}):
-            for hooks_ops in self.data[CONFIG_TESTS][test].get(CONFIG_EXPECT, {}).get(CONFIG_HOOKS, []):
-                for hook in hooks_ops:
-                    if hook not in hooks:
-                        raise CLIError(f"unknown hook name '{hook}' in expect test '{test}'")
-            upgrade_from_names = []
-            for upgrade in self.data[CONFIG_TESTS][test].get("upgrade_from", []):
-                name = upgrade.get(CONFIG_NAME).lower().strip()
-                if name in upgrade_from_names:
-                    raise CLIError(f"upgrade from name'{name}' is duplicated.")
-                upgrade_from_names.append(name)
+                if operation.name and operation.name in op_names:
+                    raise CLIError(f"config schema error duplicate op name '{op_name}' in hook '{hook.name}")
+                op_names.add(operation.name)
+                if operation.type == "call" and operation.args not in model.hooks:
+                    raise CLIError(f"'{op_name}' can't call an undefined hook {operation.args}")
+
+        for test in model.tests.values():
+            self._extra_validate_test(test, model.hooks)
+        self.model = model
+
+    @staticmethod
+    def _extra_validate_test(test, hooks):
+        for hook_name in test.expect_hooks:
+            if hook_name not in hooks:
+                raise CLIError(f"unknown hook name '{hook_name}' in expect test '{test.name}'")
+        upgrade_from_names = set()
+        for upgrade in test.data.get("upgrade_from", []):
+            name = upgrade.get(CONFIG_NAME).lower().strip()
+            if name in upgrade_from_names:
+                raise CLIError(f"upgrade from name'{name}' is duplicated.")
+            upgrade_from_names.add(name)
 
     @staticmethod
     def _read_config(filepath):
         try:
-            with open(filepath) as file_in:
+            with open(filepath, encoding="utf-8") as file_in:
                 return yaml.load(file_in, Loader=yaml.FullLoader)
         except (yaml.parser.ParserError, yaml.scanner.ScannerError, yaml.constructor.ConstructorError) as error:
             raise CLIError(f"Config file '{filepath}' yaml parser error:': {str(error)}") from error
         except FileNotFoundError as error:
             raise CLIError(f"Config file '{filepath}' file not found:': {str(error)}") from error
 
+    @staticmethod
+    def _config_cache_filepath(config_filepath):
+        ''' Return the cache path of a config file in the user cache dir, keyed by the config file path '''
+
+        cache_key = hashlib.sha1(os.path.realpath(config_filepath).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(cdf_cache_dir(), CONFIG_CACHE_DIRNAME, CONFIG_CACHE_FILENAME.format(cache_key))
+
+    def _read_config_cache(self, config_filepath, cache_filepath):
+        ''' Load validated config from cache without parsing yaml, returns False if cache is missing, stale or can't be decoded '''
+
+        if not os.path.exists(cache_filepath):
+            return False
+        try:
+            config_hash = file_hash(config_filepath)
+            cache = json_load(file_read_content(cache_filepath))
+        except CLIError:
+            return False
+        if not isinstance(cache, dict) or cache.get("version") != VERSION or cache.get("config_hash") != config_hash:
+            return False
+        _LOGGER.debug("Using cached config for '%s'", config_filepath)
+        self.data = cache["data"]
+        return True
+
+    def _write_config_cache(self, config_filepath, cache_filepath):
+        ''' Save validated config as json keyed by content hash of config, test files are loaded when needed and not cached '''
+
+        try:
+            content = json.dumps({"version": VERSION, "config_hash": file_hash(config_filepath), "data": self.data})
+            if json.loads(content)["data"] != self.data:  # i.e. non string keys or dates in yaml
+                return
+            dir_create(os.path.dirname(cache_filepath))
+            file_write_atomic(cache_filepath, content, durability=STATE_DURABILITY_RENAME)
+        except (CLIError, TypeError, ValueError) as error:
+            _LOGGER.debug("Skipping config cache. %s", str(error))
+
     def _setup_jinja2(self):
-        self.jinja_env = Environment(loader=BaseLoader, undefined=StrictUndefined)
-        self.jinja_env.globals["include_file"] = _include_file
-        self.jinja_env.globals["template_file"] = _template_file
+        self.jinja_env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined, bytecode_cache=shared_bytecode_cache())
+        # file functions resolve relative names against the working directory, forks share it with this object
+        self.jinja_env.globals["include_file"] = partial(_include_file, self.working_dir)
+        self.jinja_env.globals["template_file"] = contextfunction(partial(_template_file, self.working_dir))  # pass_context
         self.jinja_env.globals["random_string"] = random_string
+        lookups = Lookups()  # memoized lookups are shared with forks
+        self.jinja_env.globals["http_get"] = lookups.http_get
+        self.jinja_env.globals["az_query"] = lookups.az_query
 
-    def _setup_load_file_references(self):
-        # Load all files from tests
-        for test_name in self.data[CONFIG_TESTS].keys():
-            if self.data[CONFIG_TESTS][test_name].get(CONFIG_FILE, False):  # load test from another dir
-                self.data[CONFIG_TESTS][test_name][CONFIG_FILE] = self.interpolate(FIRST_PHASE, self.data[CONFIG_TESTS][test_name][CONFIG_FILE], f"test {test_name} key {CONFIG_FILE}")
-                test_data = self._read_config(self.data[CONFIG_TESTS][test_name][CONFIG_FILE])
-                self.data[CONFIG_TESTS][test_name] = {**self.data[CONFIG_TESTS][test_name], **test_data}
-                self._validate_conf(self.data[CONFIG_TESTS][test_name][CONFIG_FILE])  # revalidate after loading data
+    def _load_test(self, test_name):
+        ''' Load and validate a test defined in its own file, only tests that are used are loaded '''
+
+        test_data = self.data[CONFIG_TESTS].get(test_name)
+        if not test_data or not test_data.get(CONFIG_FILE) or test_name in self._loaded:
+            return
+        if test_name not in self._loaded_tests:
+            test_filepath = self.resolve_path(self._interpolate(FIRST_PHASE, self._document[CONFIG_TESTS][test_name][CONFIG_FILE], f"test {test_name} key {CONFIG_FILE}"))
+            file_data = self._read_config(test_filepath) or {}
+            test_data = {**self._document[CONFIG_TESTS][test_name], CONFIG_FILE: test_filepath, **file_data}
+            test_data = self._validate(_TEST_VALIDATOR, {test_name: test_data}, test_filepath)[test_name]
+            self._extra_validate_test(Test(test_name, test_data), self.data[CONFIG_HOOKS])
+            self._loaded_tests[test_name] = test_data
+        self._loaded.add(test_name)
+        self.data[CONFIG_TESTS][test_name] = dict(self._loaded_tests[test_name])
+        if self.model is not None:
+            self.model.tests[test_name] = Test(test_name, self.data[CONFIG_TESTS][test_name])
 
     def _setup_test(self):
         if not self.test:
             return
-        if not self.get_test(self.test):
+        if self.test not in self.data[CONFIG_TESTS]:
             raise CLIError(f"Could not find test {self.test}")
+        self._load_test(self.test)
 
         self.data[CONFIG_NAME] = self.data[CONFIG_TESTS][self.test].get(CONFIG_NAME, f"{self.data[CONFIG_NAME]}_{self.test}_test")
         self.data[CONFIG_TESTS][self.test][CONFIG_DESCRIPTION] = self.data[CONFIG_TESTS][self.test].get(CONFIG_DESCRIPTION, f"{self.data[CONFIG_NAME]} {self.test} test")
@@ -159,33 +315,119 @@ class ConfigParser:
             RUNTIME_RUN_ONCE_KEY: RUNTIME_RUN_ONCE,
         }
 
-    def _setup_first_phase_interpolation(self, state_locking, remove_tmp=False):
-        ''' first phase interpolation '''
-        # self.override override_state=None, prefix_state=None,
-        self.first_phase_vars[CONFIG_CDF][CONFIG_TMP] = self.interpolate(FIRST_PHASE, self.data[CONFIG_TMP], context=f"key {CONFIG_TMP}")
-        if remove_tmp:  # remove and create tmp dir incase we will download some stuff for templates
+    def _setup_tmp_dir(self):
+        if CONFIG_TMP in self.first_phase_vars[CONFIG_CDF]:
+            return
+        self._set_variable(CONFIG_CDF, CONFIG_TMP, self.resolve_path(self._interpolate(FIRST_PHASE, self.data[CONFIG_TMP], context=f"key {CONFIG_TMP}")))
+        if self._remove_tmp:  # remove and create tmp dir incase we will download some stuff for templates
             dir_remove(self.tmp_dir)
         dir_create(self.tmp_dir)
-        self.data[CONFIG_STATE_FILEPATH] = self.interpolate(FIRST_PHASE, self.data[CONFIG_STATE_FILEPATH], context=f"key {CONFIG_STATE_FILEPATH}")
-        self.state = State(self.data[CONFIG_STATE_FILEPATH], locking=state_locking)  # initialize state
-        self.jinja_env.globals["store"] = self.state.store_get  # setup store functions in jinja2
 
-        self.first_phase_vars[CONFIG_CDF][CONFIG_NAME] = self.interpolate(FIRST_PHASE, self.data[CONFIG_NAME], f"key {CONFIG_NAME}")
+    def _setup_state(self):
+        ''' open the state, does not reconcile the state with the config '''
+
+        self._setup_tmp_dir()
+        state_filepath = self._interpolate(FIRST_PHASE, self.data[CONFIG_STATE_FILEPATH], context=f"key {CONFIG_STATE_FILEPATH}")
+        self.data[CONFIG_STATE_FILEPATH] = self._resolve_state_path(state_filepath)
+        self._state = self._open_state(self.data[CONFIG_STATE_FILEPATH], self._state_locking)  # initialize state
+        self.first_phase_vars[RUNTIME_STORE] = self._state.store_get  # setup store function, not a global since jinja2 env is shared with forks
+
+    def _resolve_state_path(self, state_filepath):
+        for scheme in ("file://", "sqlite://"):
+            if state_filepath.startswith(scheme):
+                return scheme + self.resolve_path(state_filepath[len(scheme):])
+        return state_filepath
+
+    def _open_state(self, state_filepath, locking):
+        return State(
+            state_filepath,
+            locking=locking,
+            ignore_lock_error=not locking,  # readers use the last written state while a writer holds the lock
+            lock_timeout=self.data.get(CONFIG_STATE_LOCK_TIMEOUT, CONFIG_STATE_LOCK_TIMEOUT_DEFAULT) if locking else 0,
+            flush_policy=self.data.get(CONFIG_STATE_FLUSH, CONFIG_STATE_FLUSH_DEFAULT),
+            durability=self.data.get(CONFIG_STATE_DURABILITY, CONFIG_STATE_DURABILITY_DEFAULT),
+            retention=self.data.get(CONFIG_STATE_RETENTION, CONFIG_STATE_RETENTION_DEFAULT),
+            cache_dir=self.tmp_dir,
+            blob_dir=os.path.join(self.tmp_dir, BLOBS_DIRNAME, hashlib.sha1(state_filepath.encode("utf-8")).hexdigest()[:16]),  # pruned per state
+        )
+
+    def migrate_state(self, target):
+        ''' Copy the state with its events to a new state at target i.e. 'sqlite://state.db', returns the new state '''
+
+        target_state = self._open_state(self._resolve_state_path(target), True)
+        if not target_state.created:
+            raise CLIError(f"State '{target}' already exists, remove it before migrating")
+        target_state.replace_with(self.state)
+        return target_state
+
+    def _setup_first_phase_interpolation(self):
+        ''' first phase interpolation '''
+        if self._state is None:
+            self._setup_state()
+        self._set_variable(CONFIG_CDF, CONFIG_NAME, self._interpolate(FIRST_PHASE, self.data[CONFIG_NAME], f"key {CONFIG_NAME}"))
         if CONFIG_VARS in self.data:
-            # lazy variable resolve
-            for key, value in self.data[CONFIG_VARS].items():
-                try:
-                    self.first_phase_vars[CONFIG_VARS][key] = self.interpolate(FIRST_PHASE, value, f"variables in config '{key}':'{value}'")
-                except UndefinedError as error:
-                    if "result" in str(error):
-                        self._delayed_vars.append(key)
-                    else:
-                        raise CLIError() from error
-        self.first_phase_vars[CONFIG_CDF][CONFIG_RG] = self.interpolate(FIRST_PHASE, self.data[CONFIG_RG], f"key {CONFIG_RG}")
-        self.first_phase_vars[CONFIG_CDF][CONFIG_LOCATION] = self.interpolate(FIRST_PHASE, self.data[CONFIG_LOCATION], f"key {CONFIG_LOCATION}")
-        self.data[CONFIG_UP] = self.interpolate(FIRST_PHASE, self.data[CONFIG_UP], f"key {CONFIG_UP}")
+            for key in self._setup_vars_graph():
+                if self._vars_phase[key] == SECOND_PHASE:
+                    self._delayed_vars.append(key)  # resolved once result or hooks are available
+                    continue
+                value = self.data[CONFIG_VARS][key]
+                self._set_variable(CONFIG_VARS, key, self._interpolate(FIRST_PHASE, value, f"variables in config '{key}':'{value}'"))
+        self._set_variable(CONFIG_CDF, CONFIG_RG, self._interpolate(FIRST_PHASE, self.data[CONFIG_RG], f"key {CONFIG_RG}"))
+        self._set_variable(CONFIG_CDF, CONFIG_LOCATION, self._interpolate(FIRST_PHASE, self.data[CONFIG_LOCATION], f"key {CONFIG_LOCATION}"))
+        self.data[CONFIG_UP] = self._interpolate(FIRST_PHASE, self.data[CONFIG_UP], f"key {CONFIG_UP}")
         # Setup state after interpolation
-        self.state.setup(deployment_name=self.name, resource_group=self.resource_group_name, config_hooks=self._ops_in_hooks())
+        self.state.setup(deployment_name=self.name, resource_group=self.resource_group_name, config_hooks=self.model.hook_ops)
+
+    def _vars_dependencies(self, key, value):
+        ''' Return vars referenced by a variable and if it references second phase variables '''
+
+        dependencies = set()
+        second_phase = False
+        for source in _template_strings(value):
+            try:
+                references = self.jinja_env.template_references(source)
+            except TemplateSyntaxError as error:
+                raise CLIError(f"expression interpolation error. variables in config '{key}', template syntax: {str(error)}") from error
+            for path in references:
+                if path[0] in RUNTIME_SECOND_PHASE_VARS:
+                    second_phase = True
+                elif path[0] == CONFIG_VARS and len(path) == 1:  # dynamic access depends on all vars
+                    dependencies.update(var for var in self.data[CONFIG_VARS] if var != key)
+                elif path[0] == CONFIG_VARS and path[1] in self.data[CONFIG_VARS]:
+                    dependencies.add(path[1])
+        return dependencies, second_phase
+
+    def _setup_vars_graph(self):
+        ''' Build vars dependency graph, returns vars in topological order and assigns a phase per var '''
+
+        graph = {}
+        self._vars_phase = {}
+        for key, value in self.data[CONFIG_VARS].items():
+            graph[key], second_phase = self._vars_dependencies(key, value)
+            self._vars_phase[key] = SECOND_PHASE if second_phase else FIRST_PHASE
+
+        order = []
+        visiting = []
+        visited = set()
+
+        def visit(key):
+            if key in visited:
+                return
+            if key in visiting:
+                cycle = visiting[visiting.index(key):] + [key]
+                raise CLIError(f"variables in config dependency cycle detected '{' -> '.join(cycle)}'")
+            visiting.append(key)
+            for dependency in graph[key]:
+                visit(dependency)
+                if self._vars_phase[dependency] == SECOND_PHASE:
+                    self._vars_phase[key] = SECOND_PHASE
+            visiting.pop()
+            visited.add(key)
+            order.append(key)
+
+        for key in graph:
+            visit(key)
+        return order
 
     def _setup_second_phase_variables(self):
         self.second_phase_vars = {
@@ -195,58 +437,165 @@ class ConfigParser:
             },
             RUNTIME_HOOKS: self._ops_in_hooks(),
         }
-        self.second_phase_vars[RUNTIME_RESULT] = self.state.result_up  # update results from state
+        self.update_result(self.state.result_up)  # update results from state
+
+    def template_phase(self, template):
+        '''
+        Return the phase needed to interpolate template, STATIC_PHASE if no interpolation needed.
+        Lists and dicts are classified on first use, the plan is shared with forks.
+        '''
 
-    def _raw_interpolate_object(self, template, variables=None):
         if isinstance(template, str):
-            return self.jinja_env.from_string(template).render(variables)
+            if not needs_rendering(template):
+                return STATIC_PHASE
+            try:
+                variables = self.jinja_env.template_variables(template)
+            except TemplateSyntaxError:
+                return FIRST_PHASE  # let interpolate raise the error with context
+            if variables.intersection(RUNTIME_SECOND_PHASE_VARS):
+                return SECOND_PHASE
+            return FIRST_PHASE
+        if isinstance(template, (list, dict)):
+            planned = self._plan.get(id(template))
+            if planned and planned[0] is template:
+                return planned[1]
+            phase = STATIC_PHASE
+            for template_item in template.values() if isinstance(template, dict) else template:
+                phase = max(phase, self.template_phase(template_item))
+            self._plan[id(template)] = (template, phase)  # keep a reference so id is not reused
+            return phase
+        return STATIC_PHASE
+
+    def _is_static(self, template):
+        return self.template_phase(template) == STATIC_PHASE
+
+    def _raw_interpolate_object(self, template, variables=None, memo_phase=None, native=False):
+        if isinstance(template, str):
+            if not needs_rendering(template):
+                return template
+            return self._render(template, variables, memo_phase, native)
+        if self._is_static(template):
+            return template
         if isinstance(template, list):
             interpolated_list = []
             for template_item in template:
-                interpolated_list.append(self._raw_interpolate_object(template_item, variables))
+                interpolated_list.append(self._raw_interpolate_object(template_item, variables, memo_phase, native))
             return interpolated_list
         if isinstance(template, dict):
             interpolated_dict = {}
             for template_key, template_value in template.items():
-                interpolated_dict.update({template_key: self._raw_interpolate_object(template_value, variables)})
+                interpolated_dict.update({template_key: self._raw_interpolate_object(template_value, variables, memo_phase, native)})
             return interpolated_dict
         # do nothing
         return template
 
-    # TODO can be moved to interploate with flag
+    def _render_dependencies(self, source):
+        ''' Return tracked variable paths source depends on, None if the result can not be memoized '''
+
+        try:
+            return self._memo_dependencies[source]
+        except KeyError:
+            pass
+        dependencies = set()
+        for path in self.jinja_env.template_references(source):
+            if path[0] in _MEMO_STABLE:
+                continue
+            depth = _MEMO_TRACKED_DEPTH.get(path[0])
+            if depth is None:
+                dependencies = None
+                break
+            dependencies.add(path[:depth])
+        if dependencies is not None and self.jinja_env.template_filters(source).isdisjoint(_MEMO_IMPURE_FILTERS):
+            dependencies = tuple(dependencies)
+        else:
+            dependencies = None
+        self._memo_dependencies[source] = dependencies
+        return dependencies
+
+    def _path_version(self, path):
+        return (self._path_versions.get(path, 0),) + tuple(self._replaced_versions.get(path[:i], 0) for i in range(1, len(path)))
+
+    def _touch_path(self, path):
+        ''' Invalidate memoized renders that depend on path '''
+
+        for i in range(1, len(path) + 1):
+            self._path_versions[path[:i]] = self._path_versions.get(path[:i], 0) + 1
+        self._replaced_versions[path] = self._replaced_versions.get(path, 0) + 1
+
+    def _set_variable(self, root, key, value):
+        variables = self.first_phase_vars[root]
+        if key in variables and variables[key] == value:
+            return
+        variables[key] = value
+        self._touch_path((root, key))
+
+    def _render(self, source, variables, memo_phase, native=False):
+        ''' Render source, memoized per phase until one of the variable paths it reads changes '''
+
+        dependencies = self._render_dependencies(source) if memo_phase else None
+        if dependencies is None:
+            return self.jinja_env.render(source, variables, native=native)
+        versions = tuple(self._path_version(path) for path in dependencies)
+        memo = self._render_memo.get((memo_phase, native, source))
+        if memo is not None and memo[0] == versions:
+            return memo[1]
+        rendered = self.jinja_env.render(source, variables, native=native)
+        self._render_memo[(memo_phase, native, source)] = (versions, rendered)
+        return rendered
+
     def interpolate_delayed_variable(self):
-        ''' Interpolate delayed variables that was not caught in earlier phases '''
+        ''' Interpolate second phase variables once their inputs (result or hooks) have changed '''
 
-        for k in self._delayed_vars:
-            self.first_phase_vars[CONFIG_VARS][k] = self.interpolate(SECOND_PHASE, self.data[CONFIG_VARS][k], f"variables in config in delayed interpolate '{k}'")
+        self._materialize()
+        if self._delayed_vars_generation == self._second_phase_generation:
+            return
+        self._delayed_vars_generation = self._second_phase_generation
+        for k in self._delayed_vars:  # in dependency order
+            try:
+                self._set_variable(CONFIG_VARS, k, self.interpolate(SECOND_PHASE, self.data[CONFIG_VARS][k], f"variables in config in delayed interpolate '{k}'"))
+            except CLIError as error:
+                if not isinstance(error.__cause__, UndefinedError):
+                    raise
+                _LOGGER.debug("Variable '%s' inputs are not available yet. %s", k, str(error))
+                if self.first_phase_vars[CONFIG_VARS].pop(k, None) is not None:
+                    self._touch_path((CONFIG_VARS, k))
 
     def interpolate_pre_up(self):
         ''' Interpolate variables before up '''
 
         self.interpolate_delayed_variable()
         if CONFIG_PARAMS in self.data:
-            self.data[CONFIG_PARAMS] = self.interpolate(FIRST_PHASE, self.data[CONFIG_PARAMS], context="pre up interpolation")
+            # params keep their types i.e. '{{ vars.tags }}' is a dict, written as is to the deployment parameters file
+            self.data[CONFIG_PARAMS] = self.interpolate(FIRST_PHASE, self.data[CONFIG_PARAMS], context="pre up interpolation", native=True)
+
+    def interpolate(self, phase, template, context=None, extra_vars=None, root_vars=None, native=False):
+        ''' Interpolate a string template, if native single expression templates return the value with its type '''
 
-    def interpolate(self, phase, template, context=None, extra_vars=None, root_vars=None):
-        ''' Interpolate a string template '''
+        self._materialize()
+        return self._interpolate(phase, template, context=context, extra_vars=extra_vars, root_vars=root_vars, native=native)
 
+    def _interpolate(self, phase, template, context=None, extra_vars=None, root_vars=None, native=False):
         if template is None:
             return None
-        # variables
-        variables = self.first_phase_vars  # setup first phase anyway
+        # variables are resolved through layers without copying, first match wins
+        scopes = [self.first_phase_vars]  # setup first phase anyway
         if phase == SECOND_PHASE:
-            variables = {**self.second_phase_vars, **self.first_phase_vars}
-        if extra_vars:
-            variables[CONFIG_VARS] = {**variables[CONFIG_VARS], **extra_vars}
+            scopes.append(self.second_phase_vars)
         if root_vars:
-            variables = {**root_vars, **variables}
+            scopes.append(root_vars)
+        if extra_vars:
+            scopes.insert(0, {CONFIG_VARS: ChainMap(extra_vars, self.first_phase_vars[CONFIG_VARS])})
+        variables = ChainMap(*scopes)
+        memo_phase = phase
+        if extra_vars or (root_vars and not root_vars.keys().isdisjoint(_MEMO_TRACKED_DEPTH)):
+            memo_phase = None  # shadowed variables are not tracked
 
         error_context = f"in phase '{phase}'"
         if context:
             error_context = f"in phase: '{phase}'', Context: '{context}'"
 
         try:
-            return self._raw_interpolate_object(template, variables)
+            return self._raw_interpolate_object(template, variables, memo_phase, native)
         except UndefinedError as error:
             raise CLIError(f"expression interpolation error. {error_context}, undefined variable: {str(error)}") from error
         except TemplateSyntaxError as error:
@@ -254,55 +603,56 @@ class ConfigParser:
         except (TypeError, TemplateRuntimeError) as error:
             raise CLIError(f"expression interpolation error. {error_context}, Runtime error: {str(error)}") from error
 
-    def update_hooks_result(self, hooks_output):
-        ''' Update all hooks results and make them available as variables to second phase '''
+    def update_hooks_result(self, hooks_output, hook=None, op_name=None):
+        '''
+        Update all hooks results and make them available as variables to second phase.
+        If hook and op_name are given only the result of that op has changed.
+        '''
 
         self.second_phase_vars[RUNTIME_HOOKS] = hooks_output
+        self._second_phase_generation += 1
+        if hook is not None and op_name is not None:
+            self._touch_path((RUNTIME_HOOKS, hook, op_name))
+        else:
+            self._touch_path((RUNTIME_HOOKS,))
+
+    def update_result(self, result):
+        ''' Update up result and make them available as variables to second phase '''
+
+        self.second_phase_vars[RUNTIME_RESULT] = result
+        self._second_phase_generation += 1
+        self._touch_path((RUNTIME_RESULT,))
 
     def _ops_in_hooks(self):
         ''' returns ops in hooks '''
 
-        output_hooks = {}
-        for hook_k, hook_v in self.get_hooks(format_list=False):
-            output_hooks[hook_k] = {}
-            for op_obj in hook_v["ops"]:
-                op_name = op_obj.get(CONFIG_NAME, False)
-                if not op_name:
-                    continue  # skip since we don't have a names
-                if op_name in output_hooks[hook_k]:
-                    raise CLIError(f"config schema error duplicate op name '{op_name}' in hook '{hook_k}")
-                output_hooks[hook_k][op_name] = {}
-        return output_hooks
+        return {hook_name: {op_name: {} for op_name in named_ops} for hook_name, named_ops in self.model.hook_ops.items()}
 
     def get_hooks(self, format_list=True):
         ''' Return hooks as list of name or as dict with object'''
         if format_list:
-            hooks = []
-            for k, _ in self.data[CONFIG_HOOKS].items():
-                hooks.append(k)
-            return hooks
+            return list(self.model.hooks)
         return self.data[CONFIG_HOOKS].items()
 
     def get_test(self, test_name, expect=None, hook=None):
         ''' Return test dic '''
 
-        test_obj = self.data.get(CONFIG_TESTS, {}).get(test_name, {})
+        self._load_test(test_name)
+        test = self.model.tests.get(test_name)
+        if test is None:
+            return {}
         if expect is None and hook is None:
-            return test_obj
+            return test.data
         if expect:
-            return test_obj.get(CONFIG_EXPECT, {}).get(expect, {})
-        for expect_hook in test_obj.get(CONFIG_EXPECT, {}).get(CONFIG_HOOKS, []):
-            if hook in expect_hook:
-                return expect_hook.get(hook)
-        return {}
+            return test.expect.get(expect, {})
+        return test.expect_hooks.get(hook, {})
 
     def test_hooks(self, test_name):
         ''' returns all hooks in a test as list '''
 
-        hooks = []
-        for k in self.data.get(CONFIG_TESTS, {}).get(test_name, {}).get(CONFIG_EXPECT, {}).get(CONFIG_HOOKS, []):
-            hooks.append(list(k.keys())[0])
-        return hooks
+        self._load_test(test_name)
+        test = self.model.tests.get(test_name)
+        return list(test.hook_names) if test else []
 
     def upgrade_flaten(self, test_name):
         ''' return deployment mode '''
@@ -321,21 +671,28 @@ class ConfigParser:
     def tests(self):
         ''' returns all test names as list '''
 
-        tests = []
-        for k, _ in self.data[CONFIG_TESTS].items():
-            tests.append(k)
-        return tests
+        return list(self.model.tests)
+
+    @property
+    def state(self):
+        ''' returns CDF state, in lazy mode the state is opened on first access '''
+
+        if self._state is None:
+            self._setup_state()
+        return self._state
 
     @property
     def name(self):
         ''' returns CDF name '''
 
+        self._materialize()
         return self.first_phase_vars[CONFIG_CDF][CONFIG_NAME]
 
     @property
     def resource_group_name(self):
         ''' returns CDF resource group '''
 
+        self._materialize()
         return self.first_phase_vars[CONFIG_CDF][CONFIG_RG]
 
     @property
@@ -348,19 +705,23 @@ class ConfigParser:
     def location(self):
         ''' returns CDF azure location '''
 
+        self._materialize()
         return self.first_phase_vars[CONFIG_CDF][CONFIG_LOCATION]
 
     @property
     def tmp_dir(self):
         ''' returns CDF temp directory '''
 
+        if CONFIG_TMP not in self.first_phase_vars[CONFIG_CDF]:
+            self._setup_tmp_dir()
         return self.first_phase_vars[CONFIG_CDF][CONFIG_TMP]
 
     @property
     def up_location(self):
         ''' returns CDF up location '''
 
-        return self.data[CONFIG_UP]
+        self._materialize()
+        return self.resolve_path(self.data[CONFIG_UP])
 
     @property
     def provisioner(self):
@@ -84,7 +84,7 @@ MAIN_SCHEMA = {
     Optional(CONFIG_PROVISIONER, default="bicep"): And(str, Use(str.lower), lambda s: s in CONFIG_SUPPORTED_PROVISIONERS),
     Optional(CONFIG_DEPLOYMENT_COMPLETE, default=False): bool,
     Optional(CONFIG_UP, default=""): str,
-    Optional(CONFIG_TMP, default="{{cdf.config_dir}}/.cdf_tmp"): And(str, len),
+    Optional(CONFIG_TMP, default=CONFIG_TMP_DEFAULT): And(str, len),
     # Optional('vars_file', default=[]): Or(str,list),
     Optional(CONFIG_VARS, default={}): dict,
     Optional(CONFIG_PARAMS, default={}): dict,
@@ -92,4 +92,12 @@ MAIN_SCHEMA = {
     Optional(CONFIG_UPGRADE, default=[]): _list_or_tuple_of(UPGRADE_SCHEMA),
     Optional(CONFIG_TESTS, default={}): TEST_SCHEMA,
     Optional(CONFIG_STATE_FILEPATH, default=CONFIG_STATE_FILEPATH_DEFAULT): str,
+    Optional(CONFIG_STATE_RETENTION, default=CONFIG_STATE_RETENTION_DEFAULT): {
+        Optional(STATE_RETENTION_COUNT): And(int, lambda n: n > 0),
+        Optional(STATE_RETENTION_DAYS): And(Or(int, float), lambda n: n > 0),
+    },
+    Optional(CONFIG_STATE_LOCK_TIMEOUT, default=CONFIG_STATE_LOCK_TIMEOUT_DEFAULT): And(Or(int, float), lambda n: n >= 0),
+    Optional(CONFIG_STATE_DURABILITY, default=CONFIG_STATE_DURABILITY_DEFAULT): And(str, Use(str.lower), lambda s: s in STATE_SUPPORTED_DURABILITY),
+    # flush policy or seconds between state writes
+    Optional(CONFIG_STATE_FLUSH, default=CONFIG_STATE_FLUSH_DEFAULT): Or(And(str, Use(str.lower), lambda s: s in STATE_SUPPORTED_FLUSH), And(int, lambda n: n > 0)),
 }
@@ -4,11 +4,13 @@ import unittest
 import shutil
 import os
 import platform
+import yaml
 
 from mock import patch
 from knack.util import CLIError
 from azext_cdf.parser import ConfigParser
 from azext_cdf.version import VERSION
+from azext_cdf._def import STATIC_PHASE, FIRST_PHASE, SECOND_PHASE, CONFIG_STATE_FILEPATH
 from azext_cdf._supporter_test import BasicParser, assert_state
 
 
@@ -80,6 +82,67 @@ class PathsParser(BasicParser):
         self.assertEqual(parser.config_dir, f"{os.getcwd()}/path_a/path_b")  # abs path
         assert_state(self, self.state_file, {"name": self.config["name"]})
 
+    @patch.object(ConfigParser, '_read_config')
+    def test_working_dir(self, mock_read_config):
+        cwd = os.getcwd()
+        os.makedirs(f"{self.dirpath}/work/files")
+        with open(f"{self.dirpath}/work/files/static.txt", "w") as static_file:
+            static_file.write("{{ cdf.name }}")
+        self.config["name"] = "test_working_dir"
+        self.config["tmp_dir"] = "tmp"
+        self.config["up"] = "main.bicep"
+        mock_read_config.return_value = self.config
+        parser = ConfigParser("path_a/c.yml", working_dir=f"{self.dirpath}/work", override_config={CONFIG_STATE_FILEPATH: "file://tmp/state.json"})
+        self.assertEqual(os.getcwd(), cwd)  # process working dir is never changed
+        work_dir = os.path.realpath(f"{self.dirpath}/work")
+        self.assertEqual(parser.config_dir, f"{work_dir}/path_a")
+        self.assertEqual(parser.tmp_dir, f"{work_dir}/tmp")
+        self.assertEqual(parser.up_location, f"{work_dir}/main.bicep")
+        self.assertEqual(parser.interpolate(1, "{{ include_file('files/static.txt') }}"), "{{ cdf.name }}")
+        self.assertEqual(parser.interpolate(1, "{{ template_file('files/static.txt') }}"), "test_working_dir")
+        assert_state(self, f"{work_dir}/tmp/state.json", {"name": "test_working_dir"})
+
+class LazyParser(BasicParser):
+    @patch.object(ConfigParser, '_read_config')
+    def test_lazy_phases(self, mock_read_config):
+        self.config["name"] = "test_lazy_phases"
+        self.config["hooks"] = {"hello": {"ops": [{"type": "print", "args": "{{cdf.name}}"}]}}
+        self.config["tmp_dir"] = f"{self.dirpath}/tmp"
+        self.override_config[CONFIG_STATE_FILEPATH] = f"file://{self.dirpath}/tmp/state.json"
+        self.state_file = f"{self.dirpath}/tmp/state.json"
+        mock_read_config.return_value = self.config
+        with patch('azext_cdf.parser.State') as mock_state, patch.object(ConfigParser, 'template_phase') as mock_plan:
+            parser = ConfigParser("/path/c.yml", override_config=self.override_config, lazy=True)
+            self.assertEqual(parser.get_hooks(), ["hello"])
+            mock_state.assert_not_called()
+            mock_plan.assert_not_called()  # templates are classified on first interpolation
+        self.assertFalse(os.path.exists(f"{self.dirpath}/tmp"))
+        self.assertEqual(parser.state.status["Name"], None)  # state opened without setup
+        self.assertEqual(parser.name, "test_lazy_phases")  # first phase setup on access
+        assert_state(self, self.state_file, {"name": "test_lazy_phases"})
+
+
+class ForkParser(BasicParser):
+    @patch.object(ConfigParser, '_read_config')
+    def test_fork(self, mock_read_config):
+        self.config["name"] = "test_fork"
+        self.config["vars"] = {"a": "{{ cdf.name }}"}
+        self.config["tests"] = {"default": {}, "patch": {"vars": {"a": "patched"}}}
+        mock_read_config.return_value = self.config
+        parser = ConfigParser("/path/c.yml", override_config=self.override_config)
+        state_override = {CONFIG_STATE_FILEPATH: f"file://{self.dirpath}/fork_state.json"}
+        forked = parser.fork(test="patch", override_config=state_override)
+        mock_read_config.assert_called_once()
+        self.assertIs(forked.jinja_env, parser.jinja_env)
+        self.assertEqual(forked.name, "test_fork_patch_test")
+        self.assertEqual(forked.interpolate(1, "{{ vars.a }}"), "patched")
+        self.assertEqual(parser.name, "test_fork")
+        self.assertEqual(parser.interpolate(1, "{{ vars.a }}"), "test_fork")
+        self.assertEqual(parser.data["tests"]["default"].get("name"), None)  # parent not modified by fork
+        assert_state(self, f"{self.dirpath}/fork_state.json", {"name": "test_fork_patch_test"})
+        assert_state(self, self.state_file, {"name": "test_fork"})
+
+
 class InterpolateParser(BasicParser):
     @patch.object(ConfigParser, '_read_config')
     def test_first_stage_cdf(self, mock_read_config):
@@ -115,6 +178,7 @@ class InterpolateParser(BasicParser):
         self.assertEqual(parser.interpolate(1, "{{vars.e[0]}}"), "1")
         self.assertEqual(parser.interpolate(1, "{{vars.f}}"), self.config["name"])
         self.assertEqual(parser.interpolate(1, "{{vars.a}}{{a}}{{vars.z}}{{z}}{{cdf.name}}", extra_vars={"z": 9}, root_vars={"a": "A", "z":"Z", "cdf": "ignored"}), f"1A9Z{self.config['name']}")
+        self.assertNotIn("z", parser.first_phase_vars["vars"])  # extra vars do not leak into config vars
         # variable not accessible in stage one
         with self.assertRaises(CLIError) as context:
             parser.interpolate(1, "{{result}}")
@@ -128,7 +192,49 @@ class InterpolateParser(BasicParser):
         mock_read_config.return_value = self.config
         with self.assertRaises(CLIError) as context:
             ConfigParser("/path/c.yml", remove_tmp=False, override_config=self.override_config)
-        self.assertTrue('undefined variable' in str(context.exception))
+        self.assertIn('cycle', str(context.exception))
+        self.assertIn('h -> i -> h', str(context.exception))
+
+    @patch.object(ConfigParser, '_read_config')
+    def test_vars_dependency_order(self, mock_read_config):
+        self.config["name"] = "test_vars_dependency_order"
+        self.config["vars"] = {"a": "{{vars.b}}-{{vars['c']}}", "b": "{{vars.c}}", "c": "{{cdf.name}}",
+                               "out": "{{result.outputs.id.value}}", "uses_out": "{{vars.out}}!"}
+        mock_read_config.return_value = self.config
+        parser = ConfigParser("/path/c.yml", remove_tmp=False, override_config=self.override_config)
+        self.assertEqual(parser.interpolate(1, "{{vars.a}}"), "test_vars_dependency_order-test_vars_dependency_order")
+        self.assertNotIn("out", parser.first_phase_vars["vars"])
+        parser.interpolate_delayed_variable()  # result not available yet
+        self.assertNotIn("uses_out", parser.first_phase_vars["vars"])
+        parser.update_result({"outputs": {"id": {"value": "ID"}}, "resources": {}})
+        parser.interpolate_delayed_variable()
+        self.assertEqual(parser.interpolate(2, "{{vars.uses_out}}"), "ID!")
+
+    @patch.object(ConfigParser, '_read_config')
+    def test_incremental_interpolation(self, mock_read_config):
+        self.config["name"] = "test_incremental_interpolation"
+        self.config["hooks"] = {"a": {"ops": [{"name": "one", "args": "x"}, {"name": "two", "args": "y"}]}}
+        mock_read_config.return_value = self.config
+        parser = ConfigParser("/path/c.yml", remove_tmp=False, override_config=self.override_config)
+        template = "{{ hooks.a.one.stdout }}"
+        hooks = {"a": {"one": {"stdout": "1"}, "two": {}}}
+        parser.update_hooks_result(hooks)
+        with patch.object(parser.jinja_env, 'render', wraps=parser.jinja_env.render) as render:
+            self.assertEqual(parser.interpolate(2, template), "1")
+            self.assertEqual(parser.interpolate(2, template), "1")
+            hooks["a"]["two"] = {"stdout": "2"}
+            parser.update_hooks_result(hooks, hook="a", op_name="two")
+            self.assertEqual(parser.interpolate(2, template), "1")
+            self.assertEqual(render.call_count, 1)
+            hooks["a"]["one"] = {"stdout": "changed"}
+            parser.update_hooks_result(hooks, hook="a", op_name="one")
+            self.assertEqual(parser.interpolate(2, template), "changed")
+            parser.interpolate(2, "{{ random_string(5) }}")
+            parser.interpolate(2, "{{ random_string(5) }}")  # globals are never memoized
+            self.assertEqual(render.call_count, 4)
+            parser.interpolate(2, "{{ hooks.a.one.stdout | list | random }}")
+            parser.interpolate(2, "{{ hooks.a.one.stdout | list | random }}")  # non deterministic filters are never memoized
+            self.assertEqual(render.call_count, 6)
 
     @patch.object(ConfigParser, '_read_config')
     def test_jinja2_filters(self, mock_read_config):
@@ -149,8 +255,104 @@ class InterpolateParser(BasicParser):
         inter_len = parser.interpolate(1, "{{random_string(10)}}")
         self.assertEqual(len(inter_len), 10)
 
+    @patch.object(ConfigParser, '_read_config')
+    def test_interpolation_plan(self, mock_read_config):
+        self.config["name"] = "test_interpolation_plan"
+        self.config["params"] = {"tags": {"a": "1", "b": ["x", "y"]}, "name": "{{cdf.name}}", "id": "{{result.outputs.id}}", "text": "a\n"}
+        mock_read_config.return_value = self.config
+        parser = ConfigParser("/path/c.yml", remove_tmp=False, override_config=self.override_config)
+        params = parser.data["params"]
+        self.assertEqual(parser.template_phase(params["tags"]), STATIC_PHASE)
+        self.assertEqual(parser.template_phase(params["name"]), FIRST_PHASE)
+        self.assertEqual(parser.template_phase(params["id"]), SECOND_PHASE)
+        self.assertEqual(parser.template_phase(params), SECOND_PHASE)
+        interpolated = parser.interpolate(2, {"tags": params["tags"], "name": params["name"], "text": params["text"]})
+        self.assertIs(interpolated["tags"], params["tags"])  # not copied
+        self.assertEqual(interpolated["name"], "test_interpolation_plan")
+        self.assertEqual(interpolated["text"], "a")  # jinja2 strips trailing newline
+
+    @patch.object(ConfigParser, '_read_config')
+    def test_native_params(self, mock_read_config):
+        self.config["name"] = "test_native_params"
+        self.config["vars"] = {"tags": {"env": "dev"}, "count": 2}
+        self.config["params"] = {"tags": "{{ vars.tags }}", "count": "{{ vars.count }}", "name": "{{ cdf.name }}-{{ vars.count }}"}
+        mock_read_config.return_value = self.config
+        parser = ConfigParser("/path/c.yml", remove_tmp=False, override_config=self.override_config)
+        parser.interpolate_pre_up()
+        self.assertEqual(parser.data["params"], {"tags": {"env": "dev"}, "count": 2, "name": "test_native_params-2"})
+        self.assertEqual(parser.interpolate(1, "{{ vars.count }}"), "2")
+
     # TODO phase2 tests
     # TODO results tests
 
+class ConfigCacheParser(BasicParser):
+    def setUp(self):
+        super().setUp()
+        cache_env = patch.dict(os.environ, {"CDF_CACHE_DIR": f"{self.dirpath}/cache"})
+        cache_env.start()
+        self.addCleanup(cache_env.stop)
+        self.config_file = f"{self.dirpath}/.cdf.yml"
+        self.test_file = f"{self.dirpath}/test.yml"
+        self.config["tests"] = {"default": {"file": "{{cdf.config_dir}}/test.yml"}}
+        self.config["hooks"] = {"hello": {"ops": [{"type": "print", "args": "hello"}]}}
+        self._write(self.config_file, self.config)
+        self._write(self.test_file, {"description": "first"})
+
+    @staticmethod
+    def _write(filepath, data):
+        with open(filepath, "w") as out_file:
+            yaml.dump(data, out_file)
+
+    def test_cache_hit(self):
+        parser = ConfigParser(self.config_file, override_config=self.override_config)
+        self.assertEqual(parser.get_test("default")["description"], "first")
+        with patch.object(ConfigParser, '_read_config', side_effect=AssertionError("yaml parsed")), \
+                patch.object(ConfigParser, '_validate_conf', side_effect=AssertionError("cache not used")):
+            parser = ConfigParser(self.config_file, override_config=self.override_config)
+        self.assertEqual(parser.name, self.config["name"])
+        self.assertEqual(parser.get_test("default")["description"], "first")
+
+    def test_cache_in_cache_dir(self):
+        ConfigParser(self.config_file, override_config=self.override_config)
+        cache_dir = f"{os.environ['CDF_CACHE_DIR']}/config"
+        cache_files = [name for name in os.listdir(cache_dir) if name.startswith("config_cache_")]
+        self.assertEqual(len(cache_files), 1)
+        self.assertFalse([name for name in os.listdir(self.dirpath) if name.startswith("config_cache_")])
+        with open(f"{cache_dir}/{cache_files[0]}", "w") as out_file:
+            out_file.write("\x80not json")  # decode error is a cache miss
+        parser = ConfigParser(self.config_file, override_config=self.override_config)
+        self.assertEqual(parser.name, self.config["name"])
+
+    def test_cache_invalidated_on_change(self):
+        ConfigParser(self.config_file, override_config=self.override_config)
+        self._write(self.test_file, {"description": "second"})
+        parser = ConfigParser(self.config_file, override_config=self.override_config)
+        self.assertEqual(parser.get_test("default")["description"], "second")
+        self.config["name"] = "cdf_changed"
+        self._write(self.config_file, self.config)
+        parser = ConfigParser(self.config_file, override_config=self.override_config)
+        self.assertEqual(parser.name, "cdf_changed")
+
+    def test_test_files_loaded_on_demand(self):
+        self.config["tests"]["broken"] = {"file": "{{cdf.config_dir}}/missing.yml"}
+        self.config["tests"]["invalid"] = {"file": "{{cdf.config_dir}}/invalid.yml"}
+        self._write(self.config_file, self.config)
+        self._write(f"{self.dirpath}/invalid.yml", {"unknown_key": 1})
+        parser = ConfigParser(self.config_file, override_config=self.override_config)
+        self.assertCountEqual(parser.tests, ["default", "broken", "invalid"])
+        with patch.object(ConfigParser, '_read_config', wraps=ConfigParser._read_config) as read_config:
+            self.assertEqual(parser.get_test("default")["description"], "first")
+            forked = parser.fork(test="default", override_config=self.override_config)
+            self.assertEqual(forked.get_test("default")["description"], "first")
+            self.assertEqual(read_config.call_count, 1)  # loaded once and shared with forks
+        with self.assertRaises(CLIError) as context:
+            parser.get_test("broken")
+        self.assertIn("missing.yml", str(context.exception))
+        with self.assertRaises(CLIError) as context:
+            parser.fork(test="invalid")
+        self.assertIn("invalid.yml", str(context.exception))
+        self.assertIn("unknown_key", str(context.exception))
+
+
 if __name__ == '__main__':
     unittest.main()
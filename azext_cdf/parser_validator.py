@@ -0,0 +1,206 @@
+''' Config schema validator compiled from schema library definitions '''
+
+from copy import copy
+from schema import And, Hook, Literal, Optional, Or, Schema, SchemaError, Use
+
+# Same flavors and priorities as the schema library
+COMPARABLE, CALLABLE, VALIDATOR, TYPE, DICT, ITERABLE = range(6)
+
+
+class _Invalid(Exception):
+    ''' Raised by compiled validators, error message is produced by the schema library '''
+
+
+def _flavor(s):  # pylint: disable=too-many-return-statements
+    if type(s) in (list, tuple, set, frozenset):
+        return ITERABLE
+    if isinstance(s, dict):
+        return DICT
+    if issubclass(type(s), type):
+        return TYPE
+    if isinstance(s, Literal):
+        return COMPARABLE
+    if hasattr(s, "validate"):
+        return VALIDATOR
+    if callable(s):
+        return CALLABLE
+    return COMPARABLE
+
+
+def _key_priority(s):
+    if isinstance(s, Hook):
+        return _flavor(s._schema) - 0.5  # pylint: disable=protected-access
+    if isinstance(s, Optional):
+        return _flavor(s._schema) + 0.5  # pylint: disable=protected-access
+    return _flavor(s)
+
+
+def _compile_generic(s):
+    ''' Fallback to schema library for constructs without a compiled equivalent '''
+
+    schema_obj = s if isinstance(s, Schema) else Schema(s)
+
+    def validate(data):
+        try:
+            return schema_obj.validate(data)
+        except SchemaError as error:
+            raise _Invalid() from error
+    return validate
+
+
+def _compile_type(s):
+    def validate(data):
+        if isinstance(data, s) and not (isinstance(data, bool) and s == int):
+            return data
+        raise _Invalid()
+    return validate
+
+
+def _compile_callable(s):
+    def validate(data):
+        try:
+            valid = s(data)
+        except BaseException as error:  # pylint: disable=broad-except
+            raise _Invalid() from error
+        if valid:
+            return data
+        raise _Invalid()
+    return validate
+
+
+def _compile_comparable(s):
+    if isinstance(s, Literal):
+        s = s.schema
+
+    def validate(data):
+        if s == data:
+            return data
+        raise _Invalid()
+    return validate
+
+
+def _compile_iterable(s):
+    container_type = type(s)
+    validate_item = _compile_or(list(s))
+
+    def validate(data):
+        if not isinstance(data, container_type):
+            raise _Invalid()
+        return type(data)(validate_item(item) for item in data)
+    return validate
+
+
+def _compile_and(sub_schemas):
+    validators = [compile_validator(sub_schema) for sub_schema in sub_schemas]
+
+    def validate(data):
+        for validator in validators:
+            data = validator(data)
+        return data
+    return validate
+
+
+def _compile_or(sub_schemas):
+    validators = [compile_validator(sub_schema) for sub_schema in sub_schemas]
+
+    def validate(data):
+        for validator in validators:
+            try:
+                return validator(data)
+            except _Invalid:
+                pass
+        raise _Invalid()
+    return validate
+
+
+def _compile_use(callable_obj):
+    def validate(data):
+        try:
+            return callable_obj(data)
+        except BaseException as error:  # pylint: disable=broad-except
+            raise _Invalid() from error
+    return validate
+
+
+def _compile_dict(s):
+    if any(isinstance(skey, Hook) for skey in s):  # hooks call handlers on match
+        return _compile_generic(s)
+    entries = []
+    required = set()
+    defaults = []
+    for index, skey in enumerate(sorted(s, key=_key_priority)):
+        entries.append((index, compile_validator(skey), compile_validator(s[skey])))
+        if not isinstance(skey, (Optional, Hook)):
+            required.add(index)
+        elif hasattr(skey, "default"):
+            defaults.append((index, skey.key, skey.default))
+
+    def validate(data):
+        if not isinstance(data, dict):
+            raise _Invalid()
+        new = type(data)()
+        coverage = set()
+        # same order as schema library, dictionaries are evaluated last
+        for key, value in sorted(data.items(), key=lambda item: isinstance(item[1], dict)):
+            for index, validate_key, validate_value in entries:
+                try:
+                    new_key = validate_key(key)
+                except _Invalid:
+                    continue
+                new[new_key] = validate_value(value)
+                coverage.add(index)
+                break
+        if not required.issubset(coverage) or len(new) != len(data):
+            raise _Invalid()
+        for index, key, default in defaults:
+            if index not in coverage:
+                new[key] = default() if callable(default) else copy(default)  # defaults are not shared between configs
+        return new
+    return validate
+
+
+def compile_validator(s):  # pylint: disable=too-many-return-statements
+    ''' Return a function that validates data against schema s and raises _Invalid if it does not '''
+
+    flavor = _flavor(s)
+    if flavor == ITERABLE:
+        return _compile_iterable(s)
+    if flavor == DICT:
+        return _compile_dict(s)
+    if flavor == TYPE:
+        return _compile_type(s)
+    if flavor == CALLABLE:
+        return _compile_callable(s)
+    if flavor == COMPARABLE:
+        return _compile_comparable(s)
+    # exact types only, subclasses may override validate and use the schema library
+    # pylint: disable=protected-access,unidiomatic-typecheck
+    if type(s) in (Schema, Optional) and s._error is None and not s._ignore_extra_keys:
+        return compile_validator(s._schema)
+    if type(s) is And and s._error is None and not s._ignore_extra_keys:
+        return _compile_and(s._args)
+    if type(s) is Or and s._error is None and not s._ignore_extra_keys and not s.only_one:
+        return _compile_or(s._args)
+    if type(s) is Use and s._error is None:
+        return _compile_use(s._callable)
+    return _compile_generic(s)
+
+
+class CompiledSchema():  # pylint: disable=too-few-public-methods
+    '''
+    Validator compiled once from a schema library definition.
+    Valid data is validated by the compiled functions, invalid data is validated again by the schema library to raise the same errors.
+    '''
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._validate = compile_validator(schema)
+
+    def validate(self, data):
+        ''' Return validated data with defaults, raise SchemaError if data is invalid '''
+
+        try:
+            return self._validate(data)
+        except _Invalid:
+            pass
+        return Schema(self.schema).validate(data)
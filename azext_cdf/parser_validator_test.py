@@ -0,0 +1,63 @@
+''' Parser validator test'''
+
+import unittest
+from schema import And, Optional, Or, Schema, SchemaError, Use
+from azext_cdf.parser_schema import MAIN_SCHEMA
+from azext_cdf.parser_validator import CompiledSchema
+
+# pylint: disable=C0111
+
+
+def _config():
+    return {
+        "name": "cdf", "resource_group": "rg", "location": "loc", "provisioner": "Bicep",
+        "vars": {"a": "{{ cdf.name }}"},
+        "hooks": {
+            "hello": {"ops": [{"type": "Print", "args": "hello"}, {"name": "two", "args": ["a", "b"]}], "lifecycle": "pre-up"},
+        },
+        "upgrade": [{"name": "v1", "git": {"repo": "https://example.com/repo.git", "tag": "v1"}}],
+        "tests": {"default": {"expect": {"up": {"assert": "true"}, "hooks": [{"hello": {"fail": True}}]}}, "patch": {"name": "patched"}},
+    }
+
+
+class TestCompiledSchema(unittest.TestCase):
+    def assert_same_error(self, schema, data):
+        with self.assertRaises(SchemaError) as expected:
+            Schema(schema).validate(data)
+        with self.assertRaises(SchemaError) as error:
+            CompiledSchema(schema).validate(data)
+        self.assertEqual(type(error.exception), type(expected.exception))
+        self.assertEqual(str(error.exception), str(expected.exception))
+
+    def test_valid_config(self):
+        self.assertEqual(CompiledSchema(MAIN_SCHEMA).validate(_config()), Schema(MAIN_SCHEMA).validate(_config()))
+
+    def test_defaults_not_shared(self):
+        validator = CompiledSchema(MAIN_SCHEMA)
+        config = {"name": "cdf", "resource_group": "rg", "location": "loc"}
+        self.assertIsNot(validator.validate(config)["vars"], validator.validate(config)["vars"])
+
+    def test_invalid_config(self):
+        for key, value in (("provisioner", "unknown"), ("name", ""), ("unknown", 1), ("tests", {"t": {"upgrade": "str"}})):
+            config = _config()
+            config[key] = value
+            self.assert_same_error(MAIN_SCHEMA, config)
+        config = _config()
+        del config["location"]
+        self.assert_same_error(MAIN_SCHEMA, config)
+        config = _config()
+        config["hooks"]["hello"]["ops"][0]["mode"] = "never"
+        self.assert_same_error(MAIN_SCHEMA, config)
+
+    def test_constructs(self):
+        schema = {"a": And(str, Use(int)), Optional("b", default=2): Or(int, [str]), Optional(Or("c", "d")): bool}
+        validator = CompiledSchema(schema)
+        self.assertEqual(validator.validate({"a": "1", "c": True}), {"a": 1, "b": 2, "c": True})
+        self.assertEqual(validator.validate({"a": "1", "b": ["x"]}), {"a": 1, "b": ["x"]})
+        self.assert_same_error(schema, {"a": "x"})
+        self.assert_same_error(schema, {"a": "1", "b": True})
+        self.assert_same_error(schema, {"a": "1", "d": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
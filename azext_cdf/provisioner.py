@@ -1,5 +1,6 @@
 """ Provisioner file """
 
+import ast
 import json
 import os
 from knack.util import CLIError
@@ -13,11 +14,13 @@ from msrestazure.azure_exceptions import CloudError
 from azext_cdf._def import CONFIG_PARAMS, LIFECYCLE_PRE_UP, LIFECYCLE_POST_UP, LIFECYCLE_PRE_DOWN, LIFECYCLE_POST_DOWN
 from azext_cdf._def import STATE_PHASE_GOING_UP, STATE_PHASE_UP, STATE_PHASE_DOWN, STATE_PHASE_GOING_DOWN
 from azext_cdf.hooks import run_hook_lifecycle
-from azext_cdf.utils import run_command, find_the_right_file, find_the_right_dir, json_write_to_file
+from azext_cdf.utils import run_command, find_the_right_file, find_the_right_dir, json_write_to_file, file_exists, file_read_content
 from azext_cdf.state import STATE_STATUS_SUCCESS, STATE_STATUS_ERROR
 
 _LOGGER = get_logger(__name__)
 
+ARM_PARAMETERS_SCHEMA = "https://schema.management.azure.com/schemas/2019-04-01/deploymentParameters.json#"
+
 
 def _empty_deployment(cmd, cobj):
     # TODO check deployment exists before doing an empty deployment
@@ -72,7 +75,8 @@ def de_provision(cmd, cobj):
     # Run pre down life cycle
     run_hook_lifecycle(cobj, LIFECYCLE_PRE_DOWN)
     try:
-        _de_provision(cmd, cobj)
+        with cobj.state.batch():
+            _de_provision(cmd, cobj)
     except CLIError as error:
         cobj.state.add_event(f"Errored during down phase: {str(error)}", STATE_STATUS_ERROR)
         raise CLIError(error) from error
@@ -102,6 +106,7 @@ def _de_provision(cmd, cobj):
             no_prompt=False
         )
     cobj.state.set_result(outputs={}, resources={}, flush=True)
+    cobj.update_result(cobj.state.result_up)
 
 
 def provision(cmd, cobj):
@@ -115,7 +120,8 @@ def provision(cmd, cobj):
     # Run pre up life cycle
     run_hook_lifecycle(cobj, LIFECYCLE_PRE_UP)
     try:
-        _provision(cmd, cobj)
+        with cobj.state.batch():
+            _provision(cmd, cobj)
     except CLIError as error:
         cobj.state.add_event(f"Errored during up phase: {str(error)}", STATE_STATUS_ERROR)
         raise
@@ -147,6 +153,7 @@ def _provision(cmd, cobj):
             deployment_name=cobj.name,
             arm_template_file=find_the_right_file(cobj.up_location, "arm", "*.json", cobj.config_dir),
             resource_group=cobj.resource_group_name,
+            tmp_dir=cobj.tmp_dir,
             params=cobj.data[CONFIG_PARAMS],
             no_prompt=False,
             complete_deployment=cobj.deployment_mode,
@@ -160,6 +167,7 @@ def _provision(cmd, cobj):
             no_prompt=False
         )
     cobj.state.set_result(outputs=outputs, resources=output_resources, flush=True)
+    cobj.update_result(cobj.state.result_up)
 
 
 def run_bicep(cmd, deployment_name, bicep_file, tmp_dir, resource_group, params=None, no_prompt=False, complete_deployment=False):
@@ -178,6 +186,7 @@ def run_bicep(cmd, deployment_name, bicep_file, tmp_dir, resource_group, params=
         deployment_name=deployment_name,
         arm_template_file=arm_template_file,
         resource_group=resource_group,
+        tmp_dir=tmp_dir,
         params=params,
         no_prompt=no_prompt,
         complete_deployment=complete_deployment,
@@ -198,28 +207,90 @@ def check_deployment_error(cmd, resource_group_name, deployment_name, deployment
     return deployment_status
 
 
-def run_arm_deployment(cmd, deployment_name, arm_template_file, resource_group, params=None, no_prompt=False, complete_deployment=False):
+def _convert_param(key, value, param_type):
+    ''' Convert a param value to the type declared in the ARM template '''
+
+    try:
+        if param_type in ("string", "securestring"):
+            if isinstance(value, (dict, list)):
+                return json.dumps(value)
+            return value if isinstance(value, str) else str(value)
+        if param_type == "int":
+            if isinstance(value, bool):
+                raise ValueError("bool is not an int")
+            return int(value)
+        if param_type == "bool":
+            if isinstance(value, str):
+                return {"true": True, "false": False}[value.strip().lower()]
+            return bool(value)
+        if param_type in ("object", "secureobject", "array") and isinstance(value, str):
+            try:
+                return json.loads(value)
+            except json.JSONDecodeError:
+                return ast.literal_eval(value)  # python repr of a dict or list rendered by a template
+    except (ValueError, KeyError, SyntaxError, TypeError) as error:
+        raise CLIError(f"Failed to convert param '{key}' to '{param_type}'. Error: {str(error)}") from error
+    return value
+
+
+def typed_arm_parameters(arm_template_file, params):
+    ''' Return params converted to the types of the parameters declared in the ARM template '''
+
+    try:
+        declarations = json.loads(file_read_content(arm_template_file)).get("parameters", {})
+    except json.JSONDecodeError as error:  # i.e. template with comments, params are passed with their rendered types
+        _LOGGER.debug(" Failed to read parameters declarations from %s. %s", arm_template_file, str(error))
+        declarations = {}
+    param_types = {name.lower(): str(declaration.get("type", "")).lower() for name, declaration in declarations.items()}
+    return {key: _convert_param(key, value, param_types.get(key.lower())) for key, value in params.items()}
+
+
+def write_arm_parameters_file(filepath, parameters):
+    ''' Write an ARM deployment parameters file readable only by the owner, it can hold secure params '''
+
+    content = json.dumps(
+        {"$schema": ARM_PARAMETERS_SCHEMA, "contentVersion": "1.0.0.0", "parameters": {key: {"value": value} for key, value in parameters.items()}},
+        indent=2,
+        sort_keys=True,
+    )
+    try:
+        if file_exists(filepath):
+            os.remove(filepath)  # mode of an existing file is not changed by open
+        with os.fdopen(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as out_file:
+            out_file.write(content)
+    except OSError as error:
+        raise CLIError(f"Failed to write parameters file '{filepath}'. Error: {str(error)}") from error
+
+
+def run_arm_deployment(cmd, deployment_name, arm_template_file, resource_group, tmp_dir, params=None, no_prompt=False, complete_deployment=False):
     """
-    Deploy an ARM template
+    Deploy an ARM template, params are passed in a parameters file written to tmp dir
     Returns:
         output_resources
         output
     """
 
     parameters = []
-    for key, value in params.items():
-        params_obj = [f"{key}={value}"]
-        parameters.append(params_obj)
+    parameters_file = None
+    if params:
+        parameters_file = f"{tmp_dir}/{deployment_name}_parameters.json"
+        write_arm_parameters_file(parameters_file, typed_arm_parameters(arm_template_file, params))
+        parameters.append([f"@{parameters_file}"])
 
     if complete_deployment:
         mode = "Complete"
     else:
         mode = "Incremental"
 
-    deployment = deploy_arm_template_at_resource_group(
-        cmd, resource_group_name=resource_group, template_file=arm_template_file, deployment_name=deployment_name, mode=mode, no_prompt=no_prompt, parameters=parameters, no_wait=False
-    )
-    return deployment.result().as_dict().get("properties", {}).get("output_resources", {}), deployment.result().as_dict().get("properties", {}).get("outputs", {})
+    try:
+        deployment = deploy_arm_template_at_resource_group(
+            cmd, resource_group_name=resource_group, template_file=arm_template_file, deployment_name=deployment_name, mode=mode, no_prompt=no_prompt, parameters=parameters, no_wait=False
+        )
+        result = deployment.result().as_dict().get("properties", {})
+    finally:
+        if parameters_file and file_exists(parameters_file):
+            os.remove(parameters_file)  # secure params are not kept on disk
+    return result.get("output_resources", {}), result.get("outputs", {})
 
 
 def run_terraform_apply(deployment_name, terraform_dir, tmp_dir, params=None, no_prompt=False):
@@ -0,0 +1,57 @@
+''' Provisioner test'''
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from knack.util import CLIError
+from azext_cdf.provisioner import typed_arm_parameters, write_arm_parameters_file, run_arm_deployment
+
+# pylint: disable=C0111
+
+
+class TestArmParameters(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.template_file = os.path.join(self.dirpath, "template.json")
+        declarations = {"name": {"type": "string"}, "count": {"type": "int"}, "enabled": {"type": "bool"}, "tags": {"type": "object"}, "rules": {"type": "array"}}
+        with open(self.template_file, "w") as out_file:
+            json.dump({"parameters": declarations}, out_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_typed_parameters(self):
+        params = {"name": 1, "Count": "3", "enabled": "True", "tags": "{'a': 'b'}", "rules": [{"port": 22}], "undeclared": {"x": 1}}
+        self.assertEqual(
+            typed_arm_parameters(self.template_file, params),
+            {"name": "1", "Count": 3, "enabled": True, "tags": {"a": "b"}, "rules": [{"port": 22}], "undeclared": {"x": 1}},
+        )
+        with self.assertRaises(CLIError):
+            typed_arm_parameters(self.template_file, {"count": "three"})
+
+    def test_parameters_file(self):
+        filepath = os.path.join(self.dirpath, "parameters.json")
+        write_arm_parameters_file(filepath, {"tags": {"a": "b"}})
+        with open(filepath) as in_file:
+            self.assertEqual(json.load(in_file)["parameters"], {"tags": {"value": {"a": "b"}}})
+        os.chmod(filepath, 0o644)
+        write_arm_parameters_file(filepath, {"password": "secret"})
+        with open(filepath) as in_file:
+            self.assertEqual(json.load(in_file)["parameters"], {"password": {"value": "secret"}})
+        if os.name == "posix":
+            self.assertEqual(os.stat(filepath).st_mode & 0o777, 0o600)
+
+
+    @patch("azext_cdf.provisioner.deploy_arm_template_at_resource_group", side_effect=CLIError("failed"))
+    def test_parameters_file_removed(self, mock_deploy):
+        with self.assertRaises(CLIError):
+            run_arm_deployment(None, "name", self.template_file, "rg", self.dirpath, params={"name": "secret"})
+        self.assertEqual(mock_deploy.call_args[1]["parameters"], [[f"@{self.dirpath}/name_parameters.json"]])
+        self.assertFalse(os.path.exists(f"{self.dirpath}/name_parameters.json"))
+
+
+if __name__ == '__main__':
+    unittest.main()
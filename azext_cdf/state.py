@@ -1,34 +1,156 @@
 ''' Handeling the state file '''
 
+from collections import deque
+from contextlib import contextmanager
 from copy import deepcopy
 from datetime import datetime
+import atexit
+import gzip
+import hashlib
+import json
 import os
+import time
+import weakref
 import semver
 from knack.util import CLIError
 from knack.log import get_logger
-from azext_cdf.utils import json_write_to_file, file_exists, file_read_content, json_load, file_http_write_json_content, file_http_read_json_content
+from azext_cdf.utils import file_exists, file_read_content, json_load, file_http_write_json_content, file_http_read_json_content
+from azext_cdf.utils import file_append_content, file_write_atomic, file_backup, file_write_content
+from azext_cdf.lock import FileLock
+from azext_cdf.state_sqlite import SqliteStore, LazyState, ALL_CHANGED, HOOKS_CHANGED
+from azext_cdf.blobs import BLOB_KEY, BlobStore, BlobResult, is_blob_ref
 from azext_cdf.version import VERSION
 # pylint: disable=W0401,W0614
 from azext_cdf._def import *
 
 _LOGGER = get_logger(__name__)
 
+# checkpoint levels, a policy writes pending changes at checkpoints of its level or higher
+_FLUSH_LEVELS = {STATE_FLUSH_ALWAYS: 0, STATE_FLUSH_HOOK: 1, STATE_FLUSH_PHASE: 2}
+EVENTS_LOG_MAX_BYTES = 1024 * 1024
+EVENTS_LOG_SEGMENTS = 5
+EVENTS_RETENTION_SLACK = 1.5  # compact once the log holds this times the retained count
+EVENT_TIMESTAMP_FORMAT = "%H:%M:%S %d/%m/%Y"
+
+
+def events_log_filepath(state_file):
+    ''' Return the events log path of a state file i.e. state.events.jsonl for state.json '''
+
+    return f"{os.path.splitext(state_file)[0]}.events.jsonl"
+
+
+def _read_events(filepath):
+    ''' Yield events of an events log or a compressed segment, partially written lines are skipped '''
+
+    if not file_exists(filepath):
+        return
+    opener = gzip.open if filepath.endswith(".gz") else open
+    try:
+        with opener(filepath, "rt") as in_file:
+            for line in in_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    _LOGGER.debug("Skipping a partially written event in '%s'", filepath)
+    except (OSError, EOFError) as error:
+        raise CLIError(f"Failed to read events from '{filepath}'. Error: {str(error)}") from error
+
+
+def _event_epoch(event):
+    ''' Return the epoch of an event, events written by older versions only have a local timestamp '''
+
+    epoch = event.get("epoch")
+    if epoch is not None:
+        return epoch
+    try:
+        return datetime.strptime(event["timestamp"], EVENT_TIMESTAMP_FORMAT).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0
 
-class State():
-    ''' The state class '''
 
-    def __init__(self, state_file, locking=True, ignore_lock_error=False):
+def _event_matches(event, since, phase, hook):
+    if since is not None and _event_epoch(event) < since:
+        return False
+    if phase is not None and event["phase"] != phase:
+        return False
+    return hook is None or event["hook"] == hook
+
+
+def _flush_at_exit(state_ref):
+    state = state_ref()
+    if state is None:
+        return
+    try:
+        state.close()
+    except CLIError as error:
+        _LOGGER.warning("Failed to write pending state changes. %s", str(error))
+
+
+class State():
+    ''' The state class, a file://, sqlite:// or http(s):// state '''
+
+    def __init__(
+        self,
+        state_file,
+        locking=True,
+        ignore_lock_error=False,
+        flush_policy=STATE_FLUSH_ALWAYS,
+        durability=STATE_DURABILITY_FSYNC,
+        retention=None,
+        lock_timeout=0,
+        cache_dir=None,
+        blob_dir=None,
+    ):
         self.config_hooks = None
+        self.retention = CONFIG_STATE_RETENTION_DEFAULT if retention is None else retention
+        self.flush_policy = flush_policy
+        self.durability = durability
+        self._backup = False  # state file on disk is a good snapshot to backup before it is replaced
+        self.writes = 0
+        self._dirty = False
+        self._batch_depth = 0
+        self._last_flush = time.monotonic()
+        self._pending_events = []
+        self._file_lock = None
+        self._locking = locking
+        self._etag = None
+        self._http_cache_file = None
+        self._sqlite = None
+        self._changes = set()  # rows changed since the last write of a sqlite state
+        self.created = False
+        atexit.register(_flush_at_exit, weakref.ref(self))
         if state_file.startswith('file://'):
             self.state_file = state_file[len("file://"):]
+            self.events_file = events_log_filepath(self.state_file)
+            self.state_url = None
+            self._lock(self.state_file, locking, ignore_lock_error, lock_timeout)
+        elif state_file.startswith('sqlite://'):
+            self.state_file = None
+            self.events_file = None
             self.state_url = None
+            sqlite_file = state_file[len("sqlite://"):]
+            if locking:  # readers rely on WAL and never block the writer
+                self._lock(sqlite_file, locking, ignore_lock_error, lock_timeout)
+            self._sqlite = SqliteStore(sqlite_file, durability=durability)
         elif state_file.startswith('http://') or state_file.startswith('https://'):
             self.state_file = None
+            self.events_file = None  # events are kept in the state document
             self.state_url = state_file
+            if cache_dir:
+                self._http_cache_file = os.path.join(cache_dir, f"state-{hashlib.sha1(state_file.encode('utf-8')).hexdigest()}.json")
         else:
-            raise CLIError(f"Error unsupported schmea for state file '{state_file}' supported schemas 'file://'|'https://'|'http://'")
-        if self._read_state():
-            self._lock(locking, ignore_lock_error)
+            raise CLIError(f"Error unsupported schmea for state file '{state_file}' supported schemas 'file://'|'sqlite://'|'https://'|'http://'")
+        self._blobs = BlobStore(blob_dir) if blob_dir and self.state_url is None else None  # blobs are local
+        self._blob_views = {}  # (hook, op) -> (op result, BlobResult) so blobs are read once per op result
+        self._blob_garbage = False  # a blob reference was replaced since the last prune
+        existing = self._read_state()
+        if not locking:
+            self._unlock()  # snapshots are replaced atomically, a reader doesn't block writers once read
+        if existing:
+            if self.state_db.pop("LOCK", None) is not None:  # lock of older versions
+                self._dirty = True
+            if locking:
+                self.flush()  # upgraded state
             return
         # New state file
         self.state_db = {
@@ -36,15 +158,22 @@ class State():
             STATE_PHASE: STATE_PHASE_UNKNOWN,
             STATE_LASTUPDATE: self._timestamp(),
             STATE_STATUS: -1,
-            STATE_EVENTS: [],
+            STATE_STATUS_EVENT: None,
+            STATE_EVENTS_COUNT: 0,
+            STATE_EVENTS_LOG_COUNT: 0,
+            STATE_EVENTS_LOG_OLDEST: None,
             STATE_VERSION: VERSION,
             STATE_STORE: {},
             STATE_HOOKS_RESULT: {},
             STATE_RESOURCE_GROUP: None,
             STATE_UP_RESULT: {STATE_UP_RESULT_OUTPUTS: {}, STATE_UP_RESULT_RESOURCES: {}},
         }
+        self.created = True
+        self._changes.add(ALL_CHANGED)
+        self._remove_stale_files()  # events and backup of a removed state
         self._setup_hooks_reference()
-        self.add_event("Created a state file", status=STATE_STATUS_UNKNOWN, flush=True)
+        self.add_event("Created a state file", status=STATE_STATUS_UNKNOWN, flush=False)
+        self.flush()
 
     def setup(self, deployment_name, resource_group, config_hooks):
         ''' Check if resource group is mapping to state else raise an error'''
@@ -69,7 +198,7 @@ class State():
             raise CLIError("state error seems you have changed the deployment name to '{}', the state has this deployment name: {}".format(self.state_db[STATE_DEPLOYMENT_NAME], deployment_name))
         self._version_compare()
         self._setup_hooks_reference()
-        self._flush_state()
+        self._flush_state(level=STATE_FLUSH_PHASE)  # deployment is bound to state
 
     def _version_compare(self):
         ''' Check if state version '''
@@ -84,56 +213,313 @@ class State():
             pass
 
     def _setup_hooks_reference(self):
-        # TODO to complex refactor
-        # hooks/ops in state db but not config_db
-        current_state_db_hooks = deepcopy(self.state_db[STATE_HOOKS_RESULT])
-        for state_hook in current_state_db_hooks:
-            if state_hook in self.config_hooks:
-                for state_op in current_state_db_hooks[state_hook]:
-                    if state_op[0] == "_":
-                        pass  # ignore _
-                    elif state_op not in self.config_hooks[state_hook]:
-                        self.state_db[STATE_HOOKS_RESULT][state_hook].pop(state_op)
-            else:
-                self.state_db[STATE_HOOKS_RESULT].pop(state_hook)  # remove hook outdate
-
-        # hooks/ops in config db but not config_db
-        if not self.config_hooks:
+        ''' Reconcile hooks results in state with config hooks, a mapping of hook name to its named ops '''
+
+        if self.config_hooks is None:
             return
-        for config_hook in self.config_hooks:
-            if config_hook not in self.state_db[STATE_HOOKS_RESULT]:
-                self.state_db[STATE_HOOKS_RESULT][config_hook] = {}
-            for config_op in self.config_hooks[config_hook]:
-                if config_op not in self.state_db[STATE_HOOKS_RESULT][config_hook]:
-                    self.state_db[STATE_HOOKS_RESULT][config_hook][config_op] = {}
+        state_hooks = self.state_db[STATE_HOOKS_RESULT]
+        # hooks/ops in state db but not in config
+        for state_hook in list(state_hooks):
+            config_ops = self.config_hooks.get(state_hook)
+            if config_ops is None:
+                state_hooks.pop(state_hook)  # remove hook outdate
+                self._blob_garbage = True
+                continue
+            for state_op in list(state_hooks[state_hook]):
+                if state_op[0] != "_" and state_op not in config_ops:  # ignore _
+                    state_hooks[state_hook].pop(state_op)
+                    self._blob_garbage = True
+
+        # hooks/ops in config but not in state db
+        for config_hook, config_ops in self.config_hooks.items():
+            hook_result = state_hooks.setdefault(config_hook, {})
+            for config_op in config_ops:
+                hook_result.setdefault(config_op, {})
+        self._changes.add(HOOKS_CHANGED)
 
     def _read_state(self):
         if self.state_file and file_exists(self.state_file):
             # state file exists
             try:
-                state_str = file_read_content(self.state_file)
-                self.state_db = json_load(state_str)
+                self.state_db = json_load(file_read_content(self.state_file))
+                self._backup = True
             except CLIError as error:
-                raise CLIError(f"Error while reading/decoding state '{self.state_file}' Did you try to change it manually. {str(error)}") from error
+                self.state_db = self._read_backup(error)
+                self._dirty = True  # replace the corrupt state file with the next write
+            self._upgrade_events()
+            return True
+        if self.state_url:
+            return self._read_http_state()
+        if self._sqlite is not None and self._sqlite.exists():
+            self.state_db = self._sqlite.load()
             return True
-        if self.state_url:  # TODO need to add check if path
-            self.state_db = file_http_read_json_content(self.state_url)
         return False
 
-    def _flush_state(self, flush=True):
-        if not flush:
+    def _read_http_state(self):
+        ''' Read the state document, the cached copy is used if the document is not modified '''
+
+        cached = {}
+        if self._http_cache_file and file_exists(self._http_cache_file):
+            try:
+                cached = json_load(file_read_content(self._http_cache_file))
+            except CLIError:
+                cached = {}
+        status, state_db, etag = file_http_read_json_content(self.state_url, etag=cached.get("etag"))
+        if status == 404:
+            return False
+        if status == 304:
+            state_db = cached["state"]
+        self.state_db = state_db
+        self._etag = etag
+        if status != 304:
+            self._write_http_cache()
+        return True
+
+    def _write_http_cache(self):
+        if not self._http_cache_file or not self._etag:
+            return
+        try:
+            file_write_content(self._http_cache_file, json.dumps({"etag": self._etag, "state": self.state_db}))
+        except CLIError as error:
+            _LOGGER.debug("Failed to cache state. %s", str(error))
+
+    def _read_backup(self, error):
+        ''' Return the last good snapshot if the state file is corrupt i.e. interrupted write '''
+
+        backup_filepath = self.state_file + STATE_BACKUP_SUFFIX
+        try:
+            state_db = json_load(file_read_content(backup_filepath))
+        except CLIError:
+            raise CLIError(f"Error while reading/decoding state '{self.state_file}' Did you try to change it manually. {str(error)}") from error
+        _LOGGER.warning("State '%s' is corrupt, using last good snapshot '%s'. %s", self.state_file, backup_filepath, str(error))
+        return state_db
+
+    def _upgrade_events(self):
+        ''' Move events of a state written by an older version to the events log '''
+
+        events = self.state_db.pop(STATE_EVENTS, None)
+        if events is not None:
+            status = self.state_db.get(STATE_STATUS, -1)
+            self.state_db[STATE_STATUS_EVENT] = events[status] if events and status >= 0 else None
+            self.state_db[STATE_EVENTS_COUNT] = len(events)
+            self._pending_events.extend(events)
+            self._dirty = True
+        if STATE_EVENTS_LOG_COUNT not in self.state_db:
+            logged_events = list(_read_events(self.events_file))
+            self.state_db[STATE_EVENTS_LOG_COUNT] = len(logged_events)
+            self.state_db[STATE_EVENTS_LOG_OLDEST] = _event_epoch(logged_events[0]) if logged_events else None
+
+    def _write_events(self):
+        ''' Append pending events to the events log, events out of retention are archived once the log exceeds retention '''
+
+        if not self._pending_events or self._sqlite is not None:  # written with the sqlite state
+            return
+        if self.events_file is None:
+            events = self.state_db.setdefault(STATE_EVENTS, [])
+            events.extend(self._pending_events)
+            del events[:-self.retention.get(STATE_RETENTION_COUNT, len(events)) or None]  # no archive for remote states
+        else:
+            file_append_content(self.events_file, "".join(json.dumps(event) + "\n" for event in self._pending_events))
+            self.state_db[STATE_EVENTS_LOG_COUNT] = self.state_db.get(STATE_EVENTS_LOG_COUNT, 0) + len(self._pending_events)
+            if self.state_db.get(STATE_EVENTS_LOG_OLDEST) is None:
+                self.state_db[STATE_EVENTS_LOG_OLDEST] = _event_epoch(self._pending_events[0])
+            if self._needs_compaction():
+                self.compact()
+        self._pending_events = []
+
+    def _needs_compaction(self):
+        count = self.retention.get(STATE_RETENTION_COUNT)
+        if count and self.state_db[STATE_EVENTS_LOG_COUNT] > count * EVENTS_RETENTION_SLACK:
+            return True
+        days = self.retention.get(STATE_RETENTION_DAYS)
+        oldest = self.state_db[STATE_EVENTS_LOG_OLDEST]
+        if days and oldest is not None and oldest < time.time() - (days + 1) * 86400:  # at most daily
+            return True
+        return os.path.getsize(self.events_file) > EVENTS_LOG_MAX_BYTES
+
+    def compact(self):
+        '''
+        Archive events out of retention to a compressed segment, the events log keeps the retained events.
+        Segments are rotated, segments older than EVENTS_LOG_SEGMENTS are removed.
+        '''
+
+        if self.events_file is None or not file_exists(self.events_file):
+            return
+        events = list(_read_events(self.events_file))
+        keep_from = 0
+        count = self.retention.get(STATE_RETENTION_COUNT)
+        if count:
+            keep_from = max(keep_from, len(events) - count)
+        days = self.retention.get(STATE_RETENTION_DAYS)
+        if days:
+            cutoff = time.time() - days * 86400
+            while keep_from < len(events) and _event_epoch(events[keep_from]) < cutoff:
+                keep_from += 1
+        if os.path.getsize(self.events_file) > EVENTS_LOG_MAX_BYTES:
+            keep_from = max(keep_from, len(events) // 2)
+        if keep_from:
+            self._archive_events(events[:keep_from])
+            file_write_atomic(self.events_file, "".join(json.dumps(event) + "\n" for event in events[keep_from:]), durability=self.durability)
+        retained = events[keep_from:]
+        self.state_db[STATE_EVENTS_LOG_COUNT] = len(retained)
+        self.state_db[STATE_EVENTS_LOG_OLDEST] = _event_epoch(retained[0]) if retained else None
+        self._dirty = True
+
+    def _archive_segments(self):
+        ''' Return archive segment paths, newest first '''
+
+        return [f"{self.events_file}.{index}.gz" for index in range(1, EVENTS_LOG_SEGMENTS + 1)]
+
+    def _archive_events(self, events):
+        segments = self._archive_segments()
+        tmp_filepath = f"{segments[0]}.{os.getpid()}.tmp"
+        try:
+            with gzip.open(tmp_filepath, "wt") as out_file:
+                out_file.write("".join(json.dumps(event) + "\n" for event in events))
+            for index in range(len(segments) - 1, -1, -1):
+                if not file_exists(segments[index]):
+                    continue
+                if index == len(segments) - 1:
+                    os.remove(segments[index])
+                else:
+                    os.replace(segments[index], segments[index + 1])
+            os.replace(tmp_filepath, segments[0])
+        except OSError as error:
+            raise CLIError(f"Failed to archive events to '{segments[0]}'. Error: {str(error)}") from error
+
+    def _remove_stale_files(self):
+        if self.events_file is None:
+            return
+        for stale_file in [self.state_file + STATE_BACKUP_SUFFIX, self.events_file] + self._archive_segments():
+            try:
+                os.remove(stale_file)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                raise CLIError(f"Failed to remove stale state file '{stale_file}'. Error: {str(error)}") from error
+
+    def iter_events(self, archived=False):
+        ''' Yield events oldest first from the events log, and from archived segments if archived '''
+
+        if self._sqlite is not None:
+            yield from reversed(list(self._sqlite.iter_events()))
+        elif self.events_file is None:
+            yield from self.state_db.get(STATE_EVENTS, [])
+        else:
+            if archived:
+                for segment in reversed(self._archive_segments()):
+                    yield from _read_events(segment)
+            yield from _read_events(self.events_file)
+        yield from self._pending_events
+
+    def query_events(self, limit=None, since=None, phase=None, hook=None, archived=False):
+        ''' Return events newest first, filtered by epoch since, phase and hook, at most limit events '''
+
+        if self._sqlite is not None:  # filtered by indexed queries
+            matched = [event for event in reversed(self._pending_events) if _event_matches(event, since, phase, hook)]
+            matched.extend(self._sqlite.iter_events(since=since, phase=phase, hook=hook, limit=limit))
+            matched = matched[:limit]
+        else:
+            matched = deque((event for event in self.iter_events(archived=archived) if _event_matches(event, since, phase, hook)), maxlen=limit)
+            matched.reverse()
+        return [
+            {
+                "Timestamp": event["timestamp"],
+                "Epoch": _event_epoch(event),
+                "Phase": event["phase"],
+                "Message": event["msg"],
+                "Status": event["status"],
+                "Hook": event["hook"],
+            }
+            for event in matched
+        ]
+
+    def _flush_state(self, flush=True, level=STATE_FLUSH_ALWAYS):
+        ''' Mark state as changed and write it if flush and the policy writes at level '''
+
+        self._dirty = True
+        if flush:
+            self.checkpoint(level)
+
+    def checkpoint(self, level=STATE_FLUSH_ALWAYS):
+        '''
+        Write pending changes if the flush policy, 'always', 'hook', 'phase' or seconds between writes, writes at level.
+        Within a batch only phase checkpoints and the 'always' policy write.
+        Returns True if state was written.
+        '''
+
+        if not self._dirty:
+            return False
+        if self._batch_depth and level != STATE_FLUSH_PHASE and self.flush_policy != STATE_FLUSH_ALWAYS:
+            return False
+        if isinstance(self.flush_policy, int):
+            if level != STATE_FLUSH_PHASE and time.monotonic() - self._last_flush < self.flush_policy:
+                return False
+        elif _FLUSH_LEVELS[level] < _FLUSH_LEVELS[self.flush_policy]:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        '''
+        Write pending changes regardless of the flush policy.
+        A file state is a snapshot without events, an http state is written only if unchanged since read.
+        '''
+
+        if not self._dirty:
             return
+        if not self.writable:
+            _LOGGER.debug("State is opened read only, changes are not written")
+            return
+        self._write_events()  # events before the snapshot that points to them
         if self.state_file:
-            json_write_to_file(self.state_file, self.state_db)
+            if self._backup:
+                file_backup(self.state_file, self.state_file + STATE_BACKUP_SUFFIX, hard_link=self.durability != STATE_DURABILITY_NONE)
+            file_write_atomic(self.state_file, json.dumps(self.state_db), durability=self.durability)
+            self._backup = True
         elif self.state_url:
-            file_http_write_json_content(self.state_url, self.state_db)
+            self._etag = file_http_write_json_content(self.state_url, self.state_db, etag=self._etag)
+            self._write_http_cache()
+        elif self._sqlite is not None:
+            self._sqlite.write(self.state_db, self._changes, self._pending_events, retention=self.retention)
+            self._pending_events = []
+        self._changes = set()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self.writes += 1
+        if self._blob_garbage:
+            self.prune_blobs()
+
+    def prune_blobs(self):
+        ''' Remove blobs no longer referenced by hook results, only the writer of a state prunes its blobs '''
+
+        self._blob_garbage = False
+        if self._blobs is None or not self.writable:
+            return
+        referenced = {
+            value[BLOB_KEY] for ops in self.state_db[STATE_HOOKS_RESULT].values() for op_result in ops.values()
+            for value in op_result.values() if is_blob_ref(value)
+        }
+        removed = self._blobs.prune(referenced)
+        _LOGGER.debug("Removed %d unreferenced blobs", removed)
+
+    @contextmanager
+    def batch(self):
+        ''' Defer changes below phase checkpoints to the end of the outermost batch, changes are written on errors too '''
+
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
 
     @staticmethod
     def _timestamp():
         ''' Current timestamp '''
         # str_time ='%H:%M:%S %d/%m/%Y-%Z'  # utc
-        str_time = "%H:%M:%S %d/%m/%Y"  # local time
-        return datetime.now().strftime(str_time)
+        return datetime.now().strftime(EVENT_TIMESTAMP_FORMAT)  # local time
 
     def transition_to_phase(self, phase):
         """An alias to add event to write state transition"""
@@ -155,28 +541,36 @@ class State():
 
         if phase:
             self.state_db[STATE_PHASE] = phase
-        event = {"timestamp": self._timestamp(), "phase": self.state_db[STATE_PHASE], "msg": msg, "status": status, "hook": hook}
-        self.state_db[STATE_EVENTS].append(event)
+        event = {"timestamp": self._timestamp(), "epoch": time.time(), "phase": self.state_db[STATE_PHASE], "msg": msg, "status": status, "hook": hook}
+        self._pending_events.append(event)
+        self.state_db[STATE_EVENTS_COUNT] = self.state_db.get(STATE_EVENTS_COUNT, 0) + 1
         if status:
-            self.state_db[STATE_STATUS] = len(self.state_db[STATE_EVENTS]) - 1
-        self._flush_state(flush)
+            self.state_db[STATE_STATUS] = self.state_db[STATE_EVENTS_COUNT] - 1
+            self.state_db[STATE_STATUS_EVENT] = event
+        self._flush_state(flush, level=STATE_FLUSH_PHASE if status else STATE_FLUSH_ALWAYS)  # status changes are checkpoints
 
     def set_result(self, outputs=None, resources=None, flush=True):
         ''' Write outputs and resources to state'''
 
         if outputs:
             self.state_db[STATE_UP_RESULT][STATE_UP_RESULT_OUTPUTS] = outputs
+            self._changes.add(("result", STATE_UP_RESULT_OUTPUTS))
         if resources:
             self.state_db[STATE_UP_RESULT][STATE_UP_RESULT_RESOURCES] = resources
+            self._changes.add(("result", STATE_UP_RESULT_RESOURCES))
         self._flush_state(flush)
 
     def set_hook_state(self, hook, op_name, op_data, flush=True):
-        ''' Write hook output to the state file '''
+        ''' Write hook output to the state file, large outputs are kept in the blob store and the state keeps their hash and size '''
 
         # TODO add state success or failure
-        if not self.state_db[STATE_HOOKS_RESULT][hook].get(op_name, False):
-            self.state_db[STATE_HOOKS_RESULT][hook][op_name] = {}
-        self.state_db[STATE_HOOKS_RESULT][hook][op_name] = {**self.state_db[STATE_HOOKS_RESULT][hook][op_name], **op_data}
+        previous = self.state_db[STATE_HOOKS_RESULT][hook].get(op_name) or {}
+        op_result = dict(previous)  # references are kept as is
+        op_result.update(op_data if self._blobs is None else self._blobs.externalize(op_data))
+        if any(is_blob_ref(value) and value != op_result.get(key) for key, value in previous.items()):
+            self._blob_garbage = True  # pruned once written
+        self.state_db[STATE_HOOKS_RESULT][hook][op_name] = op_result
+        self._changes.add(("hook", hook, op_name))
         self._flush_state(flush)
 
     def store_get(self, key, value):
@@ -186,36 +580,60 @@ class State():
             return self.state_db[STATE_STORE][key]
         except KeyError:
             self.state_db[STATE_STORE][key] = value
+            self._changes.add(("store", key))
+            self._dirty = True  # written with the next change
             return value
 
-    def _lock(self, locking, ignore_lock_error):
-        if not locking:
-            return True
-        this_pid = os.getpid()
-        if this_pid == self.state_db.get("LOCK", None):
-            return True
-        if self.state_db.get("LOCK", None) is None:
-            self.state_db["LOCK"] = this_pid
-            self._flush_state(flush=True)
-            return True
-        # No
+    def _lock(self, filepath, locking, ignore_lock_error, lock_timeout):
+        '''
+        Lock the sidecar lock file of the state before it is read, exclusive if locking else shared.
+        Waits up to lock_timeout seconds for a lock held by another process.
+        '''
+
+        file_lock = FileLock(filepath + STATE_LOCK_SUFFIX, timeout=lock_timeout)
         try:
-            os.kill(self.state_db["LOCK"], 0)
-        except OSError:
-            # process does not exist, stale pid
-            self.state_db["LOCK"] = this_pid
-            self._flush_state(flush=True)
-            return True
-        else:
+            file_lock.acquire(exclusive=locking)
+        except CLIError:
             if not ignore_lock_error:
-                raise CLIError(f"State is locked by PID {self.state_db['LOCK']}")
+                raise
+            return False
+        self._file_lock = file_lock
+        weakref.finalize(self, file_lock.release).atexit = False  # released by close on exit
+        return True
+
+    @property
+    def writable(self):
+        '''
+        True if changes are written, a local state is only written while holding the exclusive lock.
+        A state opened without locking is read only, its changes are kept in memory.
+        '''
+
+        if not self._locking:
             return False
+        if self.state_url:
+            return True
+        return self._file_lock is not None and self._file_lock.exclusive
+
+    def close(self):
+        ''' Write pending changes and release the state lock '''
+
+        try:
+            self.flush()
+        finally:
+            self._unlock()
+
+    def _unlock(self):
+        ''' Release the state lock if held '''
+
+        if self._file_lock is not None:
+            self._file_lock.release()
+            self._file_lock = None
 
     @property
     def status(self):
         ''' Return status from state file'''
 
-        last_status_event = self.state_db[STATE_EVENTS][self.state_db[STATE_STATUS]]
+        last_status_event = self.state_db.get(STATE_STATUS_EVENT) or {"status": None, "msg": None}
         return_status = {
             "Name": self.state_db[STATE_DEPLOYMENT_NAME],
             "Phase": self.state_db[STATE_PHASE],
@@ -229,20 +647,9 @@ class State():
 
     @property
     def events(self):
-        ''' Return the events from state file '''
-
-        return_events = []
-        for event in reversed(self.state_db[STATE_EVENTS]):
-            return_events.append(
-                {
-                    "Timestamp": event["timestamp"],
-                    "Phase": event["phase"],
-                    "Message": event["msg"],
-                    "Status": event["status"],
-                    "Hook": event["hook"],
-                }
-            )
-        return return_events
+        ''' Return the retained events newest first '''
+
+        return self.query_events()
 
     @property
     def result_up(self):
@@ -252,12 +659,53 @@ class State():
 
     @property
     def result_hooks(self):
-        ''' Return the results for all hooks'''
+        ''' Return the results for all hooks, blobs are read on first access, the state keeps the references '''
 
-        return self.state_db[STATE_HOOKS_RESULT]
+        hooks = self.state_db[STATE_HOOKS_RESULT]
+        if self._blobs is None:
+            return hooks
+        return {hook: {op_name: self._blob_view(hook, op_name, op_result) for op_name, op_result in ops.items()} for hook, ops in hooks.items()}
+
+    def _blob_view(self, hook, op_name, op_result):
+        if not any(is_blob_ref(value) for value in op_result.values()):
+            return op_result
+        view = self._blob_views.get((hook, op_name))
+        if view is None or view[0] is not op_result:
+            view = self._blob_views[(hook, op_name)] = (op_result, BlobResult(self._blobs, op_result))
+        return view[1]
 
     @property
     def state(self):
         ''' Return the state dict '''
 
+        if isinstance(self.state_db, LazyState):
+            return self.state_db.load_all()
         return self.state_db
+
+    def _copy_op_result(self, other, op_result):
+        ''' Return an op result of other with its blobs copied to the blob store of this state, or inlined if it has none '''
+
+        copied = {}
+        for key, value in op_result.items():
+            if is_blob_ref(value) and other._blobs is not None:  # pylint: disable=protected-access
+                content = other._blobs.get(value)  # pylint: disable=protected-access
+                value = self._blobs.put(content) if self._blobs is not None else content
+            copied[key] = value
+        return copied
+
+    def replace_with(self, other):
+        ''' Replace this state with the state and events of other i.e. to migrate a state to another backend '''
+
+        self.state_db = deepcopy(dict(other.state))
+        for ops in self.state_db.get(STATE_HOOKS_RESULT, {}).values():
+            for op_name, op_result in ops.items():
+                ops[op_name] = self._copy_op_result(other, op_result)
+        self.state_db.pop(STATE_EVENTS, None)
+        self.state_db.pop("LOCK", None)
+        self.state_db[STATE_EVENTS_LOG_COUNT] = 0
+        self.state_db[STATE_EVENTS_LOG_OLDEST] = None
+        self._remove_stale_files()
+        self._pending_events = list(other.iter_events(archived=True))
+        self._changes.add(ALL_CHANGED)
+        self._flush_state(flush=False)
+        self.flush()
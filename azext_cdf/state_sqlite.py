@@ -0,0 +1,166 @@
+''' State tables in a sqlite database '''
+
+import json
+import sqlite3
+import time
+from knack.util import CLIError
+# pylint: disable=W0401,W0614
+from azext_cdf._def import *
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, epoch REAL, timestamp TEXT, phase TEXT, hook TEXT, status TEXT, msg TEXT
+);
+CREATE INDEX IF NOT EXISTS events_epoch ON events (epoch);
+CREATE INDEX IF NOT EXISTS events_phase ON events (phase, id);
+CREATE INDEX IF NOT EXISTS events_hook ON events (hook, id);
+CREATE TABLE IF NOT EXISTS hook_results (hook TEXT, op TEXT, data TEXT, PRIMARY KEY (hook, op));
+CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS results (kind TEXT PRIMARY KEY, value TEXT);
+'''
+
+_SYNCHRONOUS = {STATE_DURABILITY_NONE: "OFF", STATE_DURABILITY_RENAME: "NORMAL", STATE_DURABILITY_FSYNC: "FULL"}
+# state keys kept in their own tables, the other keys are rows of meta
+SECTIONS = (STATE_HOOKS_RESULT, STATE_STORE, STATE_UP_RESULT)
+ALL_CHANGED = ("all",)
+HOOKS_CHANGED = ("hooks",)
+
+
+class LazyState(dict):
+    ''' State dict of a sqlite state, hooks, store and results are loaded on first access '''
+
+    def __init__(self, store, meta):
+        super().__init__(meta)
+        self._store = store
+
+    def __missing__(self, key):
+        if key not in SECTIONS:
+            raise KeyError(key)
+        value = self[key] = self._store.load_section(key)
+        return value
+
+    def load_all(self):
+        ''' Load all sections and return self '''
+
+        for key in SECTIONS:
+            self[key]  # pylint: disable=pointless-statement
+        return self
+
+
+class SqliteStore():
+    '''
+    Metadata, events, hook op results, store keys and up results in tables of a sqlite database in WAL mode,
+    readers don't block the writer. Changes are written as row upserts in a single transaction.
+    '''
+
+    def __init__(self, filepath, durability=STATE_DURABILITY_FSYNC):
+        self.filepath = filepath
+        try:
+            self._db = sqlite3.connect(filepath, isolation_level=None, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(f"PRAGMA synchronous={_SYNCHRONOUS[durability]}")
+            self._db.executescript(_SCHEMA)
+        except sqlite3.Error as error:
+            raise CLIError(f"Failed to open sqlite state '{filepath}'. Error: {str(error)}") from error
+
+    def exists(self):
+        ''' Return True if the database holds a state '''
+
+        return self._db.execute("SELECT 1 FROM meta LIMIT 1").fetchone() is not None
+
+    def load(self):
+        ''' Return a state dict, sections are loaded lazily '''
+
+        return LazyState(self, {key: json.loads(value) for key, value in self._db.execute("SELECT key, value FROM meta")})
+
+    def load_section(self, key):
+        ''' Return hooks, store or up results '''
+
+        if key == STATE_HOOKS_RESULT:
+            hooks = {}
+            for hook, op_name, data in self._db.execute("SELECT hook, op, data FROM hook_results ORDER BY rowid"):
+                hooks.setdefault(hook, {})
+                if op_name is not None:
+                    hooks[hook][op_name] = json.loads(data)
+            return hooks
+        if key == STATE_STORE:
+            return {store_key: json.loads(value) for store_key, value in self._db.execute("SELECT key, value FROM store")}
+        results = {STATE_UP_RESULT_OUTPUTS: {}, STATE_UP_RESULT_RESOURCES: {}}
+        results.update({kind: json.loads(value) for kind, value in self._db.execute("SELECT kind, value FROM results")})
+        return results
+
+    def _write_hooks(self, hooks):
+        self._db.execute("DELETE FROM hook_results")
+        for hook, ops in hooks.items():
+            self._db.execute("INSERT INTO hook_results VALUES (?, NULL, NULL)", (hook,))  # hooks without named ops
+            self._db.executemany("INSERT INTO hook_results VALUES (?, ?, ?)", [(hook, op_name, json.dumps(data)) for op_name, data in ops.items()])
+
+    def write(self, state_db, changes, events, retention=None):
+        '''
+        Write meta rows, changed rows and new events in a transaction.
+        changes holds ("hook", hook, op), ("store", key), ("result", kind), HOOKS_CHANGED or ALL_CHANGED.
+        '''
+
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+            meta = [(key, json.dumps(value)) for key, value in state_db.items() if key not in SECTIONS and key != STATE_EVENTS]
+            self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+            if ALL_CHANGED in changes:
+                self._db.execute("DELETE FROM events")
+                self._db.execute("DELETE FROM store")
+                self._db.execute("DELETE FROM results")
+                changes = {("store", key) for key in state_db[STATE_STORE]} | {("result", kind) for kind in state_db[STATE_UP_RESULT]} | {HOOKS_CHANGED}
+            if HOOKS_CHANGED in changes:
+                self._write_hooks(state_db[STATE_HOOKS_RESULT])
+            for change in changes:
+                if change[0] == "hook" and HOOKS_CHANGED not in changes:
+                    data = state_db[STATE_HOOKS_RESULT][change[1]][change[2]]
+                    self._db.execute("INSERT OR REPLACE INTO hook_results VALUES (?, ?, ?)", (change[1], change[2], json.dumps(data)))
+                elif change[0] == "store":
+                    self._db.execute("INSERT OR REPLACE INTO store VALUES (?, ?)", (change[1], json.dumps(state_db[STATE_STORE][change[1]])))
+                elif change[0] == "result":
+                    self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (change[1], json.dumps(state_db[STATE_UP_RESULT][change[1]])))
+            self._db.executemany(
+                "INSERT INTO events (epoch, timestamp, phase, hook, status, msg) VALUES (?, ?, ?, ?, ?, ?)",
+                [(event.get("epoch"), event["timestamp"], event["phase"], event["hook"], event["status"], event["msg"]) for event in events],
+            )
+            self._prune_events(retention or {})
+            self._db.execute("COMMIT")
+        except sqlite3.Error as error:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            raise CLIError(f"Failed to write sqlite state '{self.filepath}'. Error: {str(error)}") from error
+
+    def _prune_events(self, retention):
+        ''' Delete events out of retention '''
+
+        count = retention.get(STATE_RETENTION_COUNT)
+        if count:
+            self._db.execute("DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?", (count,))
+        days = retention.get(STATE_RETENTION_DAYS)
+        if days:
+            self._db.execute("DELETE FROM events WHERE epoch < ?", (time.time() - days * 86400,))
+
+    def iter_events(self, since=None, phase=None, hook=None, limit=None):
+        ''' Yield events newest first, filtered by epoch since, phase and hook, at most limit events '''
+
+        query = "SELECT epoch, timestamp, phase, hook, status, msg FROM events"
+        where, args = [], []
+        for column, operator, value in (("epoch", ">=", since), ("phase", "=", phase), ("hook", "=", hook)):
+            if value is not None:
+                where.append(f"{column} {operator} ?")
+                args.append(value)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        for epoch, timestamp, event_phase, event_hook, status, msg in self._db.execute(query, args):
+            yield {"timestamp": timestamp, "epoch": epoch, "phase": event_phase, "msg": msg, "status": status, "hook": event_hook}
+
+    def close(self):
+        ''' Close the database connection '''
+
+        self._db.close()
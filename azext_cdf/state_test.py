@@ -0,0 +1,401 @@
+''' State test'''
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+from mock import patch
+from knack.util import CLIError
+from azext_cdf.state import State, events_log_filepath
+from azext_cdf._def import STATE_FLUSH_ALWAYS, STATE_FLUSH_HOOK, STATE_FLUSH_PHASE, STATE_PHASE_UP, STATE_PHASE_GOING_UP, STATE_STATUS_SUCCESS
+from azext_cdf._def import STATE_DURABILITY_NONE, STATE_DURABILITY_RENAME, STATE_DURABILITY_FSYNC
+
+# pylint: disable=C0111
+
+
+class _StateHandler(BaseHTTPRequestHandler):
+    documents = {}
+    requests = []
+    fail_next_put = False  # apply the write but respond with an error
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        document = self.documents.get(self.path)
+        _StateHandler.requests.append(("GET", self.headers.get("If-None-Match")))
+        if document is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body, etag = document
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        _StateHandler.requests.append(("PUT", self.headers.get("If-Match") or self.headers.get("If-None-Match")))
+        document = self.documents.get(self.path)
+        if (document and self.headers.get("If-Match") != document[1]) or (not document and self.headers.get("If-None-Match") != "*"):
+            self.send_response(412)
+            self.end_headers()
+            return
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.documents[self.path] = (body, etag)
+        if _StateHandler.fail_next_put:
+            _StateHandler.fail_next_put = False
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestStateFlush(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.state_file = f"{self.dirpath}/state.json"
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def _state(self, flush_policy):
+        state = State(f"file://{self.state_file}", flush_policy=flush_policy)
+        state.setup("name", "rg", {"hello": {"op": {}}})
+        state.writes = 0
+        return state
+
+    def _events_on_disk(self):
+        with open(events_log_filepath(self.state_file)) as in_file:
+            return len(in_file.readlines())
+
+    def _run_hook(self, state):
+        state.add_event("Running hook", hook="hello")
+        state.set_hook_state("hello", "op", {"stdout": "out"})
+        state.add_event("Finished running hook", hook="hello")
+        state.checkpoint(STATE_FLUSH_HOOK)
+
+    def test_always(self):
+        state = self._state(STATE_FLUSH_ALWAYS)
+        self._run_hook(state)
+        self.assertEqual(state.writes, 3)
+
+    def test_hook(self):
+        state = self._state(STATE_FLUSH_HOOK)
+        self._run_hook(state)
+        self.assertEqual(state.writes, 1)
+        self.assertEqual(self._events_on_disk(), 3)
+
+    def test_phase(self):
+        state = self._state(STATE_FLUSH_PHASE)
+        self._run_hook(state)
+        self.assertEqual(state.writes, 0)
+        state.completed_phase(STATE_PHASE_UP, STATE_STATUS_SUCCESS)
+        self.assertEqual(state.writes, 1)
+        self.assertEqual(self._events_on_disk(), 4)
+
+    def test_interval(self):
+        with patch("azext_cdf.state.time.monotonic", return_value=100):
+            state = self._state(10)
+            state.add_event("first")
+        self.assertEqual(state.writes, 0)
+        with patch("azext_cdf.state.time.monotonic", return_value=111):
+            state.add_event("second")
+        self.assertEqual(state.writes, 1)
+
+    def test_batch(self):
+        state = self._state(STATE_FLUSH_HOOK)
+        with self.assertRaises(CLIError):
+            with state.batch():
+                with state.batch():
+                    self._run_hook(state)
+                self.assertEqual(state.writes, 0)
+                raise CLIError("failed")
+        self.assertEqual(state.writes, 1)  # written on error
+        self.assertEqual(self._events_on_disk(), 3)
+
+    def test_batch_phase_checkpoint(self):
+        state = self._state(STATE_FLUSH_HOOK)
+        with state.batch():
+            state.add_event("deferred")
+            self.assertEqual(state.writes, 0)
+            state.transition_to_phase(STATE_PHASE_GOING_UP)
+            self.assertEqual(state.writes, 1)
+            with open(self.state_file) as in_file:
+                self.assertEqual(json.load(in_file)["phase"], STATE_PHASE_GOING_UP)
+        state.close()
+        state = self._state(STATE_FLUSH_ALWAYS)
+        with state.batch():
+            state.add_event("written")
+            self.assertEqual(state.writes, 1)
+
+
+class TestStateEvents(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.state_file = f"{self.dirpath}/state.json"
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_events_log(self):
+        state = State(f"file://{self.state_file}")
+        state.add_event("hello", hook="hook")
+        state.add_event("failed", status=STATE_STATUS_SUCCESS)
+        with open(self.state_file) as in_file:
+            snapshot = json.load(in_file)
+        self.assertNotIn("events", snapshot)
+        self.assertEqual(snapshot["events_count"], 3)
+        self.assertEqual(snapshot["status_event"]["msg"], "failed")
+        state = State(f"file://{self.state_file}", locking=False)
+        self.assertEqual(state.status["StatusMessage"], "failed")
+        self.assertEqual([event["Message"] for event in state.events], ["failed", "hello", "Created a state file"])
+
+    def test_upgrade_events(self):
+        events = [{"timestamp": "t", "phase": "up", "msg": f"msg {i}", "status": None, "hook": None} for i in range(3)]
+        with open(self.state_file, "w") as out_file:
+            json.dump({"name": None, "phase": "up", "lastUpdate": "t", "status": 1, "events": events, "version": "0.0.1", "store": {},
+                       "hooks": {}, "resource_group": None, "result": {}}, out_file)
+        state = State(f"file://{self.state_file}")  # lock writes the upgraded state
+        self.assertEqual(state.status["StatusMessage"], "msg 1")
+        self.assertEqual(len(state.events), 3)
+        with open(events_log_filepath(self.state_file)) as in_file:
+            self.assertEqual(len(in_file.readlines()), 3)
+
+    def test_compact(self):
+        state = State(f"file://{self.state_file}", retention={"count": 2})
+        with patch("azext_cdf.state.EVENTS_LOG_SEGMENTS", 2):
+            for i in range(9):
+                state.add_event(f"event {i}")
+        self.assertEqual([event["Message"] for event in state.events], ["event 8", "event 7"])
+        archived = [event["Message"] for event in state.query_events(archived=True)]
+        self.assertEqual(archived[:3], ["event 8", "event 7", "event 6"])
+        self.assertNotIn("Created a state file", archived)  # oldest segment is dropped
+        self.assertEqual(sorted(os.listdir(self.dirpath)), ["state.events.jsonl", "state.events.jsonl.1.gz", "state.events.jsonl.2.gz", "state.json", "state.json.bak", "state.json.lock"])
+
+    def test_retention_days(self):
+        with patch("azext_cdf.state.time") as mock_time:
+            mock_time.time.return_value = 1000000.0
+            mock_time.monotonic.return_value = 0
+            state = State(f"file://{self.state_file}", retention={"days": 1})
+            state.add_event("old")
+            mock_time.time.return_value += 3 * 86400
+            state.add_event("new")
+        self.assertEqual([event["Message"] for event in state.events], ["new"])
+        self.assertEqual(len(state.query_events(archived=True)), 3)
+
+    def test_query_events(self):
+        with patch("azext_cdf.state.time") as mock_time:
+            mock_time.monotonic.return_value = 0
+            mock_time.time.return_value = 0.0
+            state = State(f"file://{self.state_file}", locking=False)
+            for i in range(4):
+                mock_time.time.return_value = 1000.0 + i
+                state.add_event(f"event {i}", phase=STATE_PHASE_UP if i == 2 else None, hook="hook" if i % 2 else None)
+        self.assertEqual([event["Message"] for event in state.query_events(limit=2)], ["event 3", "event 2"])
+        self.assertEqual([event["Message"] for event in state.query_events(since=1002)], ["event 3", "event 2"])
+        self.assertEqual([event["Message"] for event in state.query_events(hook="hook", phase=STATE_PHASE_UP)], ["event 3"])
+        self.assertEqual([event["Message"] for event in state.query_events(hook="hook")], ["event 3", "event 1"])
+        self.assertEqual(state.query_events(limit=1)[0]["Epoch"], 1003.0)
+
+    def test_legacy_event_epoch(self):
+        with open(events_log_filepath(self.state_file), "w") as out_file:
+            out_file.write(json.dumps({"timestamp": "10:00:00 01/01/2021", "phase": "up", "msg": "legacy", "status": None, "hook": None}) + "\n")
+            out_file.write("{partial\n")
+        with open(self.state_file, "w") as out_file:
+            json.dump({"name": None, "phase": "up", "lastUpdate": "t", "status": -1, "version": "0.0.1", "store": {},
+                       "hooks": {}, "resource_group": None, "result": {}}, out_file)
+        state = State(f"file://{self.state_file}", locking=False)
+        self.assertEqual(state.query_events()[0]["Epoch"], datetime(2021, 1, 1, 10).timestamp())
+        self.assertEqual(state.query_events(since=datetime(2021, 1, 2).timestamp()), [])
+
+
+class TestStateDurability(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.state_file = f"{self.dirpath}/state.json"
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_corrupt_state_uses_backup(self):
+        for durability in (STATE_DURABILITY_NONE, STATE_DURABILITY_RENAME, STATE_DURABILITY_FSYNC):
+            state = State(f"file://{self.state_file}", durability=durability)
+            state.setup("name", "rg", {})
+            state.add_event("first", status=STATE_STATUS_SUCCESS)
+            state.add_event("second", status=STATE_STATUS_SUCCESS)
+            with open(self.state_file) as in_file:
+                content = in_file.read()
+            with open(self.state_file, "w") as out_file:
+                out_file.write(content[:len(content) // 2])  # interrupted write
+            state = State(f"file://{self.state_file}")
+            self.assertEqual(state.status["StatusMessage"], "first")
+            self.assertEqual(state.status["Name"], "name")
+            state.flush()  # corrupt file is replaced
+            with open(self.state_file) as in_file:
+                self.assertEqual(json.load(in_file)["status_event"]["msg"], "first")
+            os.remove(self.state_file)
+        self.assertEqual(sorted(os.listdir(self.dirpath)), ["state.events.jsonl", "state.json.bak", "state.json.lock"])  # no temp files left
+
+    def test_corrupt_state_without_backup(self):
+        with open(self.state_file, "w") as out_file:
+            out_file.write("{")
+        with self.assertRaises(CLIError):
+            State(f"file://{self.state_file}")
+
+
+class TestStateHttp(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _StateHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/state.json"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _StateHandler.documents = {}
+        _StateHandler.requests = []
+        _StateHandler.fail_next_put = False
+        self.dirpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_read_write(self):
+        state = State(self.url, cache_dir=self.dirpath)
+        state.setup("name", "rg", {})
+        state.add_event("x" * 2048, status=STATE_STATUS_SUCCESS)  # gzip body
+        self.assertEqual(_StateHandler.requests[:2], [("GET", None), ("PUT", "*")])
+        _StateHandler.requests = []
+        state = State(self.url, cache_dir=self.dirpath)
+        self.assertEqual(state.status["StatusMessage"], "x" * 2048)
+        self.assertEqual(_StateHandler.requests, [("GET", _StateHandler.documents["/state.json"][1])])  # not modified, read from cache
+        self.assertEqual([event["Message"] for event in state.events][1:], ["Created a state file"])
+
+    def test_applied_write_not_retried(self):
+        state = State(self.url)
+        _StateHandler.fail_next_put = True
+        _StateHandler.requests = []
+        with self.assertRaises(CLIError):
+            state.add_event("first")
+        self.assertEqual([method for method, _ in _StateHandler.requests], ["PUT"])
+        state.flush()  # 412, the document is the one written
+        state.add_event("second")
+        self.assertEqual([event["Message"] for event in State(self.url).events][:2], ["second", "first"])
+
+    def test_migrate_inlines_blobs(self):
+        source = State(f"file://{self.dirpath}/state.json", blob_dir=f"{self.dirpath}/blobs")
+        source.setup("name", "rg", {"hello": {"op": {}}})
+        source.set_hook_state("hello", "op", {"stdout": "x" * 10000, "stderr": ""})
+        self.assertTrue(os.listdir(f"{self.dirpath}/blobs"))
+        target = State(self.url, blob_dir=f"{self.dirpath}/blobs")  # no blobs for http states
+        target.replace_with(source)
+        state = State(self.url)
+        self.assertEqual(state.result_hooks["hello"]["op"], {"stdout": "x" * 10000, "stderr": ""})
+
+    def test_conflict(self):
+        first = State(self.url)
+        second = State(self.url)
+        second.add_event("second")
+        with self.assertRaises(CLIError) as error:
+            first.add_event("first")
+        self.assertIn("changed by another process", str(error.exception))
+
+
+class TestStateSqlite(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.state_file = f"sqlite://{self.dirpath}/state.db"
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_read_write(self):
+        state = State(self.state_file)
+        state.setup("name", "rg", {"hello": {"op": {}}, "empty": {}})
+        state.set_hook_state("hello", "op", {"stdout": "out"})
+        state.set_result(outputs={"a": 1})
+        state.store_get("key", "value")
+        state.add_event("hook ran", hook="hello")
+        state.add_event("done", phase=STATE_PHASE_UP, status=STATE_STATUS_SUCCESS)
+        state.close()
+        state = State(self.state_file, locking=False)
+        self.assertEqual(state.status["StatusMessage"], "done")
+        self.assertNotIn("hooks", dict(state.state_db))  # loaded on first access
+        self.assertEqual(state.result_hooks, {"hello": {"op": {"stdout": "out"}}, "empty": {}})
+        self.assertEqual(state.result_up["outputs"], {"a": 1})
+        self.assertEqual(state.store_get("key", "other"), "value")
+        self.assertEqual([event["Message"] for event in state.events], ["done", "hook ran", "Created a state file"])
+        self.assertEqual([event["Message"] for event in state.query_events(hook="hello")], ["hook ran"])
+        self.assertEqual([event["Message"] for event in state.query_events(phase=STATE_PHASE_UP, limit=1)], ["done"])
+
+    def test_reader_does_not_block_writer(self):
+        State(self.state_file).close()
+        reader = '''
+import sys, time
+from azext_cdf.state import State
+state = State(sys.argv[1], locking=False)
+print(state.status["StatusMessage"], flush=True)
+time.sleep(10)
+'''
+        env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+        with subprocess.Popen([sys.executable, "-c", reader, self.state_file], stdout=subprocess.PIPE, env=env, universal_newlines=True) as process:
+            try:
+                self.assertEqual(process.stdout.readline().strip(), "Created a state file")
+                state = State(self.state_file, lock_timeout=0)  # a shared lock would time out
+                state.add_event("written", status=STATE_STATUS_SUCCESS)
+                state.close()
+            finally:
+                process.kill()
+        self.assertEqual(State(self.state_file, locking=False).status["StatusMessage"], "written")
+
+    def test_retention(self):
+        state = State(self.state_file, retention={"count": 2})
+        for i in range(4):
+            state.add_event(f"event {i}")
+        state.add_event("pending", flush=False)
+        self.assertEqual([event["Message"] for event in state.query_events(limit=2)], ["pending", "event 3"])
+        state.flush()
+        self.assertEqual([event["Message"] for event in state.events], ["pending", "event 3"])
+
+    def test_migrate(self):
+        source = State(f"file://{self.dirpath}/state.json")
+        source.setup("name", "rg", {"hello": {"op": {}}})
+        source.set_hook_state("hello", "op", {"rc": 0})
+        source.add_event("done", status=STATE_STATUS_SUCCESS)
+        target = State(self.state_file)
+        self.assertTrue(target.created)
+        target.replace_with(source)
+        state = State(self.state_file, locking=False)
+        self.assertFalse(state.created)
+        self.assertEqual(state.status, source.status)
+        self.assertEqual(state.result_hooks, source.result_hooks)
+        self.assertEqual(state.events, source.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
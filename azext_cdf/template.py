@@ -0,0 +1,421 @@
+''' Jinja2 environment, compiled template and file content caching '''
+
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import ChainMap, OrderedDict
+import jinja2
+from jinja2 import Environment, FileSystemBytecodeCache, Undefined, meta, nodes
+from knack.log import get_logger
+from azext_cdf.version import VERSION
+
+_LOGGER = get_logger(__name__)
+
+TEMPLATE_CACHE_SIZE = 400
+TEMPLATE_MARKERS = ("{{", "{%", "{#")
+FILE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+BYTECODE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_DIR_ENV = "CDF_CACHE_DIR"
+BYTECODE_CACHE_DIRNAME_PREFIX = "bytecode-"
+NATIVE_RESULT = "_cdf_native_result"
+_MISSING = object()  # cache miss of entries that may be None
+
+
+def needs_rendering(source):
+    ''' Return False if rendering source through jinja2 would return it unchanged '''
+
+    if source.endswith("\n") or "\r" in source:
+        return True  # jinja2 strips trailing and normalizes newlines
+    for marker in TEMPLATE_MARKERS:
+        if marker in source:
+            return True
+    return False
+
+
+def _reference_path(node):
+    ''' Return the variable path of a Name, Getattr or constant Getitem chain, None otherwise '''
+
+    if isinstance(node, nodes.Name):
+        return (node.name,) if node.ctx == "load" else None
+    if isinstance(node, nodes.Getattr):
+        path = _reference_path(node.node)
+        return path + (node.attr,) if path else None
+    if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, (str, int)):
+        path = _reference_path(node.node)
+        return path + (node.arg.value,) if path else None
+    return None
+
+
+def _collect_references(node, references):
+    if isinstance(node, nodes.Call):
+        path = _reference_path(node.node)
+        if path and len(path) > 1:  # method call i.e. vars.a.get('b') depends on vars.a
+            references.add(path[:-1])
+            for child in (node.args, node.kwargs, node.dyn_args, node.dyn_kwargs):
+                for child_node in child if isinstance(child, list) else [child]:
+                    if child_node is not None:
+                        _collect_references(child_node, references)
+            return
+    path = _reference_path(node)
+    if path:
+        references.add(path)
+        return
+    for child_node in node.iter_child_nodes():
+        _collect_references(child_node, references)
+
+
+class TemplateCache():
+    ''' Bounded LRU cache of compiled templates or values derived from a template, keyed by source string, thread safe '''
+
+    def __init__(self, max_size=TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, source, default=None):
+        ''' Return cached entry for source or default '''
+
+        with self._lock:
+            try:
+                template = self._templates[source]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._templates.move_to_end(source)
+            self.hits += 1
+            return template
+
+    def put(self, source, template):
+        ''' Add a compiled template and evict the least recently used if needed '''
+
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._templates[source] = template
+            self._templates.move_to_end(source)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        ''' Drop all cached templates '''
+
+        with self._lock:
+            self._templates.clear()
+
+    @property
+    def stats(self):
+        ''' Return cache counters '''
+
+        return {
+            "size": len(self._templates),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class FileContentCache():
+    ''' Bounded LRU cache of file contents keyed by path, entries are invalidated when file mtime or size changes, thread safe '''
+
+    def __init__(self, max_bytes=FILE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(self, filepath):
+        ''' Return content of filepath, read from disk only if not cached or changed '''
+
+        filepath = os.path.abspath(filepath)
+        file_stat = os.stat(filepath)
+        signature = (file_stat.st_mtime_ns, file_stat.st_size)
+        with self._lock:
+            entry = self._files.get(filepath)
+            if entry is not None and entry[0] == signature:
+                self._files.move_to_end(filepath)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with open(filepath, encoding="utf-8") as in_file:  # read outside the lock
+            content = in_file.read()
+        with self._lock:
+            self._remove(filepath)
+            if file_stat.st_size <= self.max_bytes:
+                self._files[filepath] = (signature, content)
+                self._bytes += file_stat.st_size
+                while self._bytes > self.max_bytes:
+                    self._remove(next(iter(self._files)))
+                    self.evictions += 1
+        return content
+
+    def _remove(self, filepath):
+        entry = self._files.pop(filepath, None)
+        if entry is not None:
+            self._bytes -= entry[0][1]
+
+    def clear(self):
+        ''' Drop all cached files '''
+
+        with self._lock:
+            self._files.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self):
+        ''' Return cache counters '''
+
+        return {
+            "size": len(self._files),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Shared by all config objects in the process
+FILE_CACHE = FileContentCache()
+
+
+class CDFBytecodeCache(FileSystemBytecodeCache):
+    ''' Jinja2 bytecode cache on disk bounded by total bytes, oldest entries are evicted first '''
+
+    def __init__(self, directory, max_bytes=BYTECODE_CACHE_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory, pattern="%s.cache")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def load_bytecode(self, bucket):
+        try:
+            super().load_bytecode(bucket)
+        except OSError as error:
+            _LOGGER.debug("Failed to load jinja2 bytecode. %s", str(error))
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        try:
+            with tempfile.NamedTemporaryFile(mode="wb", dir=self.directory, delete=False) as out_file:
+                bucket.write_bytecode(out_file)
+            os.replace(out_file.name, filename)  # other processes never read a partial file
+            self.writes += 1
+        except OSError as error:
+            _LOGGER.debug("Failed to write jinja2 bytecode. %s", str(error))
+
+    def prune(self):
+        ''' Remove oldest entries until the cache size is within max bytes '''
+
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".cache"):
+                entry_stat = entry.stat()
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+                total += entry_stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    @property
+    def stats(self):
+        ''' Return cache counters '''
+
+        return {"directory": self.directory, "hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+
+def cdf_cache_dir():
+    ''' Return the root directory of the persistent bytecode and config caches '''
+
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "azext_cdf")
+
+
+def create_bytecode_cache(cache_dir=None, max_bytes=BYTECODE_CACHE_MAX_BYTES):
+    '''
+    Return a bytecode cache in a directory versioned by CDF and jinja2 versions, None if the cache can not be created.
+    Caches of other versions are removed.
+    '''
+
+    cache_dir = cache_dir or cdf_cache_dir()
+    dirname = f"{BYTECODE_CACHE_DIRNAME_PREFIX}cdf{VERSION}-jinja2{jinja2.__version__}"
+    try:
+        bytecode_cache = CDFBytecodeCache(os.path.join(cache_dir, dirname), max_bytes)
+        for entry in os.scandir(cache_dir):
+            if entry.is_dir() and entry.name.startswith(BYTECODE_CACHE_DIRNAME_PREFIX) and entry.name != dirname:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        bytecode_cache.prune()
+    except OSError as error:
+        _LOGGER.debug("Jinja2 bytecode cache disabled. %s", str(error))
+        return None
+    return bytecode_cache
+
+
+_BYTECODE_CACHES = {}
+_BYTECODE_CACHES_LOCK = threading.Lock()
+
+
+def shared_bytecode_cache():
+    ''' Return the process wide bytecode cache of the current cache directory, created on first use '''
+
+    cache_dir = cdf_cache_dir()
+    with _BYTECODE_CACHES_LOCK:
+        if cache_dir not in _BYTECODE_CACHES:
+            _BYTECODE_CACHES[cache_dir] = create_bytecode_cache(cache_dir)
+        return _BYTECODE_CACHES[cache_dir]
+
+
+class CDFEnvironment(Environment):
+    '''
+    Jinja2 environment that caches templates compiled by from_string in memory,
+    and in bytecode_cache if given to be reused by other processes.
+    '''
+
+    def __init__(self, *args, template_cache_size=TEMPLATE_CACHE_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.template_cache = TemplateCache(template_cache_size)
+        self._variables_cache = TemplateCache(template_cache_size)
+        self._references_cache = TemplateCache(template_cache_size)
+        self._native_cache = TemplateCache(template_cache_size)
+        self._filters_cache = TemplateCache(template_cache_size)
+
+    def from_string(self, source, globals=None, template_class=None):  # pylint: disable=redefined-builtin
+        if globals is not None or template_class is not None or not isinstance(source, str):
+            return super().from_string(source, globals=globals, template_class=template_class)
+        template = self.template_cache.get(source)
+        if template is None:
+            template = self._compile_from_string(source)
+            self.template_cache.put(source, template)
+        return template
+
+    def _compile_from_string(self, source):
+        if self.bytecode_cache is None:
+            return super().from_string(source)
+        name = hashlib.sha1(source.encode("utf-8")).hexdigest()  # one cache entry per source
+        bucket = self.bytecode_cache.get_bucket(self, name, None, source)
+        code = bucket.code
+        if code is None:
+            code = self.compile(source)
+            bucket.code = code
+            self.bytecode_cache.set_bucket(bucket)
+        return self.template_class.from_code(self, code, self.make_globals(None), None)
+
+    def render(self, source, scope, native=False):
+        '''
+        Render source with variables resolved through scope, a mapping or ChainMap of layered variables.
+        Unlike Template.render scope is not copied into a new dict.
+        If native and source is a single expression i.e. '{{ vars.tags }}' the value is returned with its type.
+        '''
+
+        expression = self.native_expression(source) if native else None
+        if expression is not None:
+            source = f"{{% set {NATIVE_RESULT} = ({expression}) %}}"
+        template = self.from_string(source)
+        layers = scope.maps if isinstance(scope, ChainMap) else [scope]
+        context = template.new_context(ChainMap(*layers, template.globals), shared=True)
+        try:
+            rendered = "".join(template.root_render_func(context))
+            if expression is None:
+                return rendered
+            value = context.vars[NATIVE_RESULT]
+            if isinstance(value, Undefined):
+                str(value)  # raises for strict undefined
+            return value
+        except Exception:  # pylint: disable=broad-except
+            return self.handle_exception()
+
+    def native_expression(self, source):
+        ''' Return the expression of source if source is a single output expression, None otherwise '''
+
+        expression = self._native_cache.get(source, _MISSING)
+        if expression is not _MISSING:
+            return expression
+        expression = None
+        stripped = source.strip()
+        body = self.parse(source).body
+        if (stripped.startswith("{{") and stripped.endswith("}}") and len(body) == 1 and isinstance(body[0], nodes.Output)
+                and len(body[0].nodes) == 1 and not isinstance(body[0].nodes[0], nodes.TemplateData)):
+            expression = stripped[2:-2]
+            if expression.startswith("-"):  # whitespace control
+                expression = expression[1:]
+            if expression.endswith("-"):
+                expression = expression[:-1]
+            expression = expression.strip()
+        self._native_cache.put(source, expression)
+        return expression
+
+    def template_variables(self, source):
+        ''' Return a frozenset of undeclared variables referenced by source '''
+
+        variables = self._variables_cache.get(source)
+        if variables is not None:
+            return variables
+        variables = frozenset(meta.find_undeclared_variables(self.parse(source)))
+        self._variables_cache.put(source, variables)
+        return variables
+
+    def template_references(self, source):
+        '''
+        Return a frozenset of variable paths referenced by source as tuples i.e. ('vars', 'a') for '{{ vars.a }}'.
+        A path of a single element means the variable is accessed dynamically. Calls to globals are included.
+        '''
+
+        references = self._references_cache.get(source)
+        if references is not None:
+            return references
+        ast = self.parse(source)
+        undeclared = meta.find_undeclared_variables(ast)
+        references = set()
+        _collect_references(ast, references)
+        references = frozenset(path for path in references if path[0] in undeclared or path[0] in self.globals)
+        self._references_cache.put(source, references)
+        return references
+
+    def template_filters(self, source):
+        ''' Return a frozenset of filter names used by source '''
+
+        filters = self._filters_cache.get(source)
+        if filters is not None:
+            return filters
+        filters = frozenset(node.name for node in self.parse(source).find_all(nodes.Filter))
+        self._filters_cache.put(source, filters)
+        return filters
+
+    @property
+    def cache_stats(self):
+        ''' Return statistics of all environment caches '''
+
+        stats = {
+            "templates": self.template_cache.stats,
+            "variables": self._variables_cache.stats,
+            "references": self._references_cache.stats,
+            "native": self._native_cache.stats,
+            "filters": self._filters_cache.stats,
+            "files": FILE_CACHE.stats,
+        }
+        if isinstance(self.bytecode_cache, CDFBytecodeCache):
+            stats["bytecode"] = self.bytecode_cache.stats
+        return stats
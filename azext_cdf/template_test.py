@@ -0,0 +1,168 @@
+''' Template test'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import BaseLoader, StrictUndefined, UndefinedError
+from azext_cdf.template import CDFEnvironment, FileContentCache, TemplateCache, CDFBytecodeCache, create_bytecode_cache
+
+# pylint: disable=C0111
+
+
+class TestTemplateCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TemplateCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # a is now most recent
+        cache.put("c", 3)  # b is evicted
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats, {"size": 2, "max_size": 2, "hits": 2, "misses": 1, "evictions": 1})
+
+    def test_disabled(self):
+        cache = TemplateCache(max_size=0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats["size"], 0)
+
+    def test_threads(self):
+        cache = TemplateCache(max_size=8)
+
+        def use(index):
+            for key in range(200):
+                if cache.get((index + key) % 32) is None:
+                    cache.put((index + key) % 32, key)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(use, range(16)))
+        stats = cache.stats
+        self.assertEqual(stats["size"], 8)
+        self.assertEqual(stats["hits"] + stats["misses"], 16 * 200)
+
+
+class TestFileContentCache(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def _write(self, name, content, mtime=None):
+        filepath = os.path.join(self.dirpath, name)
+        with open(filepath, "w") as out_file:
+            out_file.write(content)
+        if mtime:
+            os.utime(filepath, (mtime, mtime))
+        return filepath
+
+    def test_read_cached(self):
+        cache = FileContentCache()
+        filepath = self._write("a.txt", "hello", mtime=1000)
+        self.assertEqual(cache.read(filepath), "hello")
+        self.assertEqual(cache.read(filepath), "hello")
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (1, 1))
+        self._write("a.txt", "changed", mtime=2000)
+        self.assertEqual(cache.read(filepath), "changed")
+        self.assertEqual(cache.stats["bytes"], 7)
+
+    def test_eviction(self):
+        cache = FileContentCache(max_bytes=10)
+        first = self._write("a.txt", "123456")
+        second = self._write("b.txt", "123456")
+        cache.read(first)
+        cache.read(second)
+        self.assertEqual(cache.stats["size"], 1)
+        self.assertEqual(cache.stats["evictions"], 1)
+        cache.read(self._write("c.txt", "x" * 20))  # larger than the cache is not cached
+        self.assertEqual(cache.stats["size"], 1)
+
+
+class TestCDFEnvironment(unittest.TestCase):
+    def setUp(self):
+        self.env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined)
+
+    def test_from_string_cached(self):
+        template = self.env.from_string("{{ a }}")
+        self.assertIs(self.env.from_string("{{ a }}"), template)
+        self.assertEqual(template.render({"a": 1}), "1")
+        self.assertEqual(self.env.cache_stats["templates"]["hits"], 1)
+        self.assertEqual(self.env.cache_stats["templates"]["misses"], 1)
+
+    def test_globals_added_later(self):
+        template = self.env.from_string("{{ later() }}")
+        self.env.globals["later"] = lambda: "late"
+        self.assertEqual(self.env.from_string("{{ later() }}").render(), "late")
+        self.assertEqual(template.render(), "late")
+
+    def test_from_string_with_globals_not_cached(self):
+        self.env.from_string("{{ a }}", globals={"a": 1})
+        self.assertEqual(self.env.cache_stats["templates"]["size"], 0)
+
+    def test_render_scope(self):
+        self.env.globals["g"] = "global"
+        first = {"a": 1, "vars": {"x": "first"}}
+        scope = ChainMap({"a": 2}, first, {"b": 3, "g": "layer"})
+        self.assertEqual(self.env.render("{{ a }}.{{ b }}.{{ g }}.{{ vars.x }}", scope), "2.3.layer.first")
+        self.assertEqual(self.env.render("{{ g }}", first), "global")
+        self.assertEqual(first, {"a": 1, "vars": {"x": "first"}})
+
+    def test_render_native(self):
+        scope = {"vars": {"tags": {"a": "b"}, "count": 3, "name": "01"}}
+        self.assertEqual(self.env.render("{{ vars.tags }}", scope, native=True), {"a": "b"})
+        self.assertEqual(self.env.render(" {{- vars.count -}} ", scope, native=True), 3)
+        self.assertEqual(self.env.render("{{ vars.name }}", scope, native=True), "01")
+        self.assertEqual(self.env.render("{{ vars.count }}-{{ vars.name }}", scope, native=True), "3-01")
+        self.assertEqual(self.env.render("{{ vars.tags }}", scope), "{'a': 'b'}")
+        with self.assertRaises(UndefinedError):
+            self.env.render("{{ vars.missing }}", scope, native=True)
+
+    def test_analysis_caches_bounded(self):
+        env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined, template_cache_size=2)
+        for source in ("{{ a }}", "{{ b }}", "text {{ c }}", "text {{ c }}"):
+            env.template_variables(source)
+            env.template_references(source)
+            env.native_expression(source)
+        self.assertIsNone(env.native_expression("text {{ c }}"))
+        for cache in ("variables", "references", "native"):
+            self.assertEqual(env.cache_stats[cache]["size"], 2)
+            self.assertEqual(env.cache_stats[cache]["evictions"], 1)
+        self.assertEqual(env.cache_stats["native"]["hits"], 2)  # None is cached
+
+
+class TestBytecodeCache(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_shared_between_environments(self):
+        bytecode_cache = create_bytecode_cache(self.dirpath)
+        env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined, bytecode_cache=bytecode_cache)
+        self.assertEqual(env.from_string("{{ a }}!").render({"a": 1}), "1!")
+        other_env = CDFEnvironment(loader=BaseLoader, undefined=StrictUndefined, bytecode_cache=bytecode_cache)
+        self.assertEqual(other_env.from_string("{{ a }}!").render({"a": 2}), "2!")
+        self.assertEqual(other_env.cache_stats["bytecode"]["hits"], 1)
+        self.assertEqual(other_env.cache_stats["bytecode"]["writes"], 1)
+
+    def test_other_versions_removed(self):
+        os.makedirs(os.path.join(self.dirpath, "bytecode-cdf0.0.1-jinja21.0"))
+        bytecode_cache = create_bytecode_cache(self.dirpath)
+        self.assertEqual(os.listdir(self.dirpath), [os.path.basename(bytecode_cache.directory)])
+
+    def test_prune(self):
+        bytecode_cache = CDFBytecodeCache(self.dirpath, max_bytes=1)
+        env = CDFEnvironment(loader=BaseLoader, bytecode_cache=bytecode_cache)
+        env.from_string("{{ a }}")
+        env.from_string("{{ b }}")
+        self.assertEqual(len(os.listdir(self.dirpath)), 2)
+        bytecode_cache.prune()
+        self.assertEqual(len(os.listdir(self.dirpath)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
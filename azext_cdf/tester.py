@@ -90,7 +90,8 @@ def _phase_cordinator(cmd, test_cobj, func, phase_name, expect_obj, result, **kw
     failed_expection = False
     _print_x(f"  Calling '{phase_name}', expect to fail: '{expect_to_fail}'")
     try:
-        func(cmd, test_cobj, test_name, expect_obj)
+        with test_cobj.state.batch():
+            func(cmd, test_cobj, test_name, expect_obj)
         if expect_to_fail:
             result["failed"] = True  # test failed globably
             result[phase_name] = {"failed": True, "msg": "expecting to fail and did not fail"}
@@ -138,8 +139,7 @@ def _run_single_test(cmd, test_cobj, result, test_name, exit_on_error, down_stra
 
     # ** Run hook and hook expect **
     for hook in test_cobj.test_hooks(test_name=test_name):
-        expect_obj = test_cobj.get_test(test_name, hook=hook)
-        expect_obj['hook'] = hook
+        expect_obj = {**test_cobj.get_test(test_name, hook=hook), 'hook': hook}  # config is shared with forks
         hook_object = [{CONFIG_NAME: f"hook {hook}", "fail_override": expect_obj.get("fail", False), "func": _run_hook},
                        {CONFIG_NAME: f"hook {hook} expect", "fail_override": False, "func": _run_expect_tests}]
         for i in hook_object:
@@ -203,9 +203,9 @@ def _manage_git_upgrade(upgrade_config, tmp_dir, prefix_test, reuse_dir=True):
     return repo_dir_path
 
 
-def _prepera_upgrade(cmd, upgrade_config, config, working_dir, test_name, prefix):
+def _prepera_upgrade(cmd, cobj, upgrade_config, config, test_name, prefix):
     override_config = {CONFIG_STATE_FILEPATH: "file://{{ cdf.tmp_dir }}/test_" + f"{prefix}_{test_name}_state.json"}
-    test_cobj = ConfigParser(config, remove_tmp=False, working_dir=working_dir, test=test_name, override_config=override_config)
+    test_cobj = cobj.fork(test=test_name, override_config=override_config)
     upgrade_test = upgrade_config.get("from_expect")
     if upgrade_test is None:
         return test_cobj
@@ -215,11 +215,14 @@ def _prepera_upgrade(cmd, upgrade_config, config, working_dir, test_name, prefix
     override_config["tmp_dir"] = test_cobj.tmp_dir
 
     if upgrade_config.get(CONFIG_TYPE) == "local":
-        upgrade_location = upgrade_config.get("path")
+        upgrade_location = cobj.resolve_path(upgrade_config.get("path"))
     elif upgrade_config.get(CONFIG_TYPE) == "git":
         upgrade_location = _manage_git_upgrade(upgrade_config, test_cobj.tmp_dir, f"{prefix}_{test_name}", reuse_dir=True)
 
-    upgrade_cobj = ConfigParser(config, remove_tmp=False, working_dir=upgrade_location, test=upgrade_test, override_config=override_config)
+    if os.path.realpath(upgrade_location) == cobj.working_dir:
+        upgrade_cobj = cobj.fork(test=upgrade_test, override_config=override_config)
+    else:
+        upgrade_cobj = ConfigParser(config, remove_tmp=False, working_dir=upgrade_location, test=upgrade_test, override_config=override_config)
     _print_x(f"  Upgrade provisioning initial state {prefix}_{upgrade_test}")
     # TODO replace with _phase_cordinator to handle if provisioning fail
     _run_provision(cmd, upgrade_cobj, None, None)
@@ -237,7 +240,7 @@ def _upgrade_matrix(cobj, global_upgrade_strategy, test_name):
     return matrix
 
 
-def run_test(cmd, cobj, config, exit_on_error, test_args, working_dir, down_strategy, upgrade_strategy):
+def run_test(cmd, cobj, config, exit_on_error, test_args, down_strategy, upgrade_strategy):
     """ test handler function. Run all tests or specific ones """
 
     results = {}
@@ -255,7 +258,7 @@ def run_test(cmd, cobj, config, exit_on_error, test_args, working_dir, down_stra
 
             results[prefix][test_name] = {"failed": False}
             _print_x(f"Starting test: '{test_name}', upgrade path: {upgrade_title}")
-            test_cobj = _prepera_upgrade(cmd, upgrade_obj, config, working_dir, test_name, prefix)  # not sure about logic
+            test_cobj = _prepera_upgrade(cmd, cobj, upgrade_obj, config, test_name, prefix)  # not sure about logic
             _run_single_test(cmd, test_cobj, results[prefix][test_name], test_name, exit_on_error, down_strategy)
         # TODO write tests to state
     cobj.state.transition_to_phase(STATE_PHASE_TESTED)
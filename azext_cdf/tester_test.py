@@ -3,7 +3,6 @@
 import unittest
 import tempfile
 import copy
-import os
 import shutil
 import random
 import string
@@ -43,7 +42,7 @@ class TesterNoUpgrade(unittest.TestCase):
         self.config["name"] = 'test_simple_down_strategy_always'
         _read_config.return_value = self.config
         cobj = ConfigParser("/a/b/.cdf.yml")
-        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"], working_dir=os.getcwd(),
+        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"],
                           down_strategy="always", upgrade_strategy="all")
 
         assert_run_count(self, {_run_hook: 0, _run_provision: 2, _run_de_provision: 2, _run_expect_tests: 4})
@@ -69,7 +68,7 @@ class TesterNoUpgrade(unittest.TestCase):
         self.config["name"] = 'test_simple_down_strategy_success'
         _read_config.return_value = self.config
         cobj = ConfigParser("/a/b/.cdf.yml")
-        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"], working_dir=os.getcwd(),
+        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"],
                           down_strategy="success", upgrade_strategy="all")
 
         assert_run_count(self, {_run_hook: 0, _run_provision: 2, _run_de_provision: 2, _run_expect_tests: 4})
@@ -95,7 +94,7 @@ class TesterNoUpgrade(unittest.TestCase):
         self.config["name"] = 'test_simple_down_strategy_never'
         _read_config.return_value = self.config
         cobj = ConfigParser("/a/b/.cdf.yml")
-        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"], working_dir=os.getcwd(),
+        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"],
                           down_strategy="never", upgrade_strategy="all")
 
         assert_run_count(self, {_run_hook: 0, _run_provision: 2, _run_de_provision: 0, _run_expect_tests: 2})
@@ -125,7 +124,7 @@ class TesterNoUpgrade(unittest.TestCase):
         _read_config.return_value = self.config
         cobj = ConfigParser("/a/b/.cdf.yml")
         _run_provision.side_effect = CLIError("Nooo")
-        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"], working_dir=os.getcwd(),
+        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"],
                           down_strategy="always", upgrade_strategy="all")
 
         assert_run_count(self, {_run_hook: 0, _run_provision: 2, _run_de_provision: 0, _run_expect_tests: 0, de_provision: 2})
@@ -156,7 +155,7 @@ class TesterNoUpgrade(unittest.TestCase):
         cobj = ConfigParser("/a/b/.cdf.yml")
         _run_provision.side_effect = CLIError("Nooo")
         with self.assertRaises(CLIError) as context:
-            run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=True, test_args=["default", "patch"], working_dir=os.getcwd(),
+            run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=True, test_args=["default", "patch"],
                           down_strategy="always", upgrade_strategy="all")
             self.assertIn('default', context)
         assert_run_count(self, {_run_hook: 0, _run_provision: 1, _run_de_provision: 0, _run_expect_tests: 0, de_provision: 1})
@@ -164,7 +163,7 @@ class TesterNoUpgrade(unittest.TestCase):
         _run_provision.reset_mock()
         de_provision.reset_mock()
         with self.assertRaises(CLIError) as context:
-            run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=True, test_args=["default", "patch"], working_dir=os.getcwd(),
+            run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=True, test_args=["default", "patch"],
                           down_strategy="success", upgrade_strategy="all")
             self.assertIn('default', context)
         assert_run_count(self, {_run_hook: 0, _run_provision: 1, _run_de_provision: 0, _run_expect_tests: 0, de_provision: 0})
@@ -181,7 +180,7 @@ class TesterNoUpgrade(unittest.TestCase):
         self.config["name"] = 'test_simple_upgrade_strategy_only_upgrade'
         _read_config.return_value = self.config
         cobj = ConfigParser("/a/b/.cdf.yml")
-        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"], working_dir=os.getcwd(),
+        results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"],
                           down_strategy="always", upgrade_strategy="upgrade")
 
         assert_run_count(self, {_run_hook: 0, _run_provision: 0, _run_de_provision: 0, _run_expect_tests: 0})
@@ -258,7 +257,7 @@ class TestManageGitUpgrade(unittest.TestCase):
 #         self.config["name"] = 'test_simple_upgrade_strategy_only_upgrade'
 #         _read_config.return_value = self.config
 #         cobj = ConfigParser("/a/b/.cdf.yml")
-#         results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"], working_dir=os.getcwd(),
+#         results = run_test(None, cobj=cobj, config="/a/b/.cdf.yml", exit_on_error=False, test_args=["default", "patch"],
 #                           down_strategy="always", upgrade_strategy="upgrade")
 
 #         assert_run_count(self, {_run_hook: 0, _run_provision: 2, _run_de_provision: 2, _run_expect_tests: 4})
@@ -3,6 +3,8 @@
 import os
 from os import access, R_OK
 import glob
+import gzip
+import hashlib
 import json
 from json import JSONDecodeError
 import random
@@ -11,15 +13,24 @@ import shutil
 import subprocess
 import shlex
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import yaml
 from knack.log import get_logger
 from knack.util import CLIError
 import azure.cli.core.commands.progress as progress
-from azext_cdf._def import CONFIG_STATE_FILEPATH
+from azext_cdf._def import CONFIG_STATE_FILEPATH, STATE_DURABILITY_NONE, STATE_DURABILITY_FSYNC
 # from azext_cdf.parser import ConfigParser
 
 _LOGGER = get_logger(__name__)
 
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+HTTP_TIMEOUT = 30
+HTTP_GZIP_MIN_BYTES = 1024
+
+_SESSION = None
+
 
 # pylint: disable=no-self-use
 class Progress():
@@ -63,7 +74,7 @@ class Progress():
 
 
 # TODO should be refactored into parser code
-def init_config(config, config_parser, remove_tmp=False, working_dir=None, state_file=None, state_locking=True):
+def init_config(config, config_parser, remove_tmp=False, working_dir=None, state_file=None, state_locking=True, lazy=False):
     ''' return config obj and cwd'''
     cwd = os.getcwd()
     override_config = {}
@@ -71,7 +82,7 @@ def init_config(config, config_parser, remove_tmp=False, working_dir=None, state
         override_config = {
             CONFIG_STATE_FILEPATH: f"file://{state_file}",
         }
-    return config_parser(config_filepath=config, remove_tmp=remove_tmp, test=None, working_dir=working_dir, override_config=override_config, state_locking=state_locking), cwd
+    return config_parser(config_filepath=config, remove_tmp=remove_tmp, test=None, working_dir=working_dir, override_config=override_config, state_locking=state_locking, lazy=lazy), cwd
 
 
 def real_dirname(dir_path):
@@ -112,20 +123,6 @@ def dir_remove(filepath):
         raise CLIError(f"Failed to remove directory {filepath}. Error: {str(error)}") from error
 
 
-def dir_change_working(dirpath):
-    ''' Change working directory '''
-
-    if dirpath is None:
-        dirpath = os.getcwd()
-    abs_path = os.path.realpath(dirpath)
-    if not abs_path:
-        raise CLIError(f"Invalid working directory supplied {abs_path}")
-    try:
-        os.chdir(abs_path)
-    except FileNotFoundError as error:
-        raise CLIError(f"Change working dir failed. {str(error)}") from error
-
-
 def file_exists(filepath):
     ''' test if a file exists '''
 
@@ -140,49 +137,157 @@ def file_read_content(filepath):
     ''' Return content of file '''
 
     try:
-        with open(filepath, "r") as in_fh:
+        with open(filepath, "r", encoding="utf-8") as in_fh:
             return in_fh.read()
     except OSError as error:
         raise CLIError(f"Failed to read file '{filepath}'. Error: {str(error)}") from error
 
 
-def file_http_read_json_content(urlpath):
-    ''' get http content'''
+def http_session():
+    '''
+    Return the process wide HTTP session, connections are pooled per host and failed requests are retried.
+    Conditional PUTs are not retried, a retry of an applied write would fail its If-Match.
+    '''
+
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is None:
+        retries = Retry(
+            total=HTTP_RETRIES, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET", "HEAD"), raise_on_status=False
+        )
+        _SESSION = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+        _SESSION.mount("http://", adapter)
+        _SESSION.mount("https://", adapter)
+    return _SESSION
+
+
+def file_http_read_json_content(urlpath, etag=None, timeout=HTTP_TIMEOUT):
+    '''
+    Get a json document, returns (status code, content, etag).
+    Content is None if the document is not found (404) or is not modified since etag (304).
+    '''
+    headers = {"If-None-Match": etag} if etag else {}
     try:
-        resp = requests.get(urlpath)
-        return resp.json()
-    except Exception as error:
+        resp = http_session().get(urlpath, headers=headers, timeout=timeout)
+        if resp.status_code in (304, 404):
+            return resp.status_code, None, etag if resp.status_code == 304 else None
+        resp.raise_for_status()
+        return resp.status_code, resp.json(), resp.headers.get("ETag")
+    except (requests.RequestException, ValueError) as error:
         raise CLIError(f"Failed to read file '{urlpath}'. Error: {str(error)}") from error
 
 
 def file_write_content(filepath, content):
     ''' write content to a file '''
     try:
-        with open(filepath, "w") as file_in:
+        with open(filepath, "w", encoding="utf-8") as file_in:
             file_in.write(content)
     except OSError as error:
         raise CLIError(f"Failed to write file '{filepath}'. Error: {str(error)}") from error
 
 
-def file_http_write_json_content(filepath, content):
-    ''' write content do dapr endpoint'''
-    raise CLIError("http write WIP")
-    # try:
-    #     r = requests.get(filepath, json=[content])
-    # except Exception as error:
-    #     raise CLIError(f"Failed to read file '{filepath}'. Error: {str(error)}") from error
+def file_append_content(filepath, content):
+    ''' append content to a file '''
+    try:
+        with open(filepath, "a", encoding="utf-8") as file_out:
+            file_out.write(content)
+    except OSError as error:
+        raise CLIError(f"Failed to append to file '{filepath}'. Error: {str(error)}") from error
+
+
+def file_http_write_json_content(urlpath, content, etag=None, timeout=HTTP_TIMEOUT):
+    '''
+    Put a json document, returns the new etag.
+    The document is only replaced if it still matches etag, a new document is only created if none exists.
+    '''
+    body = json.dumps(content).encode("utf-8")
+    headers = {"Content-Type": "application/json", "If-Match": etag} if etag else {"Content-Type": "application/json", "If-None-Match": "*"}
+    if len(body) >= HTTP_GZIP_MIN_BYTES:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    try:
+        resp = http_session().put(urlpath, data=body, headers=headers, timeout=timeout)
+    except requests.RequestException as error:
+        raise CLIError(f"Failed to write file '{urlpath}'. Error: {str(error)}") from error
+    if resp.status_code == 412:
+        _, current, current_etag = file_http_read_json_content(urlpath, timeout=timeout)
+        if current == content:  # written by a request that failed to respond
+            return current_etag
+        raise CLIError(f"Failed to write file '{urlpath}'. It was changed by another process since it was read")
+    try:
+        resp.raise_for_status()
+    except requests.RequestException as error:
+        raise CLIError(f"Failed to write file '{urlpath}'. Error: {str(error)}") from error
+    return resp.headers.get("ETag")
 
 
 def json_write_to_file(filepath, data):
     ''' serialize data into file '''
 
     try:
-        with open(filepath, "w") as outfile:
+        with open(filepath, "w", encoding="utf-8") as outfile:
             json.dump(data, outfile)
     except OSError as error:
         raise CLIError(f"Failed to write json file '{filepath}'. Error: {str(error)}") from error
 
 
+def file_write_atomic(filepath, content, durability=STATE_DURABILITY_FSYNC):
+    '''
+    write content to a file, readers see the old or the new content but never a partial write.
+    durability 'none' writes in place, 'rename-only' renames a temp file over the file and 'fsync' also syncs file and directory to disk
+    '''
+
+    if durability == STATE_DURABILITY_NONE:
+        file_write_content(filepath, content)
+        return
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filepath, "w", encoding="utf-8") as file_out:
+            file_out.write(content)
+            if durability == STATE_DURABILITY_FSYNC:
+                file_out.flush()
+                os.fsync(file_out.fileno())
+        os.replace(tmp_filepath, filepath)
+        if durability == STATE_DURABILITY_FSYNC and hasattr(os, "O_DIRECTORY"):  # persist the rename, not supported on windows
+            dir_fd = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    except OSError as error:
+        try:
+            os.remove(tmp_filepath)
+        except OSError:
+            pass
+        raise CLIError(f"Failed to write file '{filepath}'. Error: {str(error)}") from error
+
+
+def file_backup(filepath, backup_filepath, hard_link=True):
+    ''' Replace backup_filepath with a copy of filepath, a hard link is used if supported and files are only replaced by rename '''
+
+    tmp_filepath = f"{backup_filepath}.{os.getpid()}.tmp"
+    try:
+        try:
+            if not hard_link:
+                raise OSError("hard link disabled")
+            os.link(filepath, tmp_filepath)
+        except OSError:
+            shutil.copyfile(filepath, tmp_filepath)
+        os.replace(tmp_filepath, backup_filepath)
+    except OSError as error:
+        raise CLIError(f"Failed to backup file '{filepath}'. Error: {str(error)}") from error
+
+
+def file_hash(filepath):
+    ''' Return sha256 hex digest of file content '''
+
+    try:
+        with open(filepath, "rb") as in_fh:
+            return hashlib.sha256(in_fh.read()).hexdigest()
+    except OSError as error:
+        raise CLIError(f"Failed to read file '{filepath}'. Error: {str(error)}") from error
+
+
 def json_load(content):
     ''' de serialize string content '''
     try:
@@ -0,0 +1,17 @@
+''' pytest fixtures shared by unit and integration tests '''
+
+import os
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cdf_cache_dir(tmp_path_factory):
+    ''' Keep the bytecode and config caches out of the user's home directory '''
+
+    previous = os.environ.get("CDF_CACHE_DIR")
+    os.environ["CDF_CACHE_DIR"] = str(tmp_path_factory.mktemp("cdf_cache"))
+    yield os.environ["CDF_CACHE_DIR"]
+    if previous is None:
+        os.environ.pop("CDF_CACHE_DIR", None)
+    else:
+        os.environ["CDF_CACHE_DIR"] = previous
@@ -0,0 +1,54 @@
+''' Benchmark config validation, schema library compared to compiled validator '''
+
+import argparse
+import timeit
+from schema import Schema
+from azext_cdf.parser_schema import MAIN_SCHEMA
+from azext_cdf.parser_validator import CompiledSchema
+
+
+def synthetic_config(hooks, tests):
+    ''' Return a config with number of hooks and tests '''
+
+    config = {"name": "bench", "resource_group": "rg", "location": "loc", "vars": {f"var{i}": f"{{{{ cdf.name }}}}_{i}" for i in range(50)}}
+    config["hooks"] = {
+        f"hook{i}": {
+            "description": f"hook {i}",
+            "lifecycle": "post-up",
+            "ops": [
+                {"name": "cmd", "type": "cmd", "args": ["echo", f"{i}"]},
+                {"name": "az", "type": "AZ", "args": "group list", "mode": "Wait"},
+                {"name": "print", "type": "print", "args": "{{ vars.var0 }}"},
+            ],
+        } for i in range(hooks)
+    }
+    config["upgrade"] = [{"name": f"v{i}", "type": "git", "git": {"repo": "https://example.com/repo.git", "tag": f"v{i}"}} for i in range(3)]
+    config["tests"] = {
+        f"test{i}": {
+            "description": f"test {i}",
+            "vars": {"a": i},
+            "expect": {"up": {"assert": "true"}, "down": {"cmd": "true"}, "hooks": [{f"hook{i}": {"fail": False, "assert": ["true"]}}]},
+        } for i in range(tests)
+    }
+    return config
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=__doc__)
+    args_parser.add_argument("--hooks", type=int, default=300)
+    args_parser.add_argument("--tests", type=int, default=300)
+    args_parser.add_argument("--repeat", type=int, default=5)
+    args = args_parser.parse_args()
+
+    config = synthetic_config(args.hooks, args.tests)
+    schema_obj = Schema(MAIN_SCHEMA)
+    compiled = CompiledSchema(MAIN_SCHEMA)
+    assert schema_obj.validate(config) == compiled.validate(config)
+    print(f"config with {args.hooks} hooks and {args.tests} tests, best of {args.repeat}")
+    for name, func in (("schema", schema_obj.validate), ("compiled", compiled.validate)):
+        best = min(timeit.repeat(lambda func=func: func(config), number=1, repeat=args.repeat))
+        print(f"  {name:<10} {best * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()